@@ -0,0 +1,71 @@
+"""
+Flask-Admin list pages on the favorites tables with the stock ModelView
+(exact COUNT(*), OFFSET paging) against the FastModelView from src/admin.py
+(estimated count, keyset paging). Seed a large database first, e.g.
+
+    $ python bench/seed.py --db sqlite:////tmp/admin.db --users 50000 --characters 100000 --favorites 3000000
+    $ python bench/admin_lists.py --db sqlite:////tmp/admin.db
+"""
+import argparse
+import time
+
+from common import DEFAULT_DB, load_app, summarize, time_calls, print_table, save_results, compare
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=DEFAULT_DB, help="seeded database url (see bench/seed.py)")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--output", help="where to write the JSON results")
+    parser.add_argument("--compare", help="previous results file to compare with")
+    args = parser.parse_args()
+
+    app = load_app(args.db, {"ENABLE_ADMIN": True})
+    from flask_admin.contrib.sqla import ModelView
+    from admin import FavoriteCharacterView, FavoritePlanetView
+    from models import db, FavoriteCharacter, FavoritePlanet
+
+    admin = app.extensions["admin"][0]
+    for model, fast_view in ((FavoriteCharacter, FavoriteCharacterView), (FavoritePlanet, FavoritePlanetView)):
+        name = model.__tablename__.replace("_", "")
+        # Same filters as the fast view, so the filtered pages compare the paging and counting only
+        stock = type(f"Stock{model.__name__}View", (ModelView,), {
+            "page_size": fast_view.page_size, "column_display_pk": True,
+            "column_filters": fast_view.column_filters,
+        })
+        admin.add_view(stock(model, db.session, endpoint=f"stock_{name}", url=f"/admin/stock/{name}"))
+
+    client = app.test_client()
+    results = []
+    with app.app_context():
+        for model in (FavoriteCharacter, FavoritePlanet):
+            name = model.__tablename__.replace("_", "")
+            rows = db.session.query(db.func.max(model.id)).scalar() or 0
+            deep_page = max(0, int(rows * 0.9) // FavoriteCharacterView.page_size)
+            deep_after = deep_page * FavoriteCharacterView.page_size
+            user_id = db.session.query(model.user_id).order_by(model.id).limit(1).scalar() or 1
+            pages = {
+                "first page": ("", ""),
+                "90% deep": (f"?page={deep_page}", f"?page={deep_page}&after={deep_after}"),
+                "user filter": (f"?flt0_0={user_id}", f"?flt0_0={user_id}"),
+            }
+            for label, (stock_query, fast_query) in pages.items():
+                for kind, url in (("stock", f"/admin/stock/{name}/{stock_query}"),
+                                  ("fast", f"/admin/{name}/{fast_query}")):
+                    def call(i):
+                        response = client.get(url)
+                        assert response.status_code == 200, (url, response.status_code)
+                    call(0)  # warm up templates and caches
+                    latencies, elapsed = time_calls(call, args.iterations)
+                    results.append(summarize(f"{name} {label} {kind}", latencies, elapsed, {"rows": rows}))
+
+    print_table(results)
+    save_results("admin_lists", results,
+                 {"db": args.db, "iterations": args.iterations, "started": time.time()},
+                 args.output)
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == "__main__":
+    main()
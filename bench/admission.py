@@ -0,0 +1,90 @@
+"""
+Overload with and without ADMISSION_CONTROL. Every client logs in as its own
+seeded user and sends a mix of cached reads (/people, /planets, /people/<id>),
+an uncached read (/users) and favorite writes. The clients together send a
+fixed number of requests per second (--rps), whether or not the server keeps
+up, so past its capacity an open server piles up a queue. Latencies are those
+of the requests that were served, the ones turned away with 429/503 are
+counted as shed.
+
+gthread runs with twice --max-concurrency threads, the spare ones only
+answer 503s instead of leaving requests waiting for a thread.
+
+    $ python bench/admission.py --profile gthread --rps 150 300 600 --max-concurrency 8
+"""
+import argparse
+import sys
+import time
+
+from common import DEFAULT_DB, print_table, save_results, compare
+from load import start_server, stop_server, load_result
+from group_commit import login
+
+PORT = 3558
+
+
+def mixed_paths(clients):
+    paths = []
+    for n in range(1, clients * 4 + 1):
+        paths += [("GET", "/people?limit=100"), ("GET", "/planets?limit=100"), ("GET", f"/people/{n}"),
+                  ("GET", "/users?limit=200"), ("POST", f"/favorite/planet/{n}"), ("DELETE", f"/favorite/planet/{n}")]
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=DEFAULT_DB, help="seeded database url (see bench/seed.py)")
+    parser.add_argument("--profile", default="gthread", choices=["gthread", "gevent"])
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--rps", type=int, nargs="+", default=[150, 300, 600],
+                        help="requests per second sent by all the clients together")
+    parser.add_argument("--clients", type=int, default=128,
+                        help="client threads, each one is a different seeded user")
+    parser.add_argument("--rate", type=float, default=20, help="ADMISSION_RATE, tokens per second per client")
+    parser.add_argument("--burst", type=float, default=40, help="ADMISSION_BURST")
+    parser.add_argument("--max-concurrency", type=int, default=16, help="ADMISSION_MAX_CONCURRENCY, shared by the workers")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per run")
+    parser.add_argument("--output", help="where to write the JSON results")
+    parser.add_argument("--compare", help="previous results file to compare with")
+    args = parser.parse_args()
+
+    base_url = f"http://127.0.0.1:{PORT}"
+    command = [sys.executable, "-m", "gunicorn", "wsgi", "-c", "gunicorn.conf.py",
+               "-b", f"127.0.0.1:{PORT}", "--backlog", "2048"]
+    results, tokens = [], None
+    for mode, enabled in (("open", "0"), ("admission", "1")):
+        env = {
+            "GUNICORN_PROFILE": args.profile, "WEB_CONCURRENCY": str(args.workers),
+            "GUNICORN_THREADS": str(args.max_concurrency * 2), "API_ONLY": "1",
+            "ADMISSION_CONTROL": enabled, "ADMISSION_RATE": str(args.rate),
+            "ADMISSION_BURST": str(args.burst), "ADMISSION_MAX_CONCURRENCY": str(args.max_concurrency),
+        }
+        process = start_server(command, args.db, PORT, env)
+        try:
+            # Once, with admission off: the logins all come from this address
+            # and would go through its bucket. The tokens outlive the server.
+            tokens = tokens or login(base_url, args.clients)
+            for rps in args.rps:
+                results.append(load_result(
+                    f"{mode} {rps} rps", base_url, mixed_paths(args.clients), args.clients, args.duration,
+                    headers=lambda worker: {"Authorization": "Bearer " + tokens[worker]}, rate=rps,
+                ))
+        finally:
+            stop_server(process)
+
+    print_table(results)
+    print()
+    for r in results:
+        print(f"{r['name']:<40} {r['shed']:>7} shed {r['errors']:>7} errors")
+
+    save_results("admission", results,
+                 {"db": args.db, "profile": args.profile, "workers": args.workers, "clients": args.clients,
+                  "rate": args.rate, "burst": args.burst, "max_concurrency": args.max_concurrency,
+                  "duration": args.duration, "started": time.time()},
+                 args.output)
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Head to head between the gunicorn sync workers from the Procfile (src/wsgi.py)
+and the async ASGI app (src/asgi.py) under uvicorn, on the same database and
+the same read routes, at increasing client concurrency.
+
+    $ python bench/async_vs_sync.py --workers 3 --concurrency 10 50 200
+"""
+import argparse
+import sys
+import time
+
+from common import DEFAULT_DB, print_table, save_results, compare
+from load import start_server, stop_server, load_result
+
+PORT = 3555
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=DEFAULT_DB, help="seeded database url (see bench/seed.py)")
+    parser.add_argument("--workers", type=int, default=3, help="gunicorn sync workers")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[10, 50, 200])
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per run")
+    parser.add_argument("--max-id", type=int, default=10000)
+    parser.add_argument("--output", help="where to write the JSON results")
+    parser.add_argument("--compare", help="previous results file to compare with")
+    args = parser.parse_args()
+
+    paths = ["/people?limit=50", "/planets?limit=50", "/users/favorites"]
+    paths += [f"/people/{i}" for i in range(1, args.max_id, max(1, args.max_id // 50))]
+    modes = {
+        "sync": [sys.executable, "-m", "gunicorn", "wsgi", "-w", str(args.workers),
+                 "-b", f"127.0.0.1:{PORT}", "--backlog", "2048"],
+        "async": [sys.executable, "-m", "uvicorn", "asgi:app", "--port", str(PORT),
+                  "--log-level", "warning", "--backlog", "2048"],
+    }
+
+    results = []
+    for mode, command in modes.items():
+        process = start_server(command, args.db, PORT)
+        try:
+            for concurrency in args.concurrency:
+                results.append(load_result(f"{mode} c={concurrency}", f"http://127.0.0.1:{PORT}",
+                                           paths, concurrency, args.duration))
+        finally:
+            stop_server(process)
+
+    print_table(results)
+    save_results("async_vs_sync", results,
+                 {"db": args.db, "workers": args.workers, "duration": args.duration, "started": time.time()},
+                 args.output)
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == "__main__":
+    main()
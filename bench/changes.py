@@ -0,0 +1,103 @@
+"""
+What a client that keeps a copy of the catalog reads to catch up: the full
+/people and /planets lists, page by page, against /changes?since=<seq> after
+a given number of characters and planets were renamed. The full download
+grows with the catalog, the delta with the number of changes.
+
+    $ python bench/seed.py --db sqlite:////tmp/bench.db --characters 100000 --planets 100000
+    $ python bench/changes.py --db sqlite:////tmp/bench.db --changes 10 100 1000
+
+The renames go through the session like the app's writes, so they are
+logged, and are undone at the end (which leaves their entries in the log).
+"""
+import argparse
+import time
+
+from common import DEFAULT_DB, load_app, summarize, time_calls, print_table, save_results, compare
+
+
+def download(client, url, next_url):
+    # Follows the pages like a client would, returns the bytes read
+    size = 0
+    while url:
+        response = client.get(url)
+        assert response.status_code == 200, (url, response.status_code)
+        size += len(response.data)
+        url = next_url(response.get_json())
+    return size
+
+
+def full_lists(client, page_size):
+    def next_page(path):
+        return lambda body: body["next"] and f"{path}?limit={page_size}&after={body['next']}"
+    return (download(client, f"/people?limit={page_size}", next_page("/people"))
+            + download(client, f"/planets?limit={page_size}", next_page("/planets")))
+
+
+def delta(client, since, page_size):
+    return download(client, f"/changes?since={since}&limit={page_size}",
+                    lambda body: body["more"] and f"/changes?since={body['next']}&limit={page_size}")
+
+
+def rename(db, models, count, suffix):
+    # Half characters, half planets
+    for model in models:
+        rows = db.session.execute(db.select(model).order_by(model.id).limit(count // len(models))).scalars()
+        for row in rows:
+            row.name = row.name.removesuffix(" (renamed)") + suffix
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=DEFAULT_DB, help="seeded database url (see bench/seed.py)")
+    parser.add_argument("--changes", type=int, nargs="+", default=[10, 100, 1000],
+                        help="rows changed since the client's last sync")
+    parser.add_argument("--page-size", type=int, default=1000, help="limit of every request")
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--output", help="where to write the JSON results")
+    parser.add_argument("--compare", help="previous results file to compare with")
+    args = parser.parse_args()
+
+    app = load_app(args.db)
+    from models import db, Character, Planet
+    from changes import head
+
+    client = app.test_client()
+    results = []
+    with app.app_context():
+        # Seeded databases may predate the change log
+        db.create_all()
+        rows = db.session.query(Character).count() + db.session.query(Planet).count()
+
+        sizes = []
+        latencies, elapsed = time_calls(lambda i: sizes.append(full_lists(client, args.page_size)), args.iterations)
+        results.append(summarize("full lists", latencies, elapsed, {"rows": rows, "bytes": sizes[0]}))
+
+        try:
+            for count in args.changes:
+                since = head()
+                rename(db, (Character, Planet), count, " (renamed)")
+                sizes = []
+                latencies, elapsed = time_calls(lambda i: sizes.append(delta(client, since, args.page_size)),
+                                                args.iterations)
+                results.append(summarize(f"changes, {count} changed", latencies, elapsed,
+                                         {"rows": rows, "bytes": sizes[0]}))
+        finally:
+            rename(db, (Character, Planet), max(args.changes), "")
+
+    print_table(results)
+    print()
+    for r in results:
+        print(f"{r['name']:<40} {r['bytes']:>12} bytes")
+
+    save_results("changes", results,
+                 {"db": args.db, "changes": args.changes, "page_size": args.page_size,
+                  "iterations": args.iterations, "started": time.time()},
+                 args.output)
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == "__main__":
+    main()
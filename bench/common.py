@@ -0,0 +1,84 @@
+"""
+Shared helpers for the benchmark scripts: loading the app against a given
+database, timing calls and writing the results as JSON.
+"""
+import json
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+DEFAULT_DB = "sqlite:////tmp/bench.db"
+
+
+def load_app(database_url, config=None):
+    os.environ["DATABASE_URL"] = database_url
+    if SRC_DIR not in sys.path:
+        sys.path.insert(0, SRC_DIR)
+    from app import create_app
+    return create_app(config)
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(name, latencies, elapsed, extra=None):
+    latencies = sorted(latencies)
+    result = {
+        "name": name,
+        "requests": len(latencies),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+    }
+    if extra:
+        result.update(extra)
+    return result
+
+
+def time_calls(fn, iterations):
+    latencies = []
+    start = time.perf_counter()
+    for i in range(iterations):
+        t0 = time.perf_counter()
+        fn(i)
+        latencies.append(time.perf_counter() - t0)
+    return latencies, time.perf_counter() - start
+
+
+def print_table(results):
+    print(f"{'name':<40} {'reqs':>7} {'rps':>10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for r in results:
+        print(f"{r['name']:<40} {r['requests']:>7} {r['throughput_rps']:>10} "
+              f"{r['p50_ms']:>9} {r['p95_ms']:>9} {r['p99_ms']:>9}")
+
+
+def save_results(kind, results, meta, output=None):
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        output = os.path.join(RESULTS_DIR, f"{kind}-{stamp}.json")
+    with open(output, "w") as f:
+        json.dump({"kind": kind, "meta": meta, "results": results}, f, indent=2)
+    print(f"\nResults saved to {output}")
+    return output
+
+
+def compare(old_path, results):
+    with open(old_path) as f:
+        old = {r["name"]: r for r in json.load(f)["results"]}
+    print(f"\nCompared with {old_path}:")
+    for r in results:
+        before = old.get(r["name"])
+        if before is None or not before["throughput_rps"]:
+            continue
+        change = (r["throughput_rps"] - before["throughput_rps"]) / before["throughput_rps"] * 100
+        print(f"  {r['name']:<40} rps {before['throughput_rps']} -> {r['throughput_rps']} ({change:+.1f}%)"
+              f"  p99 {before['p99_ms']} -> {r['p99_ms']} ms")
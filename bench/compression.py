@@ -0,0 +1,67 @@
+"""
+Bytes on the wire and latency of the catalog lists for each encoding:
+
+  identity  no Accept-Encoding, the plain JSON body
+  gzip/br   compressed once, then served from the compressed body cache
+  uncached  same encoding with the cache emptied before every request, so
+            each one queries, serializes and compresses again
+
+    $ python bench/compression.py --limit 100 1000 --iterations 200
+"""
+import argparse
+import time
+
+from common import DEFAULT_DB, load_app, summarize, time_calls, print_table, save_results, compare
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=DEFAULT_DB, help="seeded database url (see bench/seed.py)")
+    parser.add_argument("--limit", type=int, nargs="+", default=[100, 1000], help="page sizes to request")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--output", help="where to write the JSON results")
+    parser.add_argument("--compare", help="previous results file to compare with")
+    args = parser.parse_args()
+
+    app = load_app(args.db)
+    from compression import brotli, compressed_cache
+    client = app.test_client()
+    encodings = ["identity", "gzip"] + (["br"] if brotli is not None else [])
+
+    def request(path, encoding, clear=False):
+        def call(i):
+            if clear:
+                compressed_cache.clear()
+            response = client.get(path, headers={"Accept-Encoding": encoding})
+            sizes.append(len(response.data))
+        return call
+
+    results = []
+    for resource in ("people", "planets"):
+        for limit in args.limit:
+            path = f"/{resource}?limit={limit}"
+            for encoding in encodings:
+                runs = [(encoding, False)]
+                if encoding != "identity":
+                    runs.append((f"{encoding} uncached", True))
+                for name, clear in runs:
+                    sizes = []
+                    call = request(path, encoding, clear)
+                    call(0)  # warm up
+                    latencies, elapsed = time_calls(call, args.iterations)
+                    results.append(summarize(f"{path} {name}", latencies, elapsed, {"bytes": sizes[-1]}))
+
+    print_table(results)
+    print()
+    for r in results:
+        print(f"{r['name']:<40} {r['bytes']:>9} bytes")
+
+    save_results("compression", results,
+                 {"db": args.db, "iterations": args.iterations, "started": time.time()},
+                 args.output)
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == "__main__":
+    main()
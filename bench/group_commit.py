@@ -0,0 +1,90 @@
+"""
+Favorite writes per second with one commit per request against
+FAVORITE_GROUP_COMMIT, on the gthread profile so each worker serves
+requests concurrently. Every client logs in as its own seeded user and
+adds favorites, then removes them again.
+
+    $ python bench/group_commit.py --workers 2 --threads 32 --concurrency 16 64
+"""
+import argparse
+import json
+import sys
+import time
+
+from common import DEFAULT_DB, print_table, save_results, compare
+from load import start_server, stop_server, load_result
+from run import HttpClient
+
+PORT = 3557
+ITEMS_PER_CLIENT = 50
+
+
+def login(base_url, users):
+    client = HttpClient(base_url)
+    tokens = []
+    for i in range(1, users + 1):
+        status, body = client.open("/login", method="POST",
+                                   json_body={"email": f"user{i}@example.com", "password": "test"})
+        if status != 200:
+            raise SystemExit("Could not log in, seed the database with bench/seed.py first")
+        tokens.append(json.loads(body)["access_token"])
+    return tokens
+
+
+def write_paths(concurrency):
+    # Client n sends requests n, n + concurrency, ... so with the adds and the
+    # removes in two halves of the same length, every client deletes exactly
+    # the favorites it added and every request writes.
+    items = range(1, concurrency * ITEMS_PER_CLIENT + 1)
+    return ([("POST", f"/favorite/people/{i}") for i in items]
+            + [("DELETE", f"/favorite/people/{i}") for i in items])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=DEFAULT_DB, help="seeded database url (see bench/seed.py)")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[16, 64],
+                        help="client threads, each one is a different seeded user")
+    parser.add_argument("--window-ms", type=float, default=2)
+    parser.add_argument("--max-ops", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per run")
+    parser.add_argument("--output", help="where to write the JSON results")
+    parser.add_argument("--compare", help="previous results file to compare with")
+    args = parser.parse_args()
+
+    base_url = f"http://127.0.0.1:{PORT}"
+    command = [sys.executable, "-m", "gunicorn", "wsgi", "-c", "gunicorn.conf.py",
+               "-b", f"127.0.0.1:{PORT}", "--backlog", "2048"]
+    results = []
+    for mode, enabled in (("per request", "0"), ("group commit", "1")):
+        env = {
+            "GUNICORN_PROFILE": "gthread", "WEB_CONCURRENCY": str(args.workers),
+            "GUNICORN_THREADS": str(args.threads), "API_ONLY": "1",
+            "FAVORITE_GROUP_COMMIT": enabled, "GROUP_COMMIT_WINDOW_MS": str(args.window_ms),
+            "GROUP_COMMIT_MAX_OPS": str(args.max_ops),
+        }
+        process = start_server(command, args.db, PORT, env)
+        try:
+            tokens = login(base_url, max(args.concurrency))
+            for concurrency in args.concurrency:
+                results.append(load_result(
+                    f"{mode} c={concurrency}", base_url, write_paths(concurrency), concurrency, args.duration,
+                    headers=lambda worker: {"Authorization": "Bearer " + tokens[worker]},
+                ))
+        finally:
+            stop_server(process)
+
+    print_table(results)
+    save_results("group_commit", results,
+                 {"db": args.db, "workers": args.workers, "threads": args.threads,
+                  "window_ms": args.window_ms, "max_ops": args.max_ops,
+                  "duration": args.duration, "started": time.time()},
+                 args.output)
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Concurrent HTTP load against a running server, shared by the benchmarks that
+compare serving modes. Every client thread sends requests back to back for
+a fixed time and records the latency of each one. Responses turned away by
+admission control (429/503 with Retry-After) are counted as shed, apart
+from the latencies.
+"""
+import http.client
+import os
+import signal
+import subprocess
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+from common import SRC_DIR, summarize
+
+
+def wait_until_up(url, timeout=20):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(url, timeout=1).read()
+            return True
+        except Exception:
+            time.sleep(0.2)
+    return False
+
+
+def start_server(command, database_url, port, extra_env=None):
+    env = dict(os.environ, DATABASE_URL=database_url, **(extra_env or {}))
+    process = subprocess.Popen(command, cwd=SRC_DIR, env=env, start_new_session=True,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    if not wait_until_up(f"http://127.0.0.1:{port}/people?limit=1"):
+        stop_server(process)
+        raise RuntimeError(f"server did not start: {' '.join(command)}")
+    return process
+
+
+def stop_server(process):
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=10)
+    except Exception:
+        os.killpg(process.pid, signal.SIGKILL)
+
+
+def run_load(base_url, paths, concurrency, duration, method="GET", headers=None, rate=None):
+    # `paths` items are a path, or a (method, path) pair to mix methods.
+    # `headers(worker)` gives the headers of each client thread, e.g. its own login.
+    # With `rate` the clients together send that many requests per second
+    # whatever the server does, instead of each one waiting for its last
+    # answer, and latency counts from when the request was due.
+    parsed = urllib.parse.urlparse(base_url)
+    latencies, errors, shed = [], [], []
+    lock = threading.Lock()
+    start = time.perf_counter()
+    stop_at = start + duration
+
+    def client(worker):
+        conn = http.client.HTTPConnection(parsed.hostname, parsed.port, timeout=30)
+        mine, failed, turned_away, i = [], 0, 0, worker
+        sent_headers = headers(worker) if headers else {}
+        while time.perf_counter() < stop_at:
+            path = paths[i % len(paths)]
+            verb = method
+            if isinstance(path, tuple):
+                verb, path = path
+            t0 = time.perf_counter()
+            if rate:
+                t0 = start + i / rate
+                if t0 > stop_at:
+                    break
+                time.sleep(max(0.0, t0 - time.perf_counter()))
+            i += concurrency
+            try:
+                conn.request(verb, path, headers=sent_headers)
+                res = conn.getresponse()
+                res.read()
+                if res.status in (429, 503) and res.getheader("Retry-After"):
+                    turned_away += 1
+                    continue
+                if res.status >= 500:
+                    failed += 1
+            except Exception:
+                failed += 1
+                conn.close()
+                conn = http.client.HTTPConnection(parsed.hostname, parsed.port, timeout=30)
+                continue
+            mine.append(time.perf_counter() - t0)
+        conn.close()
+        with lock:
+            latencies.extend(mine)
+            errors.append(failed)
+            shed.append(turned_away)
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencies, time.perf_counter() - start, sum(errors), sum(shed)
+
+
+def load_result(name, base_url, paths, concurrency, duration, method="GET", headers=None, rate=None):
+    latencies, elapsed, errors, shed = run_load(base_url, paths, concurrency, duration, method, headers, rate)
+    return summarize(name, latencies, elapsed, {"concurrency": concurrency, "errors": errors, "shed": shed})
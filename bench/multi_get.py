@@ -0,0 +1,70 @@
+"""
+A favorites screen with N items: one GET /people/<id> per item against one
+GET /people?ids=... and one POST /people/batch, over HTTP to gunicorn on one
+keep-alive connection. Latencies are per screen, all its requests included.
+
+    $ python bench/multi_get.py --items 10 50 200
+"""
+import argparse
+import http.client
+import json
+import random
+import sys
+import time
+
+from common import DEFAULT_DB, summarize, time_calls, print_table, save_results, compare
+from load import start_server, stop_server
+
+PORT = 3559
+
+
+def request(conn, method, path, body=None):
+    headers = {"Content-Type": "application/json"} if body is not None else {}
+    conn.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+    response = conn.getresponse()
+    response.read()
+    assert response.status == 200, (method, path, response.status)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=DEFAULT_DB, help="seeded database url (see bench/seed.py)")
+    parser.add_argument("--profile", default="gthread", choices=["sync", "gthread", "gevent"])
+    parser.add_argument("--items", type=int, nargs="+", default=[10, 50, 200], help="items on the screen")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--output", help="where to write the JSON results")
+    parser.add_argument("--compare", help="previous results file to compare with")
+    args = parser.parse_args()
+
+    command = [sys.executable, "-m", "gunicorn", "wsgi", "-c", "gunicorn.conf.py", "-b", f"127.0.0.1:{PORT}"]
+    process = start_server(command, args.db, PORT,
+                           {"GUNICORN_PROFILE": args.profile, "WEB_CONCURRENCY": "1", "API_ONLY": "1"})
+    results = []
+    try:
+        conn = http.client.HTTPConnection("127.0.0.1", PORT, timeout=30)
+        rng = random.Random(42)
+        for count in args.items:
+            screens = [rng.sample(range(1, 1001), count) for _ in range(args.iterations)]
+            runs = {
+                "one per item": lambda i: [request(conn, "GET", f"/people/{id}") for id in screens[i]],
+                "?ids=": lambda i: request(conn, "GET", "/people?ids=" + ",".join(map(str, screens[i]))),
+                "POST batch": lambda i: request(conn, "POST", "/people/batch", {"ids": screens[i]}),
+            }
+            for name, run in runs.items():
+                run(0)  # warm up
+                latencies, elapsed = time_calls(run, args.iterations)
+                results.append(summarize(f"{count} items, {name}", latencies, elapsed, {"items": count}))
+    finally:
+        stop_server(process)
+
+    print_table(results)
+    save_results("multi_get", results,
+                 {"db": args.db, "profile": args.profile, "items": args.items,
+                  "iterations": args.iterations, "started": time.time()},
+                 args.output)
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == "__main__":
+    main()
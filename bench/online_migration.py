@@ -0,0 +1,184 @@
+"""
+A backfill over favorite_character through migrations/online.py against the
+same change as one UPDATE, on a seeded database with millions of favorites.
+While each one runs, a writer adds and removes a favorite in a loop, like
+the app would, and records how long every commit takes.
+
+The online backfill is killed (SIGKILL) partway through and started again,
+then the script checks that every row was filled, and that the second run
+only did the ranges the first one had not committed.
+
+    $ python bench/seed.py --db sqlite:////tmp/admin.db --users 50000 --characters 100000 --favorites 3000000
+    $ python bench/online_migration.py --db sqlite:////tmp/admin.db --kill-at 0.4
+
+The scratch columns it adds to favorite_character are dropped at the end.
+The resume itself is tested on a small table in tests/test_online_backfill.py,
+this measures what the writers see on a big one.
+"""
+import argparse
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import time
+
+import sqlalchemy as sa
+
+from common import DEFAULT_DB, summarize, print_table, save_results, compare
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "migrations"))
+import online  # noqa: E402
+
+NAME = "bench"
+CHECKPOINT = f"backfill:favorite_character:{NAME}"
+ONLINE_SQL = ("UPDATE favorite_character SET bench_online = user_id + character_id "
+              "WHERE id > :low AND id <= :high")
+ONE_SHOT_SQL = "UPDATE favorite_character SET bench_one_shot = user_id + character_id"
+
+
+class Writer(threading.Thread):
+    """Adds and removes one favorite per transaction until stopped."""
+
+    def __init__(self, engine):
+        super().__init__()
+        self.engine = engine
+        self.latencies = []
+        self.stop = threading.Event()
+
+    def run(self):
+        with self.engine.connect() as connection:
+            with connection.begin():
+                user_id, character_id = connection.execute(sa.text(
+                    "SELECT max(user_id), max(character_id) FROM favorite_character")).one()
+            while not self.stop.is_set():
+                t0 = time.perf_counter()
+                with connection.begin():
+                    connection.execute(sa.text(
+                        "INSERT INTO favorite_character (user_id, character_id) VALUES (:u, :c)"),
+                        {"u": user_id, "c": character_id + 1})
+                with connection.begin():
+                    connection.execute(sa.text(
+                        "DELETE FROM favorite_character WHERE user_id = :u AND character_id = :c"),
+                        {"u": user_id, "c": character_id + 1})
+                self.latencies.append(time.perf_counter() - t0)
+                time.sleep(0.01)
+
+
+def one_update(engine):
+    with engine.begin() as connection:
+        connection.execute(sa.text(ONE_SHOT_SQL))
+
+
+def while_writing(engine, fn):
+    writer = Writer(engine)
+    writer.start()
+    start = time.perf_counter()
+    try:
+        result = fn()
+    finally:
+        elapsed = time.perf_counter() - start
+        writer.stop.set()
+        writer.join()
+    return result, elapsed, writer.latencies
+
+
+def position(engine):
+    with engine.connect() as connection:
+        return connection.execute(sa.text("SELECT position, total FROM checkpoint WHERE name = :name"),
+                                  {"name": CHECKPOINT}).one_or_none()
+
+
+def killed_backfill(engine, args):
+    def child():
+        engine.dispose(close=False)
+        online.backfill(NAME, "favorite_character", ONLINE_SQL, args.batch_size, args.pause, bind=engine)
+
+    process = multiprocessing.get_context("fork").Process(target=child)
+    process.start()
+    while process.is_alive():
+        state = position(engine)
+        if state is not None and state[0] >= state[1] * args.kill_at:
+            os.kill(process.pid, signal.SIGKILL)
+            break
+        time.sleep(0.05)
+    process.join()
+    return position(engine)[0]
+
+
+def cleanup(engine):
+    columns = {c["name"] for c in sa.inspect(engine).get_columns("favorite_character")}
+    with engine.begin() as connection:
+        for column in ("bench_online", "bench_one_shot"):
+            if column in columns:
+                connection.execute(sa.text(f"ALTER TABLE favorite_character DROP COLUMN {column}"))
+        connection.execute(sa.text("DELETE FROM checkpoint WHERE name = :name"), {"name": CHECKPOINT})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=DEFAULT_DB, help="seeded database url (see bench/seed.py)")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--pause", type=float, default=0.01, help="seconds between batches")
+    parser.add_argument("--kill-at", type=float, default=0.4, help="fraction done when the first run is killed")
+    parser.add_argument("--output", help="where to write the JSON results")
+    parser.add_argument("--compare", help="previous results file to compare with")
+    args = parser.parse_args()
+
+    # Long enough for the writer to wait out the one shot UPDATE on SQLite
+    engine = sa.create_engine(args.db, connect_args={"timeout": 600} if args.db.startswith("sqlite") else {})
+    cleanup(engine)
+    with engine.begin() as connection:
+        connection.execute(sa.text("ALTER TABLE favorite_character ADD COLUMN bench_online INTEGER"))
+        connection.execute(sa.text("ALTER TABLE favorite_character ADD COLUMN bench_one_shot INTEGER"))
+        rows = connection.execute(sa.text("SELECT count(*) FROM favorite_character")).scalar()
+
+    results = []
+    try:
+        runs = [
+            ("one UPDATE", lambda: one_update(engine)),
+            ("online, killed", lambda: killed_backfill(engine, args)),
+            ("online, resumed", lambda: online.backfill(NAME, "favorite_character", ONLINE_SQL,
+                                                        args.batch_size, args.pause, bind=engine)),
+        ]
+        returned = []
+        for name, run in runs:
+            # Latencies are the writer's commits while the change runs
+            result, elapsed, latencies = while_writing(engine, run)
+            returned.append(result)
+            results.append(summarize(name, latencies, elapsed, {
+                "rows": rows, "seconds": round(elapsed, 2),
+                "max_ms": round(max(latencies, default=0) * 1000, 3),
+            }))
+        _, killed_at, resumed = returned
+
+        with engine.connect() as connection:
+            total = position(engine)[1]
+            missing = connection.execute(sa.text(
+                "SELECT count(*) FROM favorite_character WHERE id <= :total "
+                "AND (bench_online IS NULL OR bench_online != user_id + character_id)"), {"total": total}).scalar()
+            left = connection.execute(sa.text(
+                "SELECT count(*) FROM favorite_character WHERE id > :low AND id <= :total"),
+                {"low": killed_at, "total": total}).scalar()
+    finally:
+        cleanup(engine)
+
+    print_table(results)
+    print()
+    for r in results:
+        print(f"{r['name']:<40} {r['seconds']:>8} s, slowest writer commit {r['max_ms']} ms")
+    print(f"\nKilled after id {killed_at} of {total}, the second run updated {resumed} rows "
+          f"({left} were left), {missing} rows missing or wrong")
+    if missing or resumed != left:
+        raise SystemExit("The backfill did not resume where it stopped")
+
+    save_results("online_migration", results,
+                 {"db": args.db, "batch_size": args.batch_size, "pause": args.pause,
+                  "kill_at": args.kill_at, "killed_at": killed_at, "started": time.time()},
+                 args.output)
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+Run every route once with the query budget enforced and print how many SQL
+statements each one ran against its pinned budget in src/query_budget.py.
+Exits with status 1 if any route goes over, so it can run in CI.
+
+    $ python bench/query_counts.py
+"""
+import argparse
+import sys
+
+from common import DEFAULT_DB, load_app
+from run import routes, auth_headers, TestClient
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=DEFAULT_DB, help="seeded database url (see bench/seed.py)")
+    args = parser.parse_args()
+
+    app = load_app(args.db)
+    from flask import g, request
+    from query_budget import QueryBudgetExceeded, budget_for
+
+    last = {}
+
+    @app.before_request
+    def record_budget():
+        last["budget"] = budget_for(request.endpoint)
+
+    @app.after_request
+    def record_count(response):
+        last["queries"] = len(g.get("query_budget_statements", []))
+        return response
+
+    client = app.test_client()
+    # Logging in also warms up the user cache, like any client past its first request
+    headers = auth_headers(TestClient(app))
+    client.get("/users/favorites", headers=headers)
+    app.config["QUERY_BUDGET_RAISE"] = True
+    failed = False
+    print(f"{'route':<40} {'status':>6} {'queries':>8} {'budget':>7}")
+    for name, method, path, body in routes(1):
+        last.clear()
+        try:
+            res = client.open(path(0), method=method, json=body, headers=headers)
+            status, used = res.status_code, last.get("queries", "?")
+        except QueryBudgetExceeded as e:
+            failed = True
+            status, used = "FAIL", f">{last['budget']}"
+            print(e, file=sys.stderr)
+        print(f"{name:<40} {status:>6} {used:>8} {last.get('budget', '?'):>7}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Check the read/write routing locally with two SQLite files standing in for
+the primary and a read replica. Both get the same schema but different
+character names, so every response shows which database served it.
+
+    $ python bench/replica_check.py
+"""
+import os
+import sys
+
+from werkzeug.security import generate_password_hash
+from common import SRC_DIR
+
+PRIMARY = "/tmp/primary.db"
+REPLICA = "/tmp/replica.db"
+
+
+def main():
+    for path in (PRIMARY, REPLICA):
+        if os.path.exists(path):
+            os.remove(path)
+    os.environ["DATABASE_URL"] = f"sqlite:///{PRIMARY}"
+    os.environ["DATABASE_REPLICA_URLS"] = f"sqlite:///{REPLICA}"
+    sys.path.insert(0, SRC_DIR)
+    from app import create_app
+    app = create_app()
+    from models import db, User, Character
+
+    with app.app_context():
+        for bind in (None, "replica_0"):
+            engine = db.engines[bind]
+            db.metadata.create_all(engine)
+            with engine.begin() as conn:
+                where = "primary" if bind is None else "replica"
+                conn.execute(User.__table__.insert(), [{"id": 1, "username": "u", "email": "test",
+                                                       "password": generate_password_hash("test"), "is_active": True}])
+                conn.execute(Character.__table__.insert(), [{"id": 1, "name": f"Luke from {where}"}])
+
+    client = app.test_client()
+    checks = []
+
+    def check(label, ok):
+        checks.append(ok)
+        print(f"[{'ok' if ok else 'FAIL'}] {label}")
+
+    token = client.post("/login", json={"email": "test", "password": "test"}).get_json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    res = client.get("/people/1")
+    check("GET reads from the replica", "replica" in res.get_json()["character"]["name"])
+
+    res = client.post("/favorite/people/1", headers=headers)
+    check("POST writes to the primary", res.status_code == 200)
+    with app.app_context():
+        primary_favs = db.engines[None].connect().exec_driver_sql("SELECT COUNT(*) FROM favorite_character").scalar()
+        replica_favs = db.engines["replica_0"].connect().exec_driver_sql("SELECT COUNT(*) FROM favorite_character").scalar()
+    check("the favorite only exists on the primary", primary_favs == 1 and replica_favs == 0)
+
+    res = client.get("/users/favorites", headers=headers)
+    check("the next GET sticks to the primary (read your writes)",
+          len(res.get_json()["result"]["people"]) == 1)
+
+    fresh = app.test_client()
+    res = fresh.get("/users/favorites", headers=headers)
+    check("another client keeps reading from the replica", res.get_json()["result"]["people"] == [])
+
+    sys.exit(0 if all(checks) else 1)
+
+
+if __name__ == "__main__":
+    main()
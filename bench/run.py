@@ -0,0 +1,140 @@
+"""
+Drive every route of src/app.py and report throughput and p50/p95/p99
+latency per endpoint. Seed the database first with bench/seed.py.
+
+    $ python bench/run.py                         # Flask test client, in process
+    $ python bench/run.py --url http://127.0.0.1:3000   # a running gunicorn
+    $ python bench/run.py --compare bench/results/routes-<stamp>.json
+"""
+import argparse
+import json
+import time
+import urllib.error
+import urllib.request
+
+from common import DEFAULT_DB, load_app, summarize, time_calls, print_table, save_results, compare
+
+
+class HttpClient:
+    """Tiny stand-in for the Flask test client that talks to a live server."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip("/")
+
+    def open(self, path, method="GET", json_body=None, headers=None):
+        data = json.dumps(json_body).encode() if json_body is not None else None
+        req = urllib.request.Request(self.base_url + path, data=data, method=method, headers=headers or {})
+        if data is not None:
+            req.add_header("Content-Type", "application/json")
+        try:
+            with urllib.request.urlopen(req) as res:
+                return res.status, res.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+
+class TestClient:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def open(self, path, method="GET", json_body=None, headers=None):
+        res = self.client.open(path, method=method, json=json_body, headers=headers)
+        return res.status_code, res.get_data()
+
+
+# One of the users created by bench/seed.py
+LOGIN = {"email": "user1@example.com", "password": "test"}
+
+
+def auth_headers(client):
+    status, body = client.open("/login", method="POST", json_body=LOGIN)
+    if status != 200:
+        raise SystemExit("Could not log in, seed the database with bench/seed.py first")
+    return {"Authorization": "Bearer " + json.loads(body)["access_token"]}
+
+
+# Ids per ?ids= / batch request, a page worth of cards
+BATCH_IDS = 50
+
+
+def id_list(i, max_id):
+    return [(i + k) % max_id + 1 for k in range(BATCH_IDS)]
+
+
+def routes(max_id):
+    # (name, method, path builder, body)
+    batch = {"ids": id_list(0, max_id)}
+    return [
+        ("GET /", "GET", lambda i: "/", None),
+        ("GET /metrics", "GET", lambda i: "/metrics", None),
+        ("GET /users", "GET", lambda i: "/users", None),
+        ("GET /people", "GET", lambda i: "/people", None),
+        ("GET /people?after=deep", "GET", lambda i: f"/people?after={max(0, max_id - 200)}", None),
+        ("GET /people?ids=", "GET", lambda i: "/people?ids=" + ",".join(map(str, id_list(i, max_id))), None),
+        ("POST /people/batch", "POST", lambda i: "/people/batch", batch),
+        ("GET /people/<id>", "GET", lambda i: f"/people/{i % max_id + 1}", None),
+        ("GET /people/search?q=", "GET", lambda i: f"/people/search?q={i % max_id + 1}", None),
+        ("GET /people/popular", "GET", lambda i: "/people/popular", None),
+        ("GET /planets", "GET", lambda i: "/planets", None),
+        ("POST /planets/batch", "POST", lambda i: "/planets/batch", batch),
+        ("GET /planets/<id>", "GET", lambda i: f"/planets/{i % max_id + 1}", None),
+        ("GET /planets/search?q=", "GET", lambda i: f"/planets/search?q=net {i % max_id + 1}", None),
+        ("GET /planets/popular", "GET", lambda i: "/planets/popular", None),
+        ("GET /users/favorites", "GET", lambda i: "/users/favorites", None),
+        ("POST /favorite/people/<id>", "POST", lambda i: f"/favorite/people/{i % max_id + 1}", None),
+        ("DELETE /favorite/people/<id>", "DELETE", lambda i: f"/favorite/people/{i % max_id + 1}", None),
+        ("POST /favorite/planet/<id>", "POST", lambda i: f"/favorite/planet/{i % max_id + 1}", None),
+        ("DELETE /favorite/planet/<id>", "DELETE", lambda i: f"/favorite/planet/{i % max_id + 1}", None),
+        # Only the head of the log, then a client catching up from the start
+        ("GET /changes", "GET", lambda i: "/changes", None),
+        ("GET /changes?since=0", "GET", lambda i: "/changes?since=0", None),
+        ("POST /login", "POST", lambda i: "/login", LOGIN),
+    ]
+
+
+def run(client, iterations, max_id, only=None):
+    results = []
+    headers = auth_headers(client)
+    for name, method, path, body in routes(max_id):
+        if only and only not in name:
+            continue
+        statuses = {}
+
+        def call(i):
+            status, _ = client.open(path(i), method=method, json_body=body, headers=headers)
+            statuses[status] = statuses.get(status, 0) + 1
+
+        client.open(path(0), method=method, json_body=body, headers=headers)  # warm up
+        latencies, elapsed = time_calls(call, iterations)
+        results.append(summarize(name, latencies, elapsed, {"statuses": statuses}))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=DEFAULT_DB, help="database url for the in-process mode")
+    parser.add_argument("--url", help="benchmark a running server instead of the Flask test client")
+    parser.add_argument("--iterations", type=int, default=200, help="requests per endpoint")
+    parser.add_argument("--max-id", type=int, default=10000, help="highest seeded character/planet id")
+    parser.add_argument("--only", help="only run endpoints whose name contains this text")
+    parser.add_argument("--output", help="where to write the JSON results")
+    parser.add_argument("--compare", help="previous results file to compare with")
+    args = parser.parse_args()
+
+    if args.url:
+        client = HttpClient(args.url)
+    else:
+        client = TestClient(load_app(args.db))
+
+    started = time.time()
+    results = run(client, args.iterations, args.max_id, args.only)
+    print_table(results)
+    meta = {"db": None if args.url else args.db, "url": args.url, "iterations": args.iterations,
+            "max_id": args.max_id, "started": started}
+    save_results("routes", results, meta, args.output)
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == "__main__":
+    main()
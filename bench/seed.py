@@ -0,0 +1,95 @@
+"""
+Fill a database with synthetic data using the schema from src/models.py.
+
+    $ python bench/seed.py --characters 1000000 --planets 1000000 --favorites 1000000
+"""
+import argparse
+import random
+import time
+
+from werkzeug.security import generate_password_hash
+from common import DEFAULT_DB, load_app
+
+BATCH_SIZE = 10000
+
+
+def insert_batches(table, rows, total):
+    from models import db
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= BATCH_SIZE:
+            db.session.execute(table.insert(), batch)
+            batch = []
+    if batch:
+        db.session.execute(table.insert(), batch)
+    db.session.commit()
+    print(f"  {table.name}: {total} rows")
+
+
+def unique_pairs(users, items, count, rng):
+    # Favorites are unique per (user, item), draw until we have enough pairs
+    count = min(count, users * items)
+    seen = set()
+    while len(seen) < count:
+        pair = (rng.randint(1, users), rng.randint(1, items))
+        if pair not in seen:
+            seen.add(pair)
+            yield pair
+
+
+def seed(database_url, users, characters, planets, favorites, seed_value=42):
+    app = load_app(database_url)
+    from models import db, User, Character, Planet, FavoriteCharacter, FavoritePlanet
+    from models import CharacterPopularity, PlanetPopularity
+    from search import ensure_search_index
+    rng = random.Random(seed_value)
+
+    with app.app_context():
+        db.drop_all()
+        for table in ("character_fts", "planet_fts"):
+            db.session.execute(db.text(f"DROP TABLE IF EXISTS {table}"))
+        db.create_all()
+        start = time.perf_counter()
+        # Bulk inserts skip the model's hashing. One hash for everyone, scrypt
+        # takes a tenth of a second per call.
+        password = generate_password_hash("test")
+        insert_batches(User.__table__, ({
+            "id": i, "username": f"user{i}", "email": f"user{i}@example.com",
+            "password": password, "is_active": True,
+        } for i in range(1, users + 1)), users)
+        insert_batches(Character.__table__, ({"id": i, "name": f"Character {i}"}
+                                             for i in range(1, characters + 1)), characters)
+        insert_batches(Planet.__table__, ({"id": i, "name": f"Planet {i}"}
+                                          for i in range(1, planets + 1)), planets)
+        insert_batches(FavoriteCharacter.__table__, ({"user_id": u, "character_id": c}
+                                                     for u, c in unique_pairs(users, characters, favorites, rng)),
+                       min(favorites, users * characters))
+        insert_batches(FavoritePlanet.__table__, ({"user_id": u, "planet_id": p}
+                                                  for u, p in unique_pairs(users, planets, favorites, rng)),
+                       min(favorites, users * planets))
+        # Bulk inserts skip the session, count the favorites like "flask rebuild-popularity"
+        for counter in (CharacterPopularity, PlanetPopularity):
+            counter.rebuild(db.session.connection())
+        # The FTS5 search tables normally come from the migration
+        for table in (Character.__tablename__, Planet.__tablename__):
+            ensure_search_index(db.session.connection(), table)
+        db.session.commit()
+        print(f"Seeded in {time.perf_counter() - start:.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=DEFAULT_DB, help="SQLAlchemy database url (default: %(default)s)")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--characters", type=int, default=10000)
+    parser.add_argument("--planets", type=int, default=10000)
+    parser.add_argument("--favorites", type=int, default=10000,
+                        help="rows for each of the favorite tables")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    seed(args.db, args.users, args.characters, args.planets, args.favorites, args.seed)
+
+
+if __name__ == "__main__":
+    main()
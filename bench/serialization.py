@@ -0,0 +1,67 @@
+"""
+Compare the two ways of turning rows into a JSON response body:
+
+  orm       Model.query ... .all(), obj.serialize() per row, then jsonify
+  projected only the serialize_fields columns, rows encoded with orjson
+
+    $ python bench/serialization.py --rows 1000 --iterations 200
+"""
+import argparse
+import time
+
+from common import DEFAULT_DB, load_app, summarize, time_calls, print_table, save_results, compare
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=DEFAULT_DB, help="seeded database url (see bench/seed.py)")
+    parser.add_argument("--rows", type=int, default=1000, help="rows per response")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--output", help="where to write the JSON results")
+    parser.add_argument("--compare", help="previous results file to compare with")
+    args = parser.parse_args()
+
+    app = load_app(args.db)
+    from flask import jsonify
+    from models import Character, Planet, User
+    from serializers import json_response, project, rows_as_dicts
+
+    def orm_path(model):
+        def call(i):
+            items = model.query.order_by(model.id).limit(args.rows).all()
+            jsonify({"msg": "Ok", "result": [item.serialize() for item in items]}).get_data()
+        return call
+
+    def projected_path(model):
+        def call(i):
+            rows = project(model.query, model).order_by(model.id).limit(args.rows).all()
+            json_response({"msg": "Ok", "result": rows_as_dicts(model, rows)}).get_data()
+        return call
+
+    results = []
+    with app.test_request_context():
+        for model in (Character, Planet, User):
+            for name, path in (("orm", orm_path), ("projected", projected_path)):
+                call = path(model)
+                call(0)  # warm up
+                latencies, elapsed = time_calls(call, args.iterations)
+                results.append(summarize(f"{model.__tablename__} {name}", latencies, elapsed,
+                                         {"rows_per_call": args.rows}))
+
+    print_table(results)
+    by_name = {r["name"]: r for r in results}
+    for model in (Character, Planet, User):
+        orm = by_name[f"{model.__tablename__} orm"]["throughput_rps"]
+        fast = by_name[f"{model.__tablename__} projected"]["throughput_rps"]
+        if orm:
+            print(f"{model.__tablename__}: projected path is {fast / orm:.2f}x the throughput of the orm path")
+
+    save_results("serialization", results,
+                 {"db": args.db, "rows": args.rows, "iterations": args.iterations, "started": time.time()},
+                 args.output)
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Cold start of a worker: time to import the app module, build the app with
+create_app() and serve the first request, with every optional component
+(admin, migrations, swagger) and with API_ONLY=1. Each run is a fresh
+Python process, like a new gunicorn worker on a cold instance.
+
+    $ python bench/startup.py --runs 10
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from common import DEFAULT_DB, SRC_DIR, save_results, compare
+
+PROBE = """
+import json, time
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+application = app.create_app()
+t2 = time.perf_counter()
+application.test_client().get("/people?limit=1")
+t3 = time.perf_counter()
+print(json.dumps({"import": t1 - t0, "create_app": t2 - t1, "first_request": t3 - t2, "total": t3 - t0}))
+"""
+
+PROFILES = {
+    "full": {"API_ONLY": "0"},
+    "api_only": {"API_ONLY": "1"},
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=DEFAULT_DB, help="seeded database url (see bench/seed.py)")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--output", help="where to write the JSON results")
+    parser.add_argument("--compare", help="previous results file to compare with")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'profile':<10} {'import ms':>10} {'create_app ms':>14} {'1st request ms':>15} {'total ms':>9}")
+    for name, env in PROFILES.items():
+        samples = []
+        for _ in range(args.runs):
+            out = subprocess.run([sys.executable, "-c", PROBE], cwd=SRC_DIR, check=True, capture_output=True, text=True,
+                                 env=dict(os.environ, DATABASE_URL=args.db, **env))
+            samples.append(json.loads(out.stdout.strip().splitlines()[-1]))
+        median = {key: round(statistics.median(s[key] for s in samples) * 1000, 2) for key in samples[0]}
+        print(f"{name:<10} {median['import']:>10} {median['create_app']:>14} "
+              f"{median['first_request']:>15} {median['total']:>9}")
+        # Shaped like the other results so --compare works on it
+        results.append({"name": name, "requests": args.runs, "throughput_rps": round(1000 / median["total"], 2),
+                        "p50_ms": median["total"], "p95_ms": None, "p99_ms": None, "median_ms": median})
+
+    save_results("startup", results, {"db": args.db, "runs": args.runs, "started": time.time()}, args.output)
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == "__main__":
+    main()
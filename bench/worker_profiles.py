@@ -0,0 +1,59 @@
+"""
+Compare the gunicorn worker profiles from src/gunicorn.conf.py (sync,
+gthread, gevent) on the same database, routes and client concurrency.
+
+    $ python bench/worker_profiles.py --workers 3 --concurrency 10 100
+"""
+import argparse
+import importlib.util
+import sys
+import time
+
+from common import DEFAULT_DB, print_table, save_results, compare
+from load import start_server, stop_server, load_result
+
+PORT = 3556
+PROFILES = ["sync", "gthread", "gevent"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=DEFAULT_DB, help="seeded database url (see bench/seed.py)")
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--profiles", nargs="+", default=PROFILES, choices=PROFILES)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[10, 100])
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per run")
+    parser.add_argument("--max-id", type=int, default=10000)
+    parser.add_argument("--output", help="where to write the JSON results")
+    parser.add_argument("--compare", help="previous results file to compare with")
+    args = parser.parse_args()
+
+    paths = ["/people?limit=50", "/planets?limit=50", "/people/search?q=12"]
+    paths += [f"/people/{i}" for i in range(1, args.max_id, max(1, args.max_id // 50))]
+
+    results = []
+    for profile in args.profiles:
+        if profile == "gevent" and importlib.util.find_spec("gevent") is None:
+            print("gevent is not installed, skipping that profile")
+            continue
+        command = [sys.executable, "-m", "gunicorn", "wsgi", "-c", "gunicorn.conf.py",
+                   "-b", f"127.0.0.1:{PORT}", "--backlog", "2048"]
+        env = {"GUNICORN_PROFILE": profile, "WEB_CONCURRENCY": str(args.workers)}
+        process = start_server(command, args.db, PORT, env)
+        try:
+            for concurrency in args.concurrency:
+                results.append(load_result(f"{profile} c={concurrency}", f"http://127.0.0.1:{PORT}",
+                                           paths, concurrency, args.duration))
+        finally:
+            stop_server(process)
+
+    print_table(results)
+    save_results("worker_profiles", results,
+                 {"db": args.db, "workers": args.workers, "duration": args.duration, "started": time.time()},
+                 args.output)
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == "__main__":
+    main()
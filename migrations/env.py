@@ -1,6 +1,9 @@
 from __future__ import with_statement
 
+import fnmatch
 import logging
+import os
+import sys
 from logging.config import fileConfig
 
 from flask import current_app
@@ -16,6 +19,9 @@ config = context.config
 fileConfig(config.config_file_name)
 logger = logging.getLogger('alembic.env')
 
+# So the migrations can `from online import ...` (migrations/online.py)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
 # add your model's MetaData object here
 # for 'autogenerate' support
 # from myapp import mymodel
@@ -32,6 +38,21 @@ target_db = current_app.extensions['migrate'].db
 # ... etc.
 
 
+# Made with raw SQL by the name search migrations (d0a7c35f8e21, 1e5c9a7b3d62),
+# there is nothing in the models for them: the FTS5 tables on SQLite with
+# their shadow tables (character_fts_data, ...), the pg_trgm and "C" collation
+# indexes on Postgres. Autogenerate would drop them otherwise.
+UNMODELED = {
+    'table': ('character_fts*', 'planet_fts*'),
+    'index': ('ix_character_name_trgm', 'ix_planet_name_trgm',
+              'ix_character_name_lower_c', 'ix_planet_name_lower_c'),
+}
+
+
+def include_name(name, type_, parent_names):
+    return not any(fnmatch.fnmatch(name, pattern) for pattern in UNMODELED.get(type_, ()))
+
+
 def get_metadata():
     if hasattr(target_db, 'metadatas'):
         return target_db.metadatas[None]
@@ -52,7 +73,8 @@ def run_migrations_offline():
     """
     url = config.get_main_option("sqlalchemy.url")
     context.configure(
-        url=url, target_metadata=get_metadata(), literal_binds=True
+        url=url, target_metadata=get_metadata(), literal_binds=True,
+        include_name=include_name
     )
 
     with context.begin_transaction():
@@ -84,6 +106,10 @@ def run_migrations_online():
             connection=connection,
             target_metadata=get_metadata(),
             process_revision_directives=process_revision_directives,
+            include_name=include_name,
+            # Each migration commits on its own, online.py commits halfway
+            # through the ones that build indexes concurrently or backfill
+            transaction_per_migration=True,
             **current_app.extensions['migrate'].configure_args
         )
 
@@ -0,0 +1,173 @@
+"""
+Helpers for migrations on big tables, that keep the app writing while they run.
+
+    from online import create_index, drop_index, backfill
+
+create_index() and drop_index() use CREATE/DROP INDEX CONCURRENTLY on
+Postgres, which doesn't block writes to the table, and are plain index
+operations elsewhere. Both can run again after a crash.
+
+backfill() runs a data change one primary key range at a time, each range in
+its own short transaction together with its checkpoint (a `backfill:` row in
+the checkpoint table). If the migration dies halfway, `flask db upgrade`
+carries on after the last committed range. Watch it with
+`flask migration-progress`.
+
+Backfills commit as they go, so keep them in a migration of their own, after
+the one that adds the columns, and have the app write the new columns for
+new rows before they start: only the rows that exist when a backfill starts
+are visited.
+"""
+import logging
+import os
+import time
+import sqlalchemy as sa
+from alembic import op
+
+logger = logging.getLogger("alembic.online")
+
+DEFAULT_BATCH_SIZE = int(os.getenv("BACKFILL_BATCH_SIZE", 1000))
+# Seconds to wait between batches, gives the app's writes room on the table
+DEFAULT_PAUSE = float(os.getenv("BACKFILL_PAUSE", 0.05))
+BATCH_ATTEMPTS = 5
+LOCK_TIMEOUT = "5s"
+LOG_INTERVAL = 10
+
+checkpoint = sa.table(
+    "checkpoint",
+    sa.column("name", sa.String), sa.column("position", sa.BigInteger),
+    sa.column("total", sa.BigInteger), sa.column("updated_at", sa.DateTime),
+    sa.column("started_at", sa.DateTime), sa.column("finished_at", sa.DateTime),
+)
+
+
+def is_postgres(bind):
+    return bind.dialect.name == "postgresql"
+
+
+def create_index(index_name, table_name, columns, unique=False, **kw):
+    bind = op.get_bind()
+    if not is_postgres(bind):
+        op.create_index(index_name, table_name, columns, unique=unique, if_not_exists=True, **kw)
+        return
+    # CONCURRENTLY can't run inside a transaction
+    with op.get_context().autocommit_block():
+        valid = bind.execute(
+            sa.text("SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+                    "WHERE c.relname = :name"),
+            {"name": index_name},
+        ).scalar()
+        if valid is False:
+            # Left behind by a concurrent build that failed, IF NOT EXISTS would keep it
+            logger.info("Dropping the invalid index %s", index_name)
+            op.drop_index(index_name, table_name=table_name, postgresql_concurrently=True)
+        op.create_index(index_name, table_name, columns, unique=unique, if_not_exists=True,
+                        postgresql_concurrently=True, **kw)
+
+
+def drop_index(index_name, table_name):
+    bind = op.get_bind()
+    if not is_postgres(bind):
+        op.drop_index(index_name, table_name=table_name, if_exists=True)
+        return
+    with op.get_context().autocommit_block():
+        op.drop_index(index_name, table_name=table_name, if_exists=True, postgresql_concurrently=True)
+
+
+def backfill(name, table_name, statement, batch_size=None, pause=None, bind=None):
+    """Run `statement` over `table_name` one primary key range at a time.
+
+    `statement` is SQL with :low and :high parameters, and must only touch
+    the rows with low < key <= high, e.g.
+
+        backfill("character_slug", "character",
+                 "UPDATE character SET slug = lower(name) WHERE id > :low AND id <= :high")
+
+    BACKFILL_BATCH_SIZE and BACKFILL_PAUSE override the defaults. `bind` is
+    an Engine, to run it outside of a migration.
+    """
+    batch_size = batch_size or DEFAULT_BATCH_SIZE
+    pause = DEFAULT_PAUSE if pause is None else pause
+    if bind is not None:
+        return run_backfill(bind, name, table_name, statement, batch_size, pause)
+    # Commits what the migration did so far, the batches then run on
+    # connections of their own
+    with op.get_context().autocommit_block():
+        return run_backfill(op.get_bind().engine, name, table_name, statement, batch_size, pause)
+
+
+def primary_key(connection, table_name):
+    columns = sa.inspect(connection).get_pk_constraint(table_name)["constrained_columns"]
+    if len(columns) != 1:
+        raise ValueError(f"backfill needs a single column primary key, {table_name} has {columns}")
+    return columns[0]
+
+
+def start(connection, key, table_name):
+    # The rows that exist now, the app takes care of the ones written later
+    low, high = connection.execute(
+        sa.text(f'SELECT min("{key}"), max("{key}") FROM "{table_name}"')
+    ).one()
+    return (low - 1 if low is not None else 0), (high or 0)
+
+
+def run_backfill(engine, name, table_name, statement, batch_size, pause):
+    checkpoint_name = f"backfill:{table_name}:{name}"
+    statement = sa.text(statement)
+    with engine.connect() as connection:
+        with connection.begin():
+            key = primary_key(connection, table_name)
+            state = connection.execute(
+                sa.select(checkpoint.c.position, checkpoint.c.total, checkpoint.c.finished_at)
+                .where(checkpoint.c.name == checkpoint_name)
+            ).one_or_none()
+            if state is None:
+                position, total = start(connection, key, table_name)
+                connection.execute(checkpoint.insert().values(
+                    name=checkpoint_name, position=position, total=total,
+                    started_at=sa.func.now(), updated_at=sa.func.now(),
+                ))
+            else:
+                position, total, finished_at = state
+                if finished_at is not None:
+                    logger.info("Backfill %s already finished", name)
+                    return 0
+                logger.info("Resuming backfill %s after %s %s", name, table_name, position)
+
+        rows, began = 0, time.perf_counter()
+        logged = began
+        while position < total:
+            high = min(position + batch_size, total)
+            rows += run_batch(connection, statement, checkpoint_name, position, high)
+            position = high
+            if time.perf_counter() - logged > LOG_INTERVAL:
+                logged = time.perf_counter()
+                logger.info("Backfill %s: %s/%s %s, %.0f rows/s", name, position, total, key,
+                            rows / (time.perf_counter() - began))
+            if pause:
+                time.sleep(pause)
+
+        with connection.begin():
+            connection.execute(checkpoint.update().where(checkpoint.c.name == checkpoint_name)
+                               .values(finished_at=sa.func.now(), updated_at=sa.func.now()))
+        logger.info("Backfill %s done, %s rows in %.1fs", name, rows, time.perf_counter() - began)
+        return rows
+
+
+def run_batch(connection, statement, checkpoint_name, low, high):
+    for attempt in range(BATCH_ATTEMPTS):
+        try:
+            with connection.begin():
+                if is_postgres(connection):
+                    # Give up on a lock the app holds instead of queueing the app behind us
+                    connection.execute(sa.text(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'"))
+                rows = connection.execute(statement, {"low": low, "high": high}).rowcount
+                # Same transaction, so a range is never applied twice
+                connection.execute(checkpoint.update().where(checkpoint.c.name == checkpoint_name)
+                                   .values(position=high, updated_at=sa.func.now()))
+            return max(rows, 0)
+        except sa.exc.OperationalError:
+            # Lock timeout on Postgres, busy database on SQLite
+            if attempt == BATCH_ATTEMPTS - 1:
+                raise
+            time.sleep(0.1 * 2 ** attempt)
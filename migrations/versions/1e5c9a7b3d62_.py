@@ -0,0 +1,37 @@
+"""name prefix indexes in the C collation on Postgres
+
+Revision ID: 1e5c9a7b3d62
+Revises: 6b8f2d4e9a15
+Create Date: 2026-10-18 19:41:06.552914
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1e5c9a7b3d62'
+down_revision = '6b8f2d4e9a15'
+branch_labels = None
+depends_on = None
+
+TABLES = ('character', 'planet')
+
+
+def upgrade():
+    # search.py matches prefixes with LIKE on lower(name) COLLATE "C", which
+    # can use a btree index whatever the database's collation is. SQLite
+    # keeps using ix_<table>_name_lower.
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    from online import create_index
+    for table in TABLES:
+        create_index(f'ix_{table}_name_lower_c', table, [sa.text('lower(name) COLLATE "C"')])
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    from online import drop_index
+    for table in TABLES:
+        drop_index(f'ix_{table}_name_lower_c', table)
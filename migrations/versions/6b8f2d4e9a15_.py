@@ -0,0 +1,51 @@
+"""hash the user passwords
+
+Revision ID: 6b8f2d4e9a15
+Revises: c91d3a6e5b27
+Create Date: 2026-10-18 19:04:47.118305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from werkzeug.security import generate_password_hash
+
+
+# revision identifiers, used by Alembic.
+revision = '6b8f2d4e9a15'
+down_revision = 'c91d3a6e5b27'
+branch_labels = None
+depends_on = None
+
+user = sa.table('user', sa.column('id', sa.Integer), sa.column('password', sa.String))
+# Same as models.PASSWORD_HASH_METHODS, revisions don't import the models
+PASSWORD_HASH_METHODS = ('scrypt:', 'pbkdf2:')
+BATCH_SIZE = 500
+
+
+def upgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.alter_column('password',
+               existing_type=sa.String(length=80),
+               type_=sa.String(length=256),
+               existing_nullable=False)
+
+    # The hashing runs in Python, so backfill() and its SQL ranges don't fit.
+    # Rows already hashed are skipped, a rerun after a failure is harmless.
+    bind = op.get_bind()
+    last = 0
+    while True:
+        rows = bind.execute(sa.select(user.c.id, user.c.password).where(user.c.id > last)
+                            .order_by(user.c.id).limit(BATCH_SIZE)).all()
+        if not rows:
+            break
+        for user_id, password in rows:
+            if not password.startswith(PASSWORD_HASH_METHODS):
+                bind.execute(user.update().where(user.c.id == user_id)
+                             .values(password=generate_password_hash(password)))
+        last = rows[-1].id
+
+
+def downgrade():
+    # A hash can't be turned back into the password: the rows stay hashed, and
+    # the column wide enough for them. Older code can't log these users in.
+    pass
@@ -0,0 +1,41 @@
+"""unique indexes on favorites
+
+Revision ID: 8d41e6a0b7c2
+Revises: 3f9b2c7d1e4a
+Create Date: 2026-10-18 11:04:52.118734
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d41e6a0b7c2'
+down_revision = '3f9b2c7d1e4a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Keep the oldest row of every duplicated favorite so the unique indexes can be built
+    op.execute(
+        "DELETE FROM favorite_character WHERE id NOT IN "
+        "(SELECT MIN(id) FROM favorite_character GROUP BY user_id, character_id)"
+    )
+    op.execute(
+        "DELETE FROM favorite_planet WHERE id NOT IN "
+        "(SELECT MIN(id) FROM favorite_planet GROUP BY user_id, planet_id)"
+    )
+    with op.batch_alter_table('favorite_character', schema=None) as batch_op:
+        batch_op.create_index('ix_favorite_character_user_id_character_id', ['user_id', 'character_id'], unique=True)
+
+    with op.batch_alter_table('favorite_planet', schema=None) as batch_op:
+        batch_op.create_index('ix_favorite_planet_user_id_planet_id', ['user_id', 'planet_id'], unique=True)
+
+
+def downgrade():
+    with op.batch_alter_table('favorite_planet', schema=None) as batch_op:
+        batch_op.drop_index('ix_favorite_planet_user_id_planet_id')
+
+    with op.batch_alter_table('favorite_character', schema=None) as batch_op:
+        batch_op.drop_index('ix_favorite_character_user_id_character_id')
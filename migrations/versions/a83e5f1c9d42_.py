@@ -0,0 +1,32 @@
+"""favorite item indexes for the admin filters
+
+Revision ID: a83e5f1c9d42
+Revises: f4c1a9e27b30
+Create Date: 2026-10-18 16:32:10.271804
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a83e5f1c9d42'
+down_revision = 'f4c1a9e27b30'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Imported here and not at the top: `flask db heads` and `history` load
+    # the revisions without env.py, which puts migrations/ on sys.path
+    from online import create_index
+    # CONCURRENTLY on Postgres, the favorite tables are the big ones and a
+    # plain CREATE INDEX would hold off their writes for the whole build
+    create_index('ix_favorite_character_character_id', 'favorite_character', ['character_id'], unique=False)
+    create_index('ix_favorite_planet_planet_id', 'favorite_planet', ['planet_id'], unique=False)
+
+
+def downgrade():
+    from online import drop_index
+    drop_index('ix_favorite_planet_planet_id', 'favorite_planet')
+    drop_index('ix_favorite_character_character_id', 'favorite_character')
@@ -0,0 +1,60 @@
+"""name search indexes
+
+Revision ID: d0a7c35f8e21
+Revises: b62f0d9e5a13
+Create Date: 2026-10-18 14:02:44.093215
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd0a7c35f8e21'
+down_revision = 'b62f0d9e5a13'
+branch_labels = None
+depends_on = None
+
+TABLES = ('character', 'planet')
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    for table in TABLES:
+        op.create_index(f'ix_{table}_name_lower', table, [sa.text('lower(name)')], unique=False)
+
+    if dialect == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        for table in TABLES:
+            op.execute(f'CREATE INDEX ix_{table}_name_trgm ON "{table}" USING gin (name gin_trgm_ops)')
+
+    elif dialect == 'sqlite':
+        # FTS5 with the trigram tokenizer, kept in sync with the table by triggers
+        for table in TABLES:
+            fts = f'{table}_fts'
+            op.execute(f"CREATE VIRTUAL TABLE {fts} USING fts5(name, content='{table}', content_rowid='id', tokenize='trigram')")
+            op.execute(f"CREATE TRIGGER {fts}_ai AFTER INSERT ON {table} BEGIN "
+                       f"INSERT INTO {fts}(rowid, name) VALUES (new.id, new.name); END")
+            op.execute(f"CREATE TRIGGER {fts}_ad AFTER DELETE ON {table} BEGIN "
+                       f"INSERT INTO {fts}({fts}, rowid, name) VALUES ('delete', old.id, old.name); END")
+            op.execute(f"CREATE TRIGGER {fts}_au AFTER UPDATE ON {table} BEGIN "
+                       f"INSERT INTO {fts}({fts}, rowid, name) VALUES ('delete', old.id, old.name); "
+                       f"INSERT INTO {fts}(rowid, name) VALUES (new.id, new.name); END")
+            op.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        for table in TABLES:
+            op.execute(f'DROP INDEX IF EXISTS ix_{table}_name_trgm')
+
+    elif dialect == 'sqlite':
+        for table in TABLES:
+            fts = f'{table}_fts'
+            for trigger in ('ai', 'ad', 'au'):
+                op.execute(f'DROP TRIGGER IF EXISTS {fts}_{trigger}')
+            op.execute(f'DROP TABLE IF EXISTS {fts}')
+
+    for table in TABLES:
+        op.drop_index(f'ix_{table}_name_lower', table_name=table)
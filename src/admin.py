@@ -1,20 +1,154 @@
+"""
+Flask-Admin views that stay fast on tables with millions of rows.
+
+FastModelView never runs an exact COUNT(*) over the whole table: the list
+shows the planner estimate on Postgres (pg_class.reltuples) or a count
+cached for ADMIN_COUNT_TTL seconds elsewhere, and filtered lists are only
+counted up to ADMIN_COUNT_CAP rows. In primary key order the < > pager
+carries the first/last id of the page (?after= / ?before=) so the next page
+is an index range instead of an OFFSET, and the filters only offer columns
+that have an index.
+"""
 import os
+from flask import current_app, g, request
 from flask_admin import Admin
-from models import db, User, Character, Planet, FavoriteCharacter, FavoritePlanet
 from flask_admin.contrib.sqla import ModelView
+from flask_admin.contrib.sqla.filters import BaseSQLAFilter, FilterEqual, IntEqualFilter
+from sqlalchemy import func, text
+from cache import TTLCache
+from models import db, User, Character, Planet, FavoriteCharacter, FavoritePlanet
+from search import name_prefix
+
+row_counts = TTLCache(maxsize=64, ttl=60)
+
+
+def estimated_rows(session, table):
+    estimate = row_counts.get(table.name)
+    if estimate is not None:
+        return estimate
+    if session.get_bind().dialect.name == "postgresql":
+        # -1 until the table has been vacuumed or analyzed once
+        estimate = session.execute(
+            text("SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:name)"),
+            {"name": f'"{table.name}"'},
+        ).scalar()
+    if estimate is None or estimate < 0:
+        estimate = session.execute(text(f'SELECT count(*) FROM "{table.name}"')).scalar()
+    row_counts.set(table.name, estimate)
+    return estimate
+
+
+class FilterNamePrefix(BaseSQLAFilter):
+    # The prefix match of the name search, it goes through the same index
+    def apply(self, query, value, alias=None):
+        dialect = db.session.get_bind().dialect.name
+        return query.filter(name_prefix(self.get_column(alias), value, dialect))
+
+    def operation(self):
+        return "starts with"
+
+
+class FastModelView(ModelView):
+    page_size = 50
+    # No exact COUNT(*), the < > pager only needs to know if there is a next page
+    simple_list_pager = True
+    column_display_pk = True
+    # Searching is a LIKE on every text column, use the indexed filters instead
+    column_searchable_list = None
+
+    def get_list(self, page, sort_column, sort_desc, search, filters,
+                 execute=True, page_size=None):
+        if page_size is None:
+            page_size = self.page_size
+        if not execute or not page_size:
+            return super().get_list(page, sort_column, sort_desc, search, filters,
+                                    execute=execute, page_size=page_size)
+
+        # Filters, search and sorting from Flask-Admin, paging from here
+        _, query = super().get_list(None, sort_column, sort_desc, search, filters,
+                                    execute=False, page_size=0)
+        g.admin_count = self.list_count(query, bool(search or filters))
+
+        if sort_column is not None:
+            return None, query.limit(page_size).offset((page or 0) * page_size).all()
+
+        pk = getattr(self.model, self._primary_key)
+        after = request.args.get("after", type=int)
+        before = request.args.get("before", type=int)
+        if after is not None:
+            rows = query.filter(pk > after).order_by(pk).limit(page_size).all()
+        elif before is not None:
+            rows = query.filter(pk < before).order_by(pk.desc()).limit(page_size).all()[::-1]
+        else:
+            # First page, or a page number typed in the url
+            rows = query.order_by(pk).limit(page_size).offset((page or 0) * page_size).all()
+
+        if rows:
+            g.admin_cursor = (page or 0, self.get_pk_value(rows[0]), self.get_pk_value(rows[-1]))
+        return None, rows
+
+    def list_count(self, query, filtered):
+        if not filtered:
+            return f"~{estimated_rows(self.session, self.model.__table__):,}"
+        cap = current_app.config["ADMIN_COUNT_CAP"]
+        capped = query.order_by(None).limit(cap + 1).subquery()
+        count = self.session.query(func.count()).select_from(capped).scalar()
+        return f"{cap:,}+" if count > cap else f"{count:,}"
+
+    def _get_list_url(self, view_args):
+        extra_args = {k: v for k, v in view_args.extra_args.items() if k not in ("after", "before")}
+        cursor = g.get("admin_cursor")
+        if cursor is not None:
+            page, first, last = cursor
+            if view_args.page == page + 1:
+                extra_args["after"] = last
+            elif view_args.page == page - 1 and view_args.page > 0:
+                extra_args["before"] = first
+        return super()._get_list_url(view_args.clone(extra_args=extra_args))
+
+    def render(self, template, **kwargs):
+        if template == self.list_template and "admin_count" in g:
+            kwargs["count"] = g.admin_count
+        return super().render(template, **kwargs)
+
+
+class UserView(FastModelView):
+    column_filters = (IntEqualFilter(User.id, "Id"), FilterEqual(User.email, "Email"),
+                      FilterEqual(User.username, "Username"))
+
+
+class CharacterView(FastModelView):
+    column_filters = (IntEqualFilter(Character.id, "Id"), FilterNamePrefix(Character.name, "Name"))
+
+
+class PlanetView(FastModelView):
+    column_filters = (IntEqualFilter(Planet.id, "Id"), FilterNamePrefix(Planet.name, "Name"))
+
+
+class FavoriteCharacterView(FastModelView):
+    column_filters = (IntEqualFilter(FavoriteCharacter.user_id, "User id"),
+                      IntEqualFilter(FavoriteCharacter.character_id, "Character id"))
+
+
+class FavoritePlanetView(FastModelView):
+    column_filters = (IntEqualFilter(FavoritePlanet.user_id, "User id"),
+                      IntEqualFilter(FavoritePlanet.planet_id, "Planet id"))
+
 
 def setup_admin(app):
     app.secret_key = os.environ.get('FLASK_APP_KEY', 'sample key')
     app.config['FLASK_ADMIN_SWATCH'] = 'cerulean'
+    app.config.setdefault("ADMIN_COUNT_CAP", 10000)
+    row_counts.ttl = app.config.setdefault("ADMIN_COUNT_TTL", 60)
     admin = Admin(app, name='4Geeks Admin', template_mode='bootstrap3')
 
-    
+
     # Add your models here, for example this is how we add a the User model to the admin
-    admin.add_view(ModelView(User, db.session))
-    admin.add_view(ModelView(Character, db.session))
-    admin.add_view(ModelView(Planet, db.session))
-    admin.add_view(ModelView(FavoriteCharacter, db.session))
-    admin.add_view(ModelView(FavoritePlanet, db.session))
+    admin.add_view(UserView(User, db.session))
+    admin.add_view(CharacterView(Character, db.session))
+    admin.add_view(PlanetView(Planet, db.session))
+    admin.add_view(FavoriteCharacterView(FavoriteCharacter, db.session))
+    admin.add_view(FavoritePlanetView(FavoritePlanet, db.session))
 
     # You can duplicate that line to add mew models
-    # admin.add_view(ModelView(YourModelName, db.session))
\ No newline at end of file
+    # admin.add_view(FastModelView(YourModelName, db.session))
@@ -0,0 +1,295 @@
+"""
+Admission control: under overload, turn requests away right away instead of
+letting every request queue up behind the workers until they all time out.
+
+Each client (the user of a valid JWT, otherwise the remote address) has a
+token bucket that refills at ADMISSION_RATE tokens per second up to
+ADMISSION_BURST. A request costs ADMISSION_COSTS[kind] tokens and is
+answered 429 with Retry-After when the bucket can't pay for it. The kinds are:
+
+    cached  GET of a @conditional view, usually a 304 or a cached body
+    read    any other GET
+    write   POST, PUT, PATCH and DELETE, except the @read_only lookups
+    admin   anything under /admin
+
+On top of that at most ADMISSION_MAX_CONCURRENCY requests are served at a
+time, and a kind may only start while fewer than
+ADMISSION_SHARES[kind] * ADMISSION_MAX_CONCURRENCY are in flight, so the
+last free slots are kept for cheap reads. Past that the request gets a 503
+with Retry-After. With gthread give the workers more GUNICORN_THREADS than
+their share of the cap: the spare threads then answer the 503s right away
+instead of requests waiting in line for a thread.
+
+With ADMISSION_DB set to a file path the buckets and the in-flight counts
+live in that SQLite file and are shared by every worker (gunicorn.conf.py
+sets one up in /dev/shm), so the cap is for the whole server. Otherwise each
+process keeps its own, and the cap is per worker. Behind a proxy wrap the app
+in werkzeug's ProxyFix so the remote address is the client's.
+"""
+import math
+import os
+import sqlite3
+import threading
+import time
+from flask import current_app, g, jsonify, request
+from flask_jwt_extended import decode_token
+from prometheus_client import Counter
+from cache import TTLCache
+
+EXEMPT_ENDPOINTS = {"metrics", "static"}
+
+REJECTED = Counter(
+    "admission_rejected_total", "Requests turned away by admission control",
+    ["kind", "reason"])
+
+# Token -> user id, decoding and checking a JWT costs more than the rest of
+# the admission check
+token_subjects = TTLCache(maxsize=4096, ttl=300)
+
+
+class MemoryBuckets:
+    """Token buckets of this process only."""
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, cost, rate, burst, now):
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+            admitted = tokens >= cost
+            if admitted:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+            return admitted, tokens
+
+    def prune(self, before):
+        with self._lock:
+            self._buckets = {k: v for k, v in self._buckets.items() if v[1] >= before}
+
+
+class SQLiteStore:
+    """A SQLite file shared by all the workers, created with SCHEMA."""
+
+    SCHEMA = None
+
+    def __init__(self, path):
+        self.path = path
+        self._connection = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def connection(self):
+        # One connection per process, never the one inherited through a fork
+        if self._connection is None or self._pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=0.05, isolation_level=None,
+                                         check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            # Losing the counts in a crash is fine, no need to fsync
+            connection.execute("PRAGMA synchronous=OFF")
+            connection.execute(self.SCHEMA)
+            self._connection, self._pid = connection, os.getpid()
+        return self._connection
+
+
+class SQLiteBuckets(SQLiteStore):
+    """Token buckets in a SQLite file shared by all the workers."""
+
+    SCHEMA = ("CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, "
+              "updated REAL NOT NULL, admitted INTEGER NOT NULL) WITHOUT ROWID")
+    # One statement, so it is atomic across processes. SET reads the old
+    # values, `refill` is the balance before paying for this request.
+    TAKE = """
+        INSERT INTO buckets (key, tokens, updated, admitted)
+        VALUES (:key, :burst - :cost, :now, 1)
+        ON CONFLICT (key) DO UPDATE SET
+            admitted = {refill} >= :cost,
+            tokens = {refill} - CASE WHEN {refill} >= :cost THEN :cost ELSE 0 END,
+            updated = :now
+        RETURNING admitted, tokens
+    """.format(refill="min(:burst, tokens + max(0.0, :now - updated) * :rate)")
+
+    def take(self, key, cost, rate, burst, now):
+        params = {"key": key, "cost": cost, "rate": rate, "burst": burst, "now": now}
+        with self._lock:
+            admitted, tokens = self.connection().execute(self.TAKE, params).fetchone()
+        return bool(admitted), tokens
+
+    def prune(self, before):
+        with self._lock:
+            self.connection().execute("DELETE FROM buckets WHERE updated < ?", (before,))
+
+
+class MemorySlots:
+    """Requests in flight in this process, with a lower cap for the expensive kinds."""
+
+    def __init__(self, limit, shares):
+        self.limit = limit
+        self.shares = shares
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, kind):
+        with self._lock:
+            if self.in_flight >= self.limit * self.shares[kind]:
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def prune(self):
+        pass
+
+
+class SQLiteSlots(SQLiteStore):
+    """Requests in flight in all the workers, a row per process in a SQLite file."""
+
+    SCHEMA = "CREATE TABLE IF NOT EXISTS slots (pid INTEGER PRIMARY KEY, in_flight INTEGER NOT NULL)"
+    # The process writes its own count, not an increment, so a release lost
+    # to a busy store is set right by the next write. One statement, atomic
+    # across processes: no row is written when the others plus this one
+    # would go over the cap.
+    ACQUIRE = """
+        INSERT INTO slots (pid, in_flight)
+        SELECT :pid, :in_flight
+        WHERE (SELECT coalesce(sum(in_flight), 0) FROM slots WHERE pid != :pid) + :in_flight - 1 < :cap
+        ON CONFLICT (pid) DO UPDATE SET in_flight = excluded.in_flight
+    """
+    RELEASE = ("INSERT INTO slots (pid, in_flight) VALUES (:pid, :in_flight) "
+               "ON CONFLICT (pid) DO UPDATE SET in_flight = excluded.in_flight")
+
+    def __init__(self, path, limit, shares):
+        super().__init__(path)
+        self.limit = limit
+        self.shares = shares
+        self.in_flight = 0
+
+    def acquire(self, kind):
+        params = {"pid": os.getpid(), "in_flight": self.in_flight + 1, "cap": self.limit * self.shares[kind]}
+        with self._lock:
+            if self.connection().execute(self.ACQUIRE, params).rowcount == 0:
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+            self.connection().execute(self.RELEASE, {"pid": os.getpid(), "in_flight": self.in_flight})
+
+    def prune(self):
+        # The slots of a worker that died holding them (gunicorn replaced it)
+        with self._lock:
+            connection = self.connection()
+            for (pid,) in connection.execute("SELECT pid FROM slots").fetchall():
+                try:
+                    os.kill(pid, 0)
+                except ProcessLookupError:
+                    connection.execute("DELETE FROM slots WHERE pid = ?", (pid,))
+                except PermissionError:
+                    pass
+
+
+def client_key():
+    auth = request.headers.get("Authorization", "")
+    if auth.startswith("Bearer "):
+        token = auth[7:]
+        subject = token_subjects.get(token)
+        if subject is None:
+            try:
+                subject = str(decode_token(token, allow_expired=True)["sub"])
+                token_subjects.set(token, subject)
+            except Exception:
+                pass
+        if subject is not None:
+            return "user:" + subject
+    # Only a token signed by us identifies a user, anything else falls back
+    # to the address so nobody can drain another's bucket
+    return "addr:" + (request.remote_addr or "")
+
+
+def request_kind():
+    if request.path.startswith("/admin"):
+        return "admin"
+    view = current_app.view_functions.get(request.endpoint)
+    if request.method not in ("GET", "HEAD") and not getattr(view, "read_only", False):
+        return "write"
+    if hasattr(view, "conditional_tables"):
+        return "cached"
+    return "read"
+
+
+def rejected(kind, reason, status, message, retry_after):
+    REJECTED.labels(kind, reason).inc()
+    response = jsonify({"message": message})
+    response.status_code = status
+    response.headers["Retry-After"] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+def setup_admission(app):
+    app.config.setdefault("ADMISSION_RATE", float(os.getenv("ADMISSION_RATE", 20)))
+    app.config.setdefault("ADMISSION_BURST", float(os.getenv("ADMISSION_BURST", 40)))
+    app.config.setdefault("ADMISSION_COSTS", {"cached": 1, "read": 2, "write": 4, "admin": 4})
+    app.config.setdefault("ADMISSION_MAX_CONCURRENCY", int(os.getenv("ADMISSION_MAX_CONCURRENCY", 0)))
+    app.config.setdefault("ADMISSION_SHARES", {"cached": 1.0, "read": 0.8, "write": 0.5, "admin": 0.25})
+    app.config.setdefault("ADMISSION_RETRY_AFTER", 1)
+    app.config.setdefault("ADMISSION_DB", os.getenv("ADMISSION_DB"))
+    app.config.setdefault("ADMISSION_CONTROL", False)
+    if not app.config["ADMISSION_CONTROL"]:
+        return
+
+    rate, burst = app.config["ADMISSION_RATE"], app.config["ADMISSION_BURST"]
+    # A request that costs more than the burst could never get in
+    costs = {kind: min(cost, burst) for kind, cost in app.config["ADMISSION_COSTS"].items()}
+    buckets = SQLiteBuckets(app.config["ADMISSION_DB"]) if app.config["ADMISSION_DB"] else MemoryBuckets()
+    slots = None
+    if app.config["ADMISSION_MAX_CONCURRENCY"]:
+        args = app.config["ADMISSION_MAX_CONCURRENCY"], app.config["ADMISSION_SHARES"]
+        slots = SQLiteSlots(app.config["ADMISSION_DB"], *args) if app.config["ADMISSION_DB"] else MemorySlots(*args)
+    # A bucket left alone this long is full again, same as no row at all
+    idle = burst / rate
+    last_prune = time.time()
+
+    @app.before_request
+    def admit():
+        nonlocal last_prune
+        if request.method == "OPTIONS" or request.endpoint in EXEMPT_ENDPOINTS:
+            return None
+        kind = request_kind()
+
+        cost, now = costs[kind], time.time()
+        try:
+            # The slot first, a request turned away for being busy keeps its tokens
+            if slots is not None:
+                if not slots.acquire(kind):
+                    return rejected(kind, "concurrency", 503, "Server busy, try again later",
+                                    app.config["ADMISSION_RETRY_AFTER"])
+                g.admission_slot = True
+
+            admitted, tokens = buckets.take(client_key(), cost, rate, burst, now)
+            if now - last_prune > max(idle, 60):
+                last_prune = now
+                buckets.prune(now - idle)
+                if slots is not None:
+                    slots.prune()
+        except sqlite3.OperationalError as e:
+            # A busy or broken store must not take the API down with it
+            app.logger.warning("admission control store unavailable, letting the request in: %s", e)
+            return None
+        if not admitted:
+            return rejected(kind, "rate", 429, "Too many requests", (cost - tokens) / rate)
+        return None
+
+    @app.teardown_request
+    def release_slot(exc):
+        if g.pop("admission_slot", False):
+            try:
+                slots.release()
+            except sqlite3.OperationalError as e:
+                # The count in the store is fixed by this worker's next request
+                app.logger.warning("admission control store unavailable, slot not released: %s", e)
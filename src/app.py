@@ -2,219 +2,116 @@
 This module takes care of starting the API Server, Loading the DB and Adding the endpoints
 """
 import os
-from flask import Flask, request, jsonify, url_for
-from flask_migrate import Migrate
-from flask_swagger import swagger
+from flask import Flask, jsonify
 from flask_cors import CORS
-from utils import APIException, generate_sitemap
-from admin import setup_admin
-from models import db, User, Character, Planet, FavoriteCharacter, FavoritePlanet
-from flask_jwt_extended import create_access_token
-from flask_jwt_extended import get_jwt_identity
-from flask_jwt_extended import jwt_required
 from flask_jwt_extended import JWTManager
-#from models import Person
-
-app = Flask(__name__)
-
-# Setup the Flask-JWT-Extended extension
-app.config["JWT_SECRET_KEY"] = "super-secret"  # Change this!
-jwt = JWTManager(app)
-
-app.url_map.strict_slashes = False
-
-db_url = os.getenv("DATABASE_URL")
-if db_url is not None:
-    app.config['SQLALCHEMY_DATABASE_URI'] = db_url.replace("postgres://", "postgresql://")
-else:
-    app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite:////tmp/test.db"
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-MIGRATE = Migrate(app, db)
-db.init_app(app)
-CORS(app)
-setup_admin(app)
-
-# Handle/serialize errors like a JSON object
-@app.errorhandler(APIException)
-def handle_invalid_usage(error):
-    return jsonify(error.to_dict()), error.status_code
-
-# generate sitemap with all your endpoints
-@app.route('/')
-def sitemap():
-    return generate_sitemap(app)
-
-#Listar todos los usuarios del blog.
-@app.route('/users', methods=['GET'])
-def get_users():
-
-    users = User.query.all()
-
-    users_serialized = []
-    for user in users:
-        users_serialized.append(user.serialize())
-
-    response_body = {
-        "msg": "Ok", "result" : users_serialized
-    }
-
-    return jsonify(response_body), 200
-
-#Listar todos los registros de people en la base de datos
-@app.route('/people', methods=['GET'])
-def get_characters():
-
-    characters = Character.query.all()
-
-    characters_serialized = []
-    for char in characters:
-        characters_serialized.append(char.serialize())
-
-    response_body = {
-        "msg" : "Ok",
-        "result" : characters_serialized
-    }
-
-    return jsonify(response_body), 200
-
-#Muestra la información de un solo personaje según su id.
-@app.route('/people/<int:people_id>', methods=['GET'])
-def get_single_character(people_id):
-
-    single_character = Character.query.get(people_id)
-    if single_character:
-        return jsonify({
-            "msg" : "Ok",
-            "character" : single_character.serialize()
-        }), 200
-    else: return jsonify({'msg': 'Character not found'}), 404
-
-#Listar todos los registros de planets en la base de datos.
-@app.route('/planets', methods=['GET'])
-def get_planets():
-
-    planets = Planet.query.all()
-
-    planets_serialized = []
-    for item in planets:
-        planets_serialized.append(item.serialize())
-
-    response_body = {
-        "msg" : "Ok",
-        "result" : planets_serialized
-    }
-
-    return jsonify(response_body), 200
-
-#Muestra la información de un solo planeta según su id.
-@app.route('/planets/<int:planet_id>', methods=['GET'])
-def get_single_planet(planet_id):
-
-    single_planet = Planet.query.get(planet_id)
-    if single_planet:
-        return jsonify({
-            "msg" : "Ok",
-            "character" : single_planet.serialize()
-        }), 200
-    else: return jsonify({'msg': 'Planet not found'}), 404
-
-
-#Listar todos los favoritos que pertenecen al usuario actual.
-@app.route('/users/favorites', methods=['GET'])
-def user_favorite():
-
-    userchar_favorites = FavoriteCharacter.query.all()
-    userplanet_favorites = FavoritePlanet.query.all()
-    result1 = list(map(lambda fav: fav.serialize(), userchar_favorites))
-    result2 = list(map(lambda fav: fav.serialize(), userplanet_favorites))
-    return jsonify(result1, result2), 200
-
-
-#Añade un nuevo people favorito al usuario actual con el id = people_id
-@app.route('/favorite/people/<int:people_id>', methods=['POST'])
-def add_new_fav_character(people_id):
-
-    user = User.query.first()
-
-    if user:
-        character = Character.query.get(people_id)
-        if character:
-            fav = FavoriteCharacter(user_id = user.id, character_id = people_id)
-            db.session.add(fav)
-            db.session.commit()
-            return jsonify({'msg': 'Character added successfully'}), 200
-        else: return jsonify({'msg': 'Character not found'}), 404
-    else: return jsonify({'msg': 'User not found'}), 404
-
-
-#Añade un nuevo planet favorito al usuario actual con el id = planet_id
-@app.route('/favorite/planet/<int:planet_id>', methods=['POST'])
-def add_new_fav_planet(planet_id):
-
-    user = User.query.first()
-
-    if user:
-        planet = Planet.query.get(planet_id)
-        if planet:
-            fav = FavoritePlanet(user_id = user.id, planet_id = planet_id)
-            db.session.add(fav)
-            db.session.commit()
-            return jsonify({'msg': 'Planet added successfully'}), 200
-        else: return jsonify({'msg': 'Planet not found'}), 404
-    else: return jsonify({'msg': 'User not found'}), 404
-
-#Elimina un planet favorito con el id = planet_id
-@app.route('/favorite/planet/<int:planet_id>', methods=['DELETE'])
-def delete_planet(planet_id):
-
-    favorite = FavoritePlanet.query.filter_by(planet_id=planet_id).first()
-    if favorite is None:
-        return jsonify({'msg': 'Planet not found'}), 404
-    
-    else:
-        db.session.delete(favorite)
-        db.session.commit()
-        return jsonify({"msg": f"Planet {favorite.planet_id} deleted"}),200
-
-#Elimina un people favorito con el id = people_id
-@app.route('/favorite/people/<int:people_id>', methods=['DELETE'])
-def delete_character(people_id):
-
-    favorite = FavoriteCharacter.query.filter_by(character_id=people_id).first()
-    if favorite is None:
-        return jsonify({'msg': 'Character not found'}), 404
-
+from utils import APIException, generate_sitemap
+from models import db
+from routes import api
+from auth import setup_auth
+from commands import setup_commands
+from metrics import setup_metrics
+from db_routing import setup_db_routing
+from query_budget import setup_query_budget
+from group_commit import setup_group_commit
+from compression import setup_compression
+from admission import setup_admission
+from profiling import setup_profiling
+
+
+def env_flag(name, default):
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.lower() in ("1", "true", "yes")
+
+
+def create_app(config=None):
+    """Build the app. `config` is a dict that overrides the defaults below.
+
+    Flask-Admin, Flask-Migrate and the swagger spec are optional
+    (ENABLE_ADMIN, ENABLE_MIGRATE, ENABLE_SWAGGER) and only imported when
+    enabled, API_ONLY=1 turns the three of them off so API workers boot faster.
+    """
+    app = Flask(__name__)
+    app.url_map.strict_slashes = False
+
+    api_only = env_flag("API_ONLY", False)
+    app.config["ENABLE_ADMIN"] = env_flag("ENABLE_ADMIN", not api_only)
+    app.config["ENABLE_MIGRATE"] = env_flag("ENABLE_MIGRATE", not api_only)
+    app.config["ENABLE_SWAGGER"] = env_flag("ENABLE_SWAGGER", not api_only)
+    # Batch favorite writes from concurrent requests, see group_commit.py
+    app.config["FAVORITE_GROUP_COMMIT"] = env_flag("FAVORITE_GROUP_COMMIT", False)
+    # Per-client token buckets and a concurrency cap, see admission.py
+    app.config["ADMISSION_CONTROL"] = env_flag("ADMISSION_CONTROL", False)
+    # Requests with a signed X-Profile header run under the profiler, see profiling.py
+    app.config["PROFILING"] = env_flag("PROFILING", False)
+
+    # Setup the Flask-JWT-Extended extension
+    # Change this! asgi.py reads the same variable
+    app.config["JWT_SECRET_KEY"] = os.getenv("JWT_SECRET_KEY", "super-secret")
+
+    db_url = os.getenv("DATABASE_URL")
+    if db_url is not None:
+        app.config['SQLALCHEMY_DATABASE_URI'] = db_url.replace("postgres://", "postgresql://")
     else:
-        db.session.delete(favorite)
-        db.session.commit()
-        return jsonify({"msg": f"Character {favorite.character_id}deleted"}),200
-
-# Create a route to authenticate your users and return JWTs. The
-# create_access_token() function is used to actually generate the JWT.
-@app.route("/login", methods=["POST"])
-def login():
-    email = request.json.get("email", None)
-    password = request.json.get("password", None)
-
-
-    if email != "test" or password != "test":
-        return jsonify({"msg": "Bad email or password"}), 401
-
-    access_token = create_access_token(identity=email)
-    return jsonify(access_token=access_token)
-
+        app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite:////tmp/test.db"
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+    if config:
+        app.config.from_mapping(config)
+
+    jwt = JWTManager(app)
+    setup_auth(app, jwt)
+
+    # Pool sizing (DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_RECYCLE) and read replicas (DATABASE_REPLICA_URLS)
+    setup_db_routing(app, db)
+    db.init_app(app)
+    CORS(app)
+
+    if app.config["ENABLE_MIGRATE"]:
+        from flask_migrate import Migrate
+        Migrate(app, db)
+    if app.config["ENABLE_ADMIN"]:
+        from admin import setup_admin
+        setup_admin(app)
+    if app.config["ENABLE_SWAGGER"]:
+        setup_swagger(app)
+
+    setup_commands(app)
+    setup_metrics(app)
+    # After the metrics, so requests turned away still get counted
+    setup_admission(app)
+    setup_query_budget(app)
+    setup_group_commit(app)
+    # Registered after the metrics so the size they record is the compressed one
+    setup_compression(app)
+    # Wraps the whole WSGI app, so the profile includes the URL routing
+    setup_profiling(app)
+
+    # Handle/serialize errors like a JSON object
+    @app.errorhandler(APIException)
+    def handle_invalid_usage(error):
+        return jsonify(error.to_dict()), error.status_code
+
+    # generate sitemap with all your endpoints
+    @app.route('/')
+    def sitemap():
+        return generate_sitemap(app)
+
+    app.register_blueprint(api)
+    return app
+
+
+def setup_swagger(app):
+    from flask_swagger import swagger
+
+    @app.route('/spec')
+    def spec():
+        return jsonify(swagger(app))
 
-# Protect a route with jwt_required, which will kick out requests
-# without a valid JWT present.
-@app.route("/users/favorites", methods=["GET"])
-@jwt_required()
-def protected():
-    # Access the identity of the current user with get_jwt_identity
-    current_user_email = get_jwt_identity()
-    return jsonify(logged_in_as=current_user_email.serialize()), 200
 
 # this only runs if `$ python src/app.py` is executed
 if __name__ == '__main__':
     PORT = int(os.environ.get('PORT', 3000))
-    app.run(host='0.0.0.0', port=PORT, debug=False)
+    create_app().run(host='0.0.0.0', port=PORT, debug=False)
@@ -0,0 +1,252 @@
+"""
+Async version of the read and favorite endpoints of app.py, served by an
+ASGI server on top of an async SQLAlchemy engine (aiosqlite locally,
+asyncpg on Postgres). It uses the same models and returns the same
+response shapes, so both modes can be compared head to head. The favorite
+routes take the same JWTs as app.py, signed with JWT_SECRET_KEY.
+
+    $ pipenv run start-async
+    # or: uvicorn asgi:app --app-dir src --port 3000
+"""
+import os
+import jwt
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from starlette.applications import Starlette
+from starlette.responses import Response
+from starlette.routing import Route
+from models import User, Character, Planet, FavoriteCharacter, FavoritePlanet, TableVersion
+from serializers import dumps
+from utils import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+
+
+def async_database_url():
+    db_url = os.getenv("DATABASE_URL")
+    if db_url is None:
+        return "sqlite+aiosqlite:////tmp/test.db"
+    if db_url.startswith("sqlite://"):
+        return db_url.replace("sqlite://", "sqlite+aiosqlite://", 1)
+    return db_url.replace("postgres://", "postgresql://", 1).replace("postgresql://", "postgresql+asyncpg://", 1)
+
+
+JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY", "super-secret")
+
+engine = create_async_engine(async_database_url())
+Session = async_sessionmaker(engine, expire_on_commit=False)
+
+
+class BadRequest(Exception):
+    pass
+
+
+def json_response(body, status=200, headers=None):
+    return Response(dumps(body), status_code=status, media_type="application/json", headers=headers)
+
+
+def token_user_id(request):
+    # Same checks as flask_jwt_extended: an access token signed with our key,
+    # the subject is the user id
+    auth = request.headers.get("authorization", "")
+    if not auth.startswith("Bearer "):
+        return None
+    try:
+        claims = jwt.decode(auth[7:], JWT_SECRET_KEY, algorithms=["HS256"])
+        if claims.get("type") != "access":
+            return None
+        return int(claims["sub"])
+    except (jwt.InvalidTokenError, KeyError, TypeError, ValueError):
+        return None
+
+
+async def current_user(request, session):
+    user_id = token_user_id(request)
+    if user_id is None:
+        return None
+    return await session.get(User, user_id)
+
+
+def unauthorized():
+    return json_response({"msg": "Missing or invalid token"}, 401)
+
+
+def int_arg(request, name, default=None, minimum=None, maximum=None):
+    value = request.query_params.get(name)
+    if value is None or value == "":
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        raise BadRequest(f"'{name}' must be an integer")
+    if minimum is not None and value < minimum:
+        raise BadRequest(f"'{name}' must be >= {minimum}")
+    if maximum is not None and value > maximum:
+        value = maximum
+    return value
+
+
+async def etag_for(session, *tables):
+    rows = await session.execute(
+        select(TableVersion.name, TableVersion.version).where(TableVersion.name.in_(tables))
+    )
+    versions = dict(rows.all())
+    return '"' + "-".join(f"{name}.{versions.get(name, 0)}" for name in tables) + '"'
+
+
+def not_modified(request, etag):
+    # Same strong ETag as the conditional() decorator in utils.py
+    tags = [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]
+    return etag in tags or "*" in tags
+
+
+async def list_response(request, model):
+    try:
+        limit = int_arg(request, "limit", DEFAULT_PAGE_SIZE, minimum=1, maximum=MAX_PAGE_SIZE)
+        after = int_arg(request, "after", None, minimum=0)
+    except BadRequest as e:
+        return json_response({"message": str(e)}, 400)
+
+    async with Session() as session:
+        etag = await etag_for(session, model.__tablename__)
+        if not_modified(request, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+
+        query = select(*model.serialize_columns()).order_by(model.id).limit(limit + 1)
+        if after is not None:
+            query = query.where(model.id > after)
+        rows = (await session.execute(query)).all()
+
+    items = [dict(zip(model.serialize_fields, row)) for row in rows]
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = items[-1]["id"]
+    return json_response({"msg": "Ok", "result": items, "next": next_cursor}, headers={"ETag": etag})
+
+
+async def single_response(request, model, id, not_found):
+    async with Session() as session:
+        etag = await etag_for(session, model.__tablename__)
+        if not_modified(request, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+        row = (await session.execute(
+            select(*model.serialize_columns()).where(model.id == id)
+        )).first()
+
+    if row is None:
+        return json_response({"msg": not_found}, 404)
+    return json_response({"msg": "Ok", "character": dict(zip(model.serialize_fields, row))},
+                         headers={"ETag": etag})
+
+
+async def get_users(request):
+    try:
+        limit = int_arg(request, "limit", DEFAULT_PAGE_SIZE, minimum=1, maximum=MAX_PAGE_SIZE)
+        after = int_arg(request, "after", None, minimum=0)
+    except BadRequest as e:
+        return json_response({"message": str(e)}, 400)
+
+    query = select(*User.serialize_columns()).order_by(User.id).limit(limit + 1)
+    if after is not None:
+        query = query.where(User.id > after)
+    async with Session() as session:
+        rows = (await session.execute(query)).all()
+
+    users = [dict(zip(User.serialize_fields, row)) for row in rows]
+    next_cursor = None
+    if len(users) > limit:
+        users = users[:limit]
+        next_cursor = users[-1]["id"]
+    return json_response({"msg": "Ok", "result": users, "next": next_cursor})
+
+
+async def get_characters(request):
+    return await list_response(request, Character)
+
+
+async def get_single_character(request):
+    return await single_response(request, Character, request.path_params["people_id"], "Character not found")
+
+
+async def get_planets(request):
+    return await list_response(request, Planet)
+
+
+async def get_single_planet(request):
+    return await single_response(request, Planet, request.path_params["planet_id"], "Planet not found")
+
+
+async def user_favorite(request):
+    async with Session() as session:
+        user = await current_user(request, session)
+        if user is None:
+            return unauthorized()
+        etag = await etag_for(session, "favorite_character", "favorite_planet", "character", "planet")
+        if not_modified(request, etag):
+            return Response(status_code=304, headers={"ETag": etag, "Vary": "Authorization"})
+        result = User.group_favorites(await session.execute(user.favorites_query()))
+    # The same url answers differently for each user
+    return json_response({"msg": "Ok", "result": result}, headers={"ETag": etag, "Vary": "Authorization"})
+
+
+async def add_favorite(request, model, item_model, item_column, item_id, label):
+    async with Session() as session:
+        user = await current_user(request, session)
+        if user is None:
+            return unauthorized()
+        if await session.get(item_model, item_id) is None:
+            return json_response({"msg": f"{label} not found"}, 404)
+
+        exists = (await session.execute(
+            select(model.id).where(model.user_id == user.id, item_column == item_id)
+        )).first()
+        if exists is None:
+            try:
+                session.add(model(user_id=user.id, **{item_column.key: item_id}))
+                await session.commit()
+            except IntegrityError:
+                # Another request added the same favorite first
+                await session.rollback()
+    return json_response({"msg": f"{label} added successfully"})
+
+
+async def delete_favorite(request, model, item_column, item_id, label):
+    async with Session() as session:
+        user = await current_user(request, session)
+        if user is None:
+            return unauthorized()
+        favorite = (await session.execute(
+            select(model).where(model.user_id == user.id, item_column == item_id)
+        )).scalar()
+        if favorite is None:
+            return json_response({"msg": f"{label} not found"}, 404)
+        await session.delete(favorite)
+        await session.commit()
+    return json_response({"msg": f"{label} {item_id} deleted"})
+
+
+async def favorite_character(request):
+    people_id = request.path_params["people_id"]
+    if request.method == "POST":
+        return await add_favorite(request, FavoriteCharacter, Character, FavoriteCharacter.character_id,
+                                  people_id, "Character")
+    return await delete_favorite(request, FavoriteCharacter, FavoriteCharacter.character_id, people_id, "Character")
+
+
+async def favorite_planet(request):
+    planet_id = request.path_params["planet_id"]
+    if request.method == "POST":
+        return await add_favorite(request, FavoritePlanet, Planet, FavoritePlanet.planet_id, planet_id, "Planet")
+    return await delete_favorite(request, FavoritePlanet, FavoritePlanet.planet_id, planet_id, "Planet")
+
+
+app = Starlette(routes=[
+    Route("/users", get_users, methods=["GET"]),
+    Route("/people", get_characters, methods=["GET"]),
+    Route("/people/{people_id:int}", get_single_character, methods=["GET"]),
+    Route("/planets", get_planets, methods=["GET"]),
+    Route("/planets/{planet_id:int}", get_single_planet, methods=["GET"]),
+    Route("/users/favorites", user_favorite, methods=["GET"]),
+    Route("/favorite/people/{people_id:int}", favorite_character, methods=["POST", "DELETE"]),
+    Route("/favorite/planet/{planet_id:int}", favorite_planet, methods=["POST", "DELETE"]),
+])
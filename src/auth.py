@@ -0,0 +1,52 @@
+"""
+Resolves the User behind a JWT for `current_user` without hitting the
+database on every request.
+
+Users are kept in a small in-process cache keyed by the token subject
+(the user id) for USER_CACHE_TTL seconds, at most USER_CACHE_SIZE of them.
+Any change to a User row through the session evicts it right away in this
+worker, other workers pick it up when the entry expires.
+"""
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from models import db, User
+from cache import TTLCache
+
+user_cache = TTLCache(maxsize=1024, ttl=60)
+
+
+@event.listens_for(Session, "after_flush")
+def evict_changed_users(session, flush_context):
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, User):
+            user_cache.pop(str(obj.id))
+
+
+def load_user(identity):
+    cached = user_cache.get(identity)
+    if cached is None:
+        try:
+            user_id = int(identity)
+        except (TypeError, ValueError):
+            # Not one of our subjects (e.g. a token from before they were
+            # user ids), None makes flask_jwt_extended answer 401
+            return None
+        user = db.session.get(User, user_id)
+        if user is None:
+            return None
+        # Keep a detached copy with its columns loaded, so the cache never
+        # holds on to a request's session
+        db.session.expunge(user)
+        user_cache.set(identity, user)
+        cached = user
+    # Attach it to this request's session without a SELECT
+    return db.session.merge(cached, load=False)
+
+
+def setup_auth(app, jwt):
+    user_cache.maxsize = app.config.setdefault("USER_CACHE_SIZE", 1024)
+    user_cache.ttl = app.config.setdefault("USER_CACHE_TTL", 60)
+
+    @jwt.user_lookup_loader
+    def user_lookup_callback(jwt_header, jwt_data):
+        return load_user(jwt_data["sub"])
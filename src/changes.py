@@ -0,0 +1,140 @@
+"""
+Delta sync for clients that keep a local copy of the people, the planets and
+their own favorites.
+
+Every write to those tables leaves an entry in the change log (log_changes
+in models.py). /changes?since=<seq> returns the entries after seq, one per
+row with the row as it is now, so a client that synced a minute ago only
+reads what changed in that minute. Without `since` it only returns the
+current seq: take it before downloading the full lists, then sync from it.
+Apply inserts and updates as upserts, the insert of a row may be compacted
+away and its update come first.
+
+`flask compact-changes` removes the entries a later one of the same row
+supersedes, which is always safe, and the deletes older than
+CHANGES_RETENTION_DAYS. A client asking for a seq before the newest delete
+removed that way gets a 410 and has to download the full lists again.
+"""
+from datetime import datetime, timedelta
+from sqlalchemy import select, delete, func, exists
+from sqlalchemy.orm import aliased
+from models import db, Character, Planet, FavoriteCharacter, FavoritePlanet, ChangeLog, Checkpoint
+from utils import APIException
+
+# Resource name in /changes for each table, same names as /people, /planets
+# and the two lists of /users/favorites
+RESOURCES = {
+    "character": "people",
+    "planet": "planets",
+    "favorite_character": "favorite_people",
+    "favorite_planet": "favorite_planets",
+}
+FLOOR_CHECKPOINT = "changes:floor"
+
+
+def current_rows(table_name, ids, user_id):
+    if table_name in ("character", "planet"):
+        model = Character if table_name == "character" else Planet
+        rows = db.session.execute(select(*model.serialize_columns()).where(model.id.in_(ids)))
+        return {row.id: dict(zip(model.serialize_fields, row)) for row in rows}
+
+    # Favorites in the shape of /users/favorites, names included
+    model, item, item_key = ((FavoriteCharacter, Character, "character_id") if table_name == "favorite_character"
+                             else (FavoritePlanet, Planet, "planet_id"))
+    rows = db.session.execute(
+        select(model.id, getattr(model, item_key), item.name)
+        .join(item, item.id == getattr(model, item_key))
+        .where(model.id.in_(ids), model.user_id == user_id)
+    )
+    return {fav_id: {"id": fav_id, item_key: item_id, "name": name} for fav_id, item_id, name in rows}
+
+
+def head():
+    return db.session.execute(select(func.max(ChangeLog.seq))).scalar() or 0
+
+
+def changes_since(since, limit, user_id=None):
+    floor = Checkpoint.get(FLOOR_CHECKPOINT)
+    if since < floor:
+        raise APIException("Changes before this seq were compacted, download the full lists again",
+                           status_code=410, payload={"floor": floor})
+
+    last = head()
+    visible = ChangeLog.user_id.is_(None)
+    if user_id is not None:
+        visible = visible | (ChangeLog.user_id == user_id)
+    entries = db.session.execute(
+        select(ChangeLog.seq, ChangeLog.table_name, ChangeLog.row_id, ChangeLog.op)
+        .where(ChangeLog.seq > since, ChangeLog.seq <= last, visible)
+        .order_by(ChangeLog.seq)
+        .limit(limit + 1)
+    ).all()
+    more = len(entries) > limit
+    entries = entries[:limit]
+
+    # Only the last entry of each row counts, the row is read as it is now anyway
+    latest = {}
+    for entry in entries:
+        latest.pop((entry.table_name, entry.row_id), None)
+        latest[(entry.table_name, entry.row_id)] = entry
+
+    wanted = {}
+    for (table_name, row_id), entry in latest.items():
+        if entry.op != "delete":
+            wanted.setdefault(table_name, []).append(row_id)
+    rows = {table_name: current_rows(table_name, ids, user_id) for table_name, ids in wanted.items()}
+
+    changes = []
+    for (table_name, row_id), entry in latest.items():
+        row = rows.get(table_name, {}).get(row_id)
+        change = {"seq": entry.seq, "resource": RESOURCES[table_name], "id": row_id}
+        if entry.op == "delete" or row is None:
+            # Gone since, the delete entry is further on in the log
+            change["op"] = "delete"
+        else:
+            change["op"] = entry.op
+            change["data"] = row
+        changes.append(change)
+
+    return {
+        "changes": changes,
+        # Past the other users' favorites too once there is nothing left
+        "next": entries[-1].seq if more else last,
+        "more": more,
+    }
+
+
+def compact(retention_days, batch_size):
+    """Returns how many superseded entries and old deletes were removed."""
+    superseded = 0
+    later = aliased(ChangeLog)
+    low, last = db.session.execute(select(func.min(ChangeLog.seq), func.max(ChangeLog.seq))).one()
+    low = (low or 1) - 1
+    while low < (last or 0):
+        high = low + batch_size
+        # Only entries of the same row and the same user: a favorite given to
+        # another user has to stay deleted for the first one
+        replaced = exists().where(
+            later.table_name == ChangeLog.table_name, later.row_id == ChangeLog.row_id,
+            later.user_id.is_not_distinct_from(ChangeLog.user_id), later.seq > ChangeLog.seq,
+        )
+        superseded += db.session.execute(
+            delete(ChangeLog).where(ChangeLog.seq > low, ChangeLog.seq <= high, replaced)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.session.commit()
+        low = high
+
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    old_deletes = (ChangeLog.op == "delete") & (ChangeLog.created_at < cutoff)
+    newest = db.session.execute(select(func.max(ChangeLog.seq)).where(old_deletes)).scalar()
+    removed = 0
+    if newest is not None:
+        removed = db.session.execute(
+            delete(ChangeLog).where(old_deletes, ChangeLog.seq <= newest)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        # Clients behind it could have missed one of those deletes
+        Checkpoint.save(db.session.connection(), FLOOR_CHECKPOINT, max(newest, Checkpoint.get(FLOOR_CHECKPOINT)))
+        db.session.commit()
+    return superseded, removed
@@ -0,0 +1,315 @@
+"""
+Custom `flask` commands, registered on the app by setup_commands().
+
+    $ flask import-catalog people dumps/people.ndjson
+    $ flask import-catalog planets dumps/planets.csv --batch-size 20000
+    $ flask rebuild-popularity
+    $ flask migration-progress --watch 5
+    $ flask compact-changes --keep-days 30
+    $ flask profile GET "/people?limit=1000"
+"""
+import csv
+import io
+import json
+import os
+import time
+import click
+from sqlalchemy import func, select, text
+from models import db, Character, Planet, Checkpoint, TableVersion, CharacterPopularity, PlanetPopularity, ChangeLog
+from changes import compact
+from profiling import FORMATS, SAVED_KEY, install, make_token
+
+IMPORT_MODELS = {"people": Character, "planets": Planet}
+POPULARITY_MODELS = {"people": CharacterPopularity, "planets": PlanetPopularity}
+DEFAULT_BATCH_SIZE = 5000
+CHANGES_RETENTION_DAYS = int(os.getenv("CHANGES_RETENTION_DAYS", 30))
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+def read_ndjson(f):
+    for line in f:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def read_csv(f):
+    yield from csv.DictReader(f)
+
+
+def read_json_array(f):
+    # Decodes one object at a time out of a top level JSON array, so the file
+    # is never loaded in memory as a whole.
+    decoder = json.JSONDecoder()
+    buffer = ""
+    started = False
+    while True:
+        chunk = f.read(READ_CHUNK_SIZE)
+        buffer += chunk
+        pos = 0
+        while True:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if not started and pos < len(buffer):
+                if buffer[pos] != "[":
+                    raise click.ClickException("JSON dumps must be an array of objects")
+                started = True
+                pos += 1
+                continue
+            if pos < len(buffer) and buffer[pos] == "]":
+                return
+            try:
+                record, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if not chunk:
+                    raise click.ClickException("Unexpected end of the JSON dump")
+                break
+            yield record
+        buffer = buffer[pos:]
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m" if hours else f"{minutes}m{seconds:02d}s"
+
+
+def backfill_progress(now):
+    # The checkpoints written by migrations/online.py
+    rows = db.session.execute(
+        select(Checkpoint).where(Checkpoint.name.like("backfill:%")).order_by(Checkpoint.started_at)
+    ).scalars()
+    lines = []
+    for row in rows:
+        total = row.total or 0
+        done = min(row.position, total)
+        percent = 100.0 * done / total if total else 100.0
+        elapsed = ((row.finished_at or row.updated_at) - row.started_at).total_seconds() if row.started_at else 0
+        if row.finished_at is not None:
+            status = f"finished in {format_duration(elapsed)}"
+        else:
+            rate = done / elapsed if elapsed > 0 else 0
+            eta = f"ETA {format_duration((total - done) / rate)}" if rate else "ETA ?"
+            idle = (now - row.updated_at).total_seconds()
+            status = f"{rate:.0f} keys/s, {eta}" if idle < 60 else f"stalled for {format_duration(idle)}"
+        lines.append(f"{row.name[len('backfill:'):]:<50} {done:>12}/{total:<12} {percent:5.1f}%  {status}")
+    return lines
+
+
+def index_build_progress():
+    # Postgres reports CREATE INDEX (CONCURRENTLY) as it goes
+    if db.engine.dialect.name != "postgresql":
+        return []
+    rows = db.session.execute(text(
+        "SELECT relid::regclass, index_relid::regclass, phase, blocks_done, blocks_total "
+        "FROM pg_stat_progress_create_index"
+    ))
+    return [f"index {index} on {table}: {phase}, {100.0 * done / total if total else 0:.1f}% of the blocks"
+            for table, index, phase, done, total in rows]
+
+
+READERS = {".ndjson": read_ndjson, ".jsonl": read_ndjson, ".csv": read_csv, ".json": read_json_array}
+
+
+def same_columns(batch):
+    # executemany and COPY take the columns from the first row, so every row
+    # has the same ones. Left out only when no row has a value, e.g. the id
+    # when the database assigns it.
+    columns = [column for column in batch[0] if any(row[column] is not None for row in batch)]
+    if "id" in columns and any(row["id"] is None for row in batch):
+        raise click.ClickException("Either every row of the dump has an id or none does")
+    return [{column: row[column] for column in columns} for row in batch]
+
+
+def batches(records, size, columns):
+    batch = []
+    for record in records:
+        batch.append({column: None if record.get(column) in (None, "") else record[column] for column in columns})
+        if len(batch) >= size:
+            yield same_columns(batch)
+            batch = []
+    if batch:
+        yield same_columns(batch)
+
+
+def insert_batch(connection, table, batch):
+    if connection.dialect.name == "postgresql":
+        # COPY is several times faster than INSERT on Postgres
+        columns = list(batch[0].keys())
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in batch:
+            # None is an empty unquoted field, NULL for COPY
+            writer.writerow([row[column] for column in columns])
+        buffer.seek(0)
+        cursor = connection.connection.cursor()
+        cursor.copy_expert(f'COPY "{table.name}" ({", ".join(columns)}) FROM STDIN WITH (FORMAT csv)', buffer)
+    else:
+        # A single executemany per batch
+        connection.execute(table.insert(), batch)
+
+
+def log_inserts(connection, table, batch, before):
+    # Core inserts skip the session listener that writes the change log
+    if all("id" in row for row in batch):
+        ids = [int(row["id"]) for row in batch]
+    else:
+        ids = connection.execute(select(table.c.id).where(table.c.id > before)).scalars().all()
+    ChangeLog.record(connection, [{"table_name": table.name, "row_id": row_id, "op": "insert"} for row_id in ids])
+
+
+def fix_sequence(connection, table):
+    # Rows imported with explicit ids don't move the Postgres sequence forward
+    if connection.dialect.name == "postgresql":
+        connection.exec_driver_sql(
+            f"SELECT setval(pg_get_serial_sequence('\"{table.name}\"', 'id'), "
+            f"COALESCE((SELECT MAX(id) FROM \"{table.name}\"), 1))"
+        )
+
+
+def setup_commands(app):
+
+    @app.cli.command("import-catalog")
+    @click.argument("kind", type=click.Choice(sorted(IMPORT_MODELS)))
+    @click.argument("path", type=click.Path(exists=True, dir_okay=False))
+    @click.option("--format", "file_format", type=click.Choice(["ndjson", "csv", "json"]),
+                  help="Defaults to the file extension.")
+    @click.option("--batch-size", default=DEFAULT_BATCH_SIZE, show_default=True,
+                  help="Rows inserted and committed together.")
+    @click.option("--restart", is_flag=True, help="Ignore the saved checkpoint and start from the first row.")
+    def import_catalog(kind, path, file_format, batch_size, restart):
+        """Stream a JSON/CSV/NDJSON dump of characters or planets into the database.
+
+        Every batch is committed together with a checkpoint, so running the
+        same command again after a crash carries on where it stopped.
+        """
+        model = IMPORT_MODELS[kind]
+        table = model.__table__
+        extension = f".{file_format}" if file_format else os.path.splitext(path)[1].lower()
+        reader = READERS.get(extension)
+        if reader is None:
+            raise click.ClickException(f"Unknown format '{extension}', use --format")
+
+        checkpoint = f"import:{table.name}:{os.path.abspath(path)}"
+        if restart:
+            Checkpoint.clear(checkpoint)
+            db.session.commit()
+        done = Checkpoint.get(checkpoint)
+        if done:
+            click.echo(f"Resuming after {done} rows")
+
+        start = time.perf_counter()
+        imported = 0
+        with open(path, newline="", encoding="utf-8") as f:
+            records = reader(f)
+            for _ in range(done):
+                next(records, None)
+            for batch in batches(records, batch_size, model.serialize_fields):
+                connection = db.session.connection()
+                before = connection.execute(select(func.max(table.c.id))).scalar() or 0
+                insert_batch(connection, table, batch)
+                log_inserts(connection, table, batch, before)
+                imported += len(batch)
+                Checkpoint.save(connection, checkpoint, done + imported)
+                TableVersion.bump(connection, {table.name})
+                db.session.commit()
+                elapsed = time.perf_counter() - start
+                click.echo(f"{done + imported} rows ({imported / elapsed:.0f} rows/s)")
+
+        fix_sequence(db.session.connection(), table)
+        db.session.commit()
+        click.echo(f"Imported {imported} {kind} in {time.perf_counter() - start:.1f}s")
+
+    @app.cli.command("rebuild-popularity")
+    @click.argument("kinds", nargs=-1, type=click.Choice(sorted(POPULARITY_MODELS)))
+    def rebuild_popularity(kinds):
+        """Recompute the favorite counters behind /people/popular and /planets/popular.
+
+        Each kind is rebuilt in one transaction from the favorite tables,
+        run it after writing favorites outside the app or if the counts drift.
+        """
+        for kind in kinds or sorted(POPULARITY_MODELS):
+            start = time.perf_counter()
+            rows = POPULARITY_MODELS[kind].rebuild(db.session.connection())
+            db.session.commit()
+            click.echo(f"Rebuilt {rows} {kind} counters in {time.perf_counter() - start:.1f}s")
+
+    @app.cli.command("migration-progress")
+    @click.option("--watch", type=float, help="Print it again every this many seconds.")
+    def migration_progress(watch):
+        """Show how far the online backfills and index builds of the migrations are.
+
+        Backfills keep their checkpoint when they finish, so this also lists
+        the finished ones. Run it from another shell while `flask db upgrade`
+        works through a big table.
+        """
+        while True:
+            # The checkpoint columns hold the database's now() without a time zone
+            now = db.session.execute(select(func.now())).scalar().replace(tzinfo=None)
+            lines = backfill_progress(now) + index_build_progress()
+            db.session.rollback()
+            click.echo("\n".join(lines) if lines else "No online migrations have run")
+            if not watch:
+                return
+            time.sleep(watch)
+            click.echo()
+
+    @app.cli.command("compact-changes")
+    @click.option("--keep-days", default=CHANGES_RETENTION_DAYS, show_default=True,
+                  help="Deletes older than this are dropped, clients further behind get a 410.")
+    @click.option("--batch-size", default=DEFAULT_BATCH_SIZE, show_default=True,
+                  help="Range of seqs looked at and committed together.")
+    def compact_changes(keep_days, batch_size):
+        """Drop the change log entries /changes no longer needs.
+
+        Entries followed by a later one of the same row go first, whatever
+        their age. Run it from cron, it only holds short transactions.
+        """
+        start = time.perf_counter()
+        superseded, removed = compact(keep_days, batch_size)
+        click.echo(f"Removed {superseded} superseded entries and {removed} old deletes "
+                   f"in {time.perf_counter() - start:.1f}s")
+
+    @app.cli.command("profile-token")
+    def profile_token():
+        """Print a token for the X-Profile header, see profiling.py."""
+        if not app.config["PROFILE_SECRET"]:
+            raise click.ClickException("Set PROFILE_SECRET first, the tokens are signed with it")
+        click.echo(make_token(app))
+
+    @app.cli.command("profile")
+    @click.argument("method", type=click.Choice(["GET", "POST", "PUT", "PATCH", "DELETE"], case_sensitive=False))
+    @click.argument("path")
+    @click.option("--json", "body", help="JSON body of the request.")
+    @click.option("--user", type=int, help="Send a JWT of this user id, for the routes behind @jwt_required.")
+    @click.option("--format", "output_format", type=click.Choice(sorted(FORMATS)),
+                  help="Defaults to PROFILE_FORMAT.")
+    @click.option("--warmup", default=1, show_default=True,
+                  help="Requests sent first without the profiler, so connections and caches are warm.")
+    def profile(method, path, body, user, output_format, warmup):
+        """Run one request to PATH through the app under the profiler, against DATABASE_URL.
+
+        Works with PROFILING off and without PROFILE_SECRET. Prints where the time went and
+        the file with the call stacks.
+        """
+        if output_format:
+            app.config["PROFILE_FORMAT"] = output_format
+        install(app)
+        headers = {}
+        if user is not None:
+            from flask_jwt_extended import create_access_token
+            headers["Authorization"] = "Bearer " + create_access_token(identity=str(user))
+        data = json.loads(body) if body else None
+
+        client = app.test_client()
+        for _ in range(warmup):
+            client.open(path, method=method.upper(), json=data, headers=headers)
+        saved = []
+        response = client.open(path, method=method.upper(), json=data, headers=headers,
+                               environ_base={SAVED_KEY: saved})
+
+        click.echo(f"{method.upper()} {path} -> {response.status}")
+        for part in response.headers["Server-Timing"].split(", "):
+            category, duration = part.split(";dur=")
+            click.echo(f"  {category:<12} {float(duration):>10.2f} ms")
+        click.echo(f"Call stacks saved in {saved[0]}")
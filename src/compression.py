@@ -0,0 +1,109 @@
+"""
+gzip and brotli (when the `brotli` package is installed) responses,
+negotiated through Accept-Encoding.
+
+Any JSON or text response of COMPRESS_MIN_SIZE bytes or more is compressed on
+the way out. The catalog lists also go through @cache_compressed: their
+compressed bytes are kept per url, encoding and ETag, so while the tables are
+unchanged a request skips the query, the serialization and the compression.
+A new table version means a new ETag, and old entries simply age out. The
+NDJSON exports are streamed and skip the cache.
+"""
+import gzip
+from functools import wraps
+from flask import current_app, g, make_response, request
+from cache import TTLCache
+from utils import wants_stream
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = {"application/json", "application/x-ndjson", "text/html", "text/plain"}
+
+compressed_cache = TTLCache(maxsize=256, ttl=600)
+
+
+def negotiate():
+    if not current_app.config["COMPRESS_RESPONSES"]:
+        return None
+    offered = ["br", "gzip"] if brotli is not None else ["gzip"]
+    return request.accept_encodings.best_match(offered)
+
+
+def compress(data, encoding, level):
+    if encoding == "br":
+        return brotli.compress(data, quality=level)
+    # mtime=0 so the same body always gives the same bytes
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def compressible(response):
+    return (response.status_code == 200 and not response.is_streamed
+            and not response.content_encoding and response.mimetype in COMPRESSIBLE_MIMETYPES)
+
+
+def set_encoding(response, encoding):
+    response.content_encoding = encoding
+    # Same content in another encoding, so the ETag becomes weak (RFC 9110 8.8.1)
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+
+
+def cache_compressed(fn):
+    # Goes under @conditional, which leaves the ETag of the tables in g.etag
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        encoding = negotiate()
+        etag = g.get("etag")
+        # A body per list of ids, not worth a cache entry. The NDJSON export
+        # has the same url as the JSON page and is never cached.
+        if encoding is None or etag is None or "ids" in request.args or wants_stream():
+            return fn(*args, **kwargs)
+
+        key = (request.full_path, encoding, etag)
+        cached = compressed_cache.get(key)
+        if cached is None:
+            response = make_response(fn(*args, **kwargs))
+            if not compressible(response):
+                return response
+            # Compressed once per table version, worth a higher level
+            level = current_app.config["COMPRESS_CACHED_LEVEL"][encoding]
+            cached = (compress(response.get_data(), encoding, level), response.content_type)
+            compressed_cache.set(key, cached)
+
+        body, content_type = cached
+        response = current_app.response_class(body, 200, content_type=content_type)
+        response.content_encoding = encoding
+        return response
+    return wrapper
+
+
+def setup_compression(app):
+    app.config.setdefault("COMPRESS_RESPONSES", True)
+    app.config.setdefault("COMPRESS_MIN_SIZE", 500)
+    app.config.setdefault("COMPRESS_LEVEL", {"gzip": 6, "br": 5})
+    app.config.setdefault("COMPRESS_CACHED_LEVEL", {"gzip": 9, "br": 9})
+    compressed_cache.maxsize = app.config.setdefault("COMPRESS_CACHE_SIZE", 256)
+    compressed_cache.ttl = app.config.setdefault("COMPRESS_CACHE_TTL", 600)
+
+    @app.after_request
+    def compress_response(response):
+        if response.mimetype in COMPRESSIBLE_MIMETYPES:
+            response.vary.add("Accept-Encoding")
+        if response.content_encoding:
+            # Already compressed by @cache_compressed, only the ETag is left
+            if response.content_encoding in ("gzip", "br"):
+                set_encoding(response, response.content_encoding)
+            return response
+        if not compressible(response) or response.calculate_content_length() < app.config["COMPRESS_MIN_SIZE"]:
+            return response
+        encoding = negotiate()
+        if encoding is None:
+            return response
+        level = app.config["COMPRESS_LEVEL"][encoding]
+        response.set_data(compress(response.get_data(), encoding, level))
+        set_encoding(response, encoding)
+        return response
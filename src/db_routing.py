@@ -0,0 +1,93 @@
+"""
+Connection pool settings and read/write routing between the primary
+database and read replicas.
+
+DATABASE_REPLICA_URLS is a comma separated list of replica urls. GET and
+HEAD requests, and the POSTs marked @read_only, read from one of them,
+everything else (favorite add/delete, admin edits) goes to the primary
+DATABASE_URL. After a client writes
+something its next requests stick to the primary for REPLICA_STICKY_SECONDS,
+so it always reads its own writes even if the replicas are behind.
+
+To try it locally use two SQLite files:
+
+    DATABASE_URL=sqlite:////tmp/primary.db
+    DATABASE_REPLICA_URLS=sqlite:////tmp/replica.db
+"""
+import os
+import random
+import time
+from flask import g, request, has_request_context
+from flask_sqlalchemy.session import Session
+
+REPLICA_BIND_PREFIX = "replica_"
+STICKY_COOKIE = "db_primary_until"
+
+
+def normalize_url(url):
+    return url.strip().replace("postgres://", "postgresql://", 1)
+
+
+def engine_options(url):
+    options = {
+        # Check connections before using them, the free tier database drops idle ones
+        "pool_pre_ping": True,
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", 1800)),
+    }
+    # SQLite in memory uses a single connection pool that takes no sizing options
+    if not url.startswith("sqlite") or os.getenv("DB_POOL_SIZE"):
+        options["pool_size"] = int(os.getenv("DB_POOL_SIZE", 5))
+        options["max_overflow"] = int(os.getenv("DB_MAX_OVERFLOW", 10))
+        options["pool_timeout"] = int(os.getenv("DB_POOL_TIMEOUT", 30))
+    return options
+
+
+def replica_urls():
+    urls = os.getenv("DATABASE_REPLICA_URLS", "")
+    return [normalize_url(url) for url in urls.split(",") if url.strip()]
+
+
+class RoutingSession(Session):
+    """db.session that sends reads to a replica when the request allows it."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self.use_replica():
+            replica = self.info.get("replica_bind")
+            if replica is None:
+                # Stay on the same replica for the whole request
+                replica = self.info["replica_bind"] = random.choice(self.replica_keys())
+            return self._db.engines[replica]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def replica_keys(self):
+        return [key for key in self._db.engines if key and key.startswith(REPLICA_BIND_PREFIX)]
+
+    def use_replica(self):
+        if self._flushing or self.info.get("wrote") or not has_request_context():
+            return False
+        return g.get("db_read_replica", False) and bool(self.replica_keys())
+
+
+def setup_db_routing(app, db):
+    primary = app.config["SQLALCHEMY_DATABASE_URI"]
+    app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", engine_options(primary))
+    app.config.setdefault("REPLICA_STICKY_SECONDS", int(os.getenv("REPLICA_STICKY_SECONDS", 5)))
+
+    binds = app.config.setdefault("SQLALCHEMY_BINDS", {})
+    for i, url in enumerate(replica_urls()):
+        binds[f"{REPLICA_BIND_PREFIX}{i}"] = {"url": url, **engine_options(url)}
+
+    @app.before_request
+    def choose_database():
+        sticky_until = request.cookies.get(STICKY_COOKIE, type=float) or 0
+        reads = (request.method in ("GET", "HEAD")
+                 or getattr(app.view_functions.get(request.endpoint), "read_only", False))
+        g.db_read_replica = reads and sticky_until < time.time()
+
+    @app.after_request
+    def remember_write(response):
+        if db.session.info.pop("wrote", False):
+            sticky_until = time.time() + app.config["REPLICA_STICKY_SECONDS"]
+            response.set_cookie(STICKY_COOKIE, str(sticky_until),
+                                max_age=app.config["REPLICA_STICKY_SECONDS"], httponly=True)
+        return response
@@ -0,0 +1,202 @@
+"""
+Favorite writes, committed one request at a time or, with
+FAVORITE_GROUP_COMMIT on, batched with the writes of concurrent requests.
+
+In group commit mode the first request to arrive waits GROUP_COMMIT_WINDOW_MS
+(or until GROUP_COMMIT_MAX_OPS writes are queued), then commits everything
+queued so far in one transaction and wakes up the other requests. Each of
+them only answers once the transaction holding its write has committed.
+Batches only fill up when a worker serves requests concurrently, so use it
+with the gthread or gevent profiles from gunicorn.conf.py.
+"""
+import os
+import threading
+import time
+from flask import current_app
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.orm import Session
+from models import db, FavoriteCharacter, FavoritePlanet
+from query_budget import unbudgeted
+
+ITEM_KEYS = {FavoriteCharacter: "character_id", FavoritePlanet: "planet_id"}
+BATCH_ATTEMPTS = 3
+
+
+class FavoriteWrite:
+    def __init__(self, action, model, user_id, item_id):
+        self.action = action
+        self.model = model
+        self.user_id = user_id
+        self.item_id = item_id
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+    @property
+    def key(self):
+        return (self.model, self.user_id, self.item_id)
+
+
+def apply_writes(session, writes):
+    # One SELECT per favorite table for every pair in the batch, then the
+    # writes are applied in arrival order against that state.
+    state = {}
+    for model, item_key in ITEM_KEYS.items():
+        pairs = {(w.user_id, w.item_id) for w in writes if w.model is model}
+        if not pairs:
+            continue
+        # Both INs seek the unique (user_id, item) index, a row value IN on
+        # the pair does not on SQLite. Extra combinations are dropped here.
+        item = getattr(model, item_key)
+        rows = session.scalars(select(model).where(
+            model.user_id.in_({user_id for user_id, _ in pairs}),
+            item.in_({item_id for _, item_id in pairs}),
+        ))
+        for fav in rows:
+            if (fav.user_id, getattr(fav, item_key)) in pairs:
+                state[(model, fav.user_id, getattr(fav, item_key))] = fav
+
+    for write in writes:
+        fav = state.get(write.key)
+        if write.action == "add":
+            if fav is None:
+                if write.key in state:
+                    # Removed earlier in this batch, the DELETE has to reach
+                    # the unique index before the INSERT does
+                    session.flush()
+                fav = write.model(user_id=write.user_id, **{ITEM_KEYS[write.model]: write.item_id})
+                session.add(fav)
+                state[write.key] = fav
+            write.result = True
+        else:
+            if fav is not None:
+                if fav in session.new:
+                    session.expunge(fav)
+                else:
+                    session.delete(fav)
+                state[write.key] = None
+            write.result = fav is not None
+
+
+def commit_writes(engine, writes):
+    for attempt in range(BATCH_ATTEMPTS):
+        try:
+            with Session(engine) as session:
+                apply_writes(session, writes)
+                session.commit()
+            return
+        except OperationalError:
+            # The database was locked, read the state again and retry
+            if attempt == BATCH_ATTEMPTS - 1:
+                raise
+
+
+def commit_batch(engine, writes):
+    try:
+        commit_writes(engine, writes)
+    except IntegrityError:
+        # Retrying the batch would fail it again, and one request's bad write
+        # (an item that doesn't exist, a duplicate from another process) must
+        # not fail the others: commit each write alone, only that one errors.
+        for write in writes:
+            try:
+                commit_writes(engine, [write])
+            except Exception as error:
+                write.error = error
+
+
+class GroupCommitter:
+
+    def __init__(self, window, max_ops):
+        self.window = window
+        self.max_ops = max_ops
+        self.condition = threading.Condition()
+        # One batch commits at a time, the next one fills up meanwhile
+        self.committing = threading.Lock()
+        self.pending = []
+        self.leader = False
+
+    def submit(self, write):
+        with self.condition:
+            self.pending.append(write)
+            leader = not self.leader
+            if leader:
+                self.leader = True
+            elif len(self.pending) >= self.max_ops:
+                self.condition.notify_all()
+
+        if leader:
+            with self.committing:
+                with self.condition:
+                    deadline = time.monotonic() + self.window
+                    while len(self.pending) < self.max_ops:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self.condition.wait(remaining)
+                    batch, self.pending = self.pending, []
+                    # The next request to arrive leads the next batch
+                    self.leader = False
+                try:
+                    with unbudgeted():
+                        commit_batch(db.engine, batch)
+                except Exception as error:
+                    for queued in batch:
+                        queued.error = error
+                finally:
+                    for queued in batch:
+                        queued.done.set()
+        else:
+            write.done.wait()
+
+        if write.error is not None:
+            raise write.error
+        return write.result
+
+
+def write_favorite(action, model, user_id, item_id):
+    committer = current_app.extensions.get("group_commit")
+    if committer is not None:
+        # Hand the request's connection back to the pool while it waits, the
+        # batch needs one and every queued request would otherwise hold its own
+        db.session.close()
+        result = committer.submit(FavoriteWrite(action, model, user_id, item_id))
+        # Keep this client on the primary for a while, see db_routing.py
+        db.session.info["wrote"] = True
+        return result
+
+    item_key = ITEM_KEYS[model]
+    fav = model.query.filter_by(user_id=user_id, **{item_key: item_id}).first()
+    if action == "add":
+        if fav is None:
+            try:
+                db.session.add(model(user_id=user_id, **{item_key: item_id}))
+                db.session.commit()
+            except IntegrityError:
+                # Another request added the same favorite first
+                db.session.rollback()
+        return True
+    if fav is None:
+        return False
+    db.session.delete(fav)
+    db.session.commit()
+    return True
+
+
+def add_favorite(model, user_id, item_id):
+    return write_favorite("add", model, user_id, item_id)
+
+
+def remove_favorite(model, user_id, item_id):
+    return write_favorite("delete", model, user_id, item_id)
+
+
+def setup_group_commit(app):
+    app.config.setdefault("FAVORITE_GROUP_COMMIT", False)
+    app.config.setdefault("GROUP_COMMIT_WINDOW_MS", float(os.getenv("GROUP_COMMIT_WINDOW_MS", 2)))
+    app.config.setdefault("GROUP_COMMIT_MAX_OPS", int(os.getenv("GROUP_COMMIT_MAX_OPS", 64)))
+    if app.config["FAVORITE_GROUP_COMMIT"]:
+        app.extensions["group_commit"] = GroupCommitter(
+            app.config["GROUP_COMMIT_WINDOW_MS"] / 1000, app.config["GROUP_COMMIT_MAX_OPS"]
+        )
@@ -0,0 +1,88 @@
+"""
+Gunicorn settings. gunicorn reads the -c file before it applies --chdir, so
+from the repo root the path includes src/:
+
+    gunicorn wsgi --chdir ./src/ -c src/gunicorn.conf.py
+
+GUNICORN_PROFILE selects the worker type:
+
+    sync     one request at a time per worker (gunicorn's default)
+    gthread  a pool of GUNICORN_THREADS threads per worker
+    gevent   up to GUNICORN_WORKER_CONNECTIONS greenlets per worker
+
+Each profile starts a small fixed number of workers, so a small instance
+doesn't run out of memory; raise it with WEB_CONCURRENCY. The app is loaded once in
+the master (preload_app) and shared copy-on-write with the workers, and every
+worker throws away the database connections it inherited after the fork. With
+ADMISSION_CONTROL=1 the workers share their token buckets through a SQLite
+file in /dev/shm, one per master (see admission.py).
+"""
+import os
+import tempfile
+
+profile = os.getenv("GUNICORN_PROFILE", "sync")
+
+PROFILES = {
+    "sync": {"worker_class": "sync", "workers": 2},
+    "gthread": {"worker_class": "gthread", "workers": 1},
+    "gevent": {"worker_class": "gevent", "workers": 1},
+}
+if profile not in PROFILES:
+    raise RuntimeError(f"GUNICORN_PROFILE must be one of {', '.join(PROFILES)}, not {profile!r}")
+
+if profile == "gevent":
+    # Patch before the app is preloaded, otherwise the locks and sockets
+    # created at import time (SQLAlchemy pool, caches) would block the hub.
+    from gevent import monkey
+    monkey.patch_all()
+
+worker_class = PROFILES[profile]["worker_class"]
+workers = int(os.getenv("WEB_CONCURRENCY", PROFILES[profile]["workers"]))
+threads = int(os.getenv("GUNICORN_THREADS", 8 if profile == "gthread" else 1))
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", 1000))
+preload_app = True
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 30))
+keepalive = 5
+accesslog = os.getenv("GUNICORN_ACCESS_LOG")
+
+# Set before the app is preloaded, which is when admission.py reads it
+admission_db = None
+if not os.getenv("ADMISSION_DB"):
+    shm = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    admission_db = os.environ["ADMISSION_DB"] = os.path.join(shm, f"admission-{os.getpid()}.db")
+
+
+def post_fork(server, worker):
+    from wsgi import application
+    from models import db
+
+    # Connections opened by the master must not be shared with the workers,
+    # close=False leaves them alone for the master and just empties this pool.
+    with application.app_context():
+        engines = list(db.engines.values())
+    for engine in engines:
+        engine.dispose(close=False)
+
+    if profile == "gevent" and any(engine.dialect.name == "postgresql" for engine in engines):
+        # psycopg2 blocks the whole worker unless it waits through gevent.
+        # db.session itself is safe: Flask-SQLAlchemy scopes it to the app
+        # context, which lives in a contextvar and so is per greenlet.
+        try:
+            from psycogreen.gevent import patch_psycopg
+            patch_psycopg()
+        except ImportError:
+            server.log.warning("psycogreen is not installed, Postgres queries will block the gevent worker")
+
+
+def child_exit(server, worker):
+    # Drop the dead worker's live samples from the shared /metrics files
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
+
+
+def on_exit(server):
+    if admission_db is not None:
+        for path in (admission_db, admission_db + "-wal", admission_db + "-shm"):
+            if os.path.exists(path):
+                os.remove(path)
@@ -0,0 +1,68 @@
+"""
+Prometheus metrics for the API: request count, latency and response size per
+endpoint, plus the number of SQL queries and the time spent in them for
+every request, counted by the listeners in query_budget.py. Everything is
+exposed in /metrics.
+
+When gunicorn runs several workers, set PROMETHEUS_MULTIPROC_DIR to an empty
+directory before starting it, every worker writes its samples there and
+/metrics adds them up.
+"""
+import os
+import time
+from flask import g, request, Response
+from prometheus_client import (Counter, Histogram, CollectorRegistry, generate_latest,
+                               CONTENT_TYPE_LATEST, REGISTRY, multiprocess)
+
+REQUEST_COUNT = Counter(
+    "http_requests_total", "HTTP requests handled",
+    ["method", "endpoint", "status"])
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "Time spent handling a request",
+    ["method", "endpoint"])
+RESPONSE_SIZE = Histogram(
+    "http_response_size_bytes", "Size of the response body",
+    ["method", "endpoint"],
+    buckets=(100, 1000, 10000, 100000, 1000000, 10000000))
+SQL_QUERIES = Histogram(
+    "sql_queries_per_request", "SQL statements executed by a request",
+    ["method", "endpoint"],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100))
+SQL_DURATION = Histogram(
+    "sql_duration_per_request_seconds", "Time a request spent waiting on SQL statements",
+    ["method", "endpoint"])
+
+
+def endpoint_label():
+    # Use the route template (/people/<int:people_id>) so ids don't blow up the label set
+    return request.url_rule.rule if request.url_rule is not None else "not_found"
+
+
+def setup_metrics(app):
+
+    @app.before_request
+    def start_timer():
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        if "request_start" not in g or request.path == "/metrics":
+            return response
+        method, endpoint = request.method, endpoint_label()
+        REQUEST_COUNT.labels(method, endpoint, response.status_code).inc()
+        REQUEST_LATENCY.labels(method, endpoint).observe(time.perf_counter() - g.request_start)
+        if response.content_length is not None:
+            RESPONSE_SIZE.labels(method, endpoint).observe(response.content_length)
+        # Not there for a request turned away before the query budget started
+        SQL_QUERIES.labels(method, endpoint).observe(g.get("sql_queries", 0))
+        SQL_DURATION.labels(method, endpoint).observe(g.get("sql_duration", 0.0))
+        return response
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry = REGISTRY
+        return Response(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
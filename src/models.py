@@ -1,54 +1,122 @@
 from flask_sqlalchemy import SQLAlchemy
+from collections import Counter
+from sqlalchemy import event, select, update, insert, literal, union_all, func, inspect
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session, validates
+from werkzeug.security import generate_password_hash, check_password_hash
+from db_routing import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 
-class User(db.Model):
+# How the hashes written by generate_password_hash() start
+PASSWORD_HASH_METHODS = ("scrypt:", "pbkdf2:")
+
+class Serializable:
+    # Fields sent by the API, in order. Both serialize() on an instance and the
+    # column projected queries in serializers.py are built from this list.
+    serialize_fields = ()
+
+    def serialize(self):
+        return {field: getattr(self, field) for field in self.serialize_fields}
+
+    @classmethod
+    def serialize_columns(cls, fields=None):
+        return [getattr(cls, field) for field in fields or cls.serialize_fields]
+
+class User(Serializable, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(120), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
-    password = db.Column(db.String(80), unique=False, nullable=False)
+    # A werkzeug hash, scrypt ones take 162 characters
+    password = db.Column(db.String(256), unique=False, nullable=False)
     is_active = db.Column(db.Boolean(), unique=False, nullable=False)
 
-    def serialize(self):
-        return {
-            "id": self.id,
-            "username" : self.username,
-            "email": self.email,
-        }
+    serialize_fields = ("id", "username", "email")
+    # Fields of each entry in favorites(), people have character_id and planets planet_id
+    favorite_fields = ("id", "character_id", "planet_id", "name")
+
+    @validates("password")
+    def hash_password(self, key, password):
+        # Whoever sets it (the admin, a fixture), only the hash is stored
+        if password.startswith(PASSWORD_HASH_METHODS):
+            return password
+        return generate_password_hash(password)
+
+    def check_password(self, password):
+        return check_password_hash(self.password, password)
+
+    def favorites_query(self, with_names=True):
+        # Both kinds of favorites with the names embedded, in one UNION ALL
+        # query that goes through the (user_id, ...) unique indexes. Without
+        # the names it never leaves the favorite tables.
+        characters = (
+            select(literal("character").label("kind"), FavoriteCharacter.id,
+                   FavoriteCharacter.character_id.label("item_id"))
+            .where(FavoriteCharacter.user_id == self.id)
+        )
+        planets = (
+            select(literal("planet").label("kind"), FavoritePlanet.id,
+                   FavoritePlanet.planet_id.label("item_id"))
+            .where(FavoritePlanet.user_id == self.id)
+        )
+        if with_names:
+            characters = characters.add_columns(Character.name).join(
+                Character, Character.id == FavoriteCharacter.character_id)
+            planets = planets.add_columns(Planet.name).join(
+                Planet, Planet.id == FavoritePlanet.planet_id)
+        return union_all(characters, planets)
+
+    @staticmethod
+    def group_favorites(rows, fields=None):
+        fields = fields or User.favorite_fields
+        result = {"people": [], "planets": []}
+        for kind, fav_id, item_id, *name in rows:
+            if kind == "character":
+                fav = {"id": fav_id, "character_id": item_id, "name": name[0] if name else None}
+                result["people"].append({field: fav[field] for field in fields if field in fav})
+            else:
+                fav = {"id": fav_id, "planet_id": item_id, "name": name[0] if name else None}
+                result["planets"].append({field: fav[field] for field in fields if field in fav})
+        return result
+
+    def favorites(self, fields=None):
+        with_names = fields is None or "name" in fields
+        return User.group_favorites(db.session.execute(self.favorites_query(with_names)), fields)
 
     # def __repr__(self):
     #     return '<User %r>' % self.username
 
-class Character(db.Model):
+class Character(Serializable, db.Model):
     __tablename__ = 'character'
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(200), nullable=False)
+    # Prefix search, see search.py
+    __table_args__ = (db.Index('ix_character_name_lower', db.func.lower(name)),)
 
     def __repr__(self):
         return '<User %r>' % self.name
 
-    def serialize(self):
-        return {
-            "id" : self.id,
-            "name" : self.name
-        }
+    serialize_fields = ("id", "name")
 
-class Planet(db.Model):
+class Planet(Serializable, db.Model):
     __tablename__ = 'planet'
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(200), nullable=False)
+    # Prefix search, see search.py
+    __table_args__ = (db.Index('ix_planet_name_lower', db.func.lower(name)),)
 
     def __repr__(self):
         return '<User %r>' % self.name
 
-    def serialize(self):
-        return {
-            "id" : self.id,
-            "name" : self.name
-        }
+    serialize_fields = ("id", "name")
 
-class FavoriteCharacter(db.Model):
+class FavoriteCharacter(Serializable, db.Model):
     __tablename__ = 'favorite_character'
+    __table_args__ = (
+        db.Index('ix_favorite_character_user_id_character_id', 'user_id', 'character_id', unique=True),
+        # Admin filter and lookups by item, see admin.py
+        db.Index('ix_favorite_character_character_id', 'character_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
 
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
@@ -57,15 +125,15 @@ class FavoriteCharacter(db.Model):
     character_id = db.Column(db.Integer, db.ForeignKey('character.id'))
     character = db.relationship(Character)
 
-    def serialize(self):
-        return {
-            "id" : self.id,
-            "user_id" : self.user_id,
-            "character_id" : self.character_id,
-        }
+    serialize_fields = ("id", "user_id", "character_id")
 
-class FavoritePlanet(db.Model):
+class FavoritePlanet(Serializable, db.Model):
     __tablename__ = 'favorite_planet'
+    __table_args__ = (
+        db.Index('ix_favorite_planet_user_id_planet_id', 'user_id', 'planet_id', unique=True),
+        # Admin filter and lookups by item, see admin.py
+        db.Index('ix_favorite_planet_planet_id', 'planet_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
 
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
@@ -74,9 +142,253 @@ class FavoritePlanet(db.Model):
     planet_id = db.Column(db.Integer, db.ForeignKey('planet.id'))
     planet = db.relationship(Planet)
 
-    def serialize(self):
-        return {
-            "id" : self.id,
-            "user_id" : self.user_id,
-            "planet_id" : self.planet_id
-        }
\ No newline at end of file
+    serialize_fields = ("id", "user_id", "planet_id")
+
+# How many users have each character/planet in their favorites. The favorite
+# handlers and Flask-Admin keep it in step through the after_flush listener
+# below, "flask rebuild-popularity" recomputes it from scratch if it drifts.
+class PopularityCounter:
+    item_model = None
+    favorite_model = None
+    item_key = None
+
+    @classmethod
+    def add(cls, connection, deltas):
+        table = cls.__table__
+        item = table.c[cls.item_key]
+        for item_id, delta in sorted(deltas.items()):
+            if delta == 0:
+                continue
+            if connection.dialect.name in ("postgresql", "sqlite"):
+                # Atomic upsert, two users adding the first favorite of an item
+                # at the same time must not fail each other's transaction
+                dialect_insert = postgresql.insert if connection.dialect.name == "postgresql" else sqlite.insert
+                statement = dialect_insert(table).values({cls.item_key: item_id, "count": max(delta, 0)})
+                connection.execute(statement.on_conflict_do_update(
+                    index_elements=[item], set_={"count": table.c.count + delta}
+                ))
+            else:
+                result = connection.execute(
+                    update(table).where(item == item_id).values(count=table.c.count + delta)
+                )
+                if result.rowcount == 0 and delta > 0:
+                    connection.execute(insert(table).values({cls.item_key: item_id, "count": delta}))
+
+    @classmethod
+    def top(cls, limit, fields=None):
+        # Walks ix_<table>_count from the top, so the cost only depends on limit
+        counter = cls.__table__
+        fields = fields or cls.item_model.serialize_fields + ("favorites",)
+        columns = [counter.c.count.label("favorites") if field == "favorites" else getattr(cls.item_model, field)
+                   for field in fields]
+        query = (
+            select(*columns)
+            .join_from(counter, cls.item_model, counter.c[cls.item_key] == cls.item_model.id)
+            .where(counter.c.count > 0)
+            .order_by(counter.c.count.desc(), counter.c[cls.item_key])
+            .limit(limit)
+        )
+        return [dict(row) for row in db.session.execute(query).mappings()]
+
+    @classmethod
+    def rebuild(cls, connection):
+        favorite = cls.favorite_model.__table__
+        item = favorite.c[cls.item_key]
+        if connection.dialect.name == "postgresql":
+            # Hold off favorite writes while the counts are recomputed
+            connection.exec_driver_sql(f'LOCK TABLE "{favorite.name}" IN SHARE MODE')
+        connection.execute(cls.__table__.delete())
+        result = connection.execute(insert(cls.__table__).from_select(
+            [cls.item_key, "count"],
+            select(item, func.count()).where(item.isnot(None)).group_by(item),
+        ))
+        TableVersion.bump(connection, {cls.__tablename__})
+        return result.rowcount
+
+class CharacterPopularity(PopularityCounter, db.Model):
+    __tablename__ = 'character_popularity'
+    character_id = db.Column(db.Integer, db.ForeignKey('character.id', ondelete='CASCADE'), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    __table_args__ = (db.Index('ix_character_popularity_count', count.desc(), character_id),)
+
+    item_model = Character
+    favorite_model = FavoriteCharacter
+    item_key = "character_id"
+
+class PlanetPopularity(PopularityCounter, db.Model):
+    __tablename__ = 'planet_popularity'
+    planet_id = db.Column(db.Integer, db.ForeignKey('planet.id', ondelete='CASCADE'), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    __table_args__ = (db.Index('ix_planet_popularity_count', count.desc(), planet_id),)
+
+    item_model = Planet
+    favorite_model = FavoritePlanet
+    item_key = "planet_id"
+
+POPULARITY_COUNTERS = {counter.favorite_model: counter for counter in (CharacterPopularity, PlanetPopularity)}
+
+# Every table gets a counter that goes up on each write, the read endpoints
+# build their ETag from it so an unchanged table costs one primary key lookup.
+class TableVersion(db.Model):
+    __tablename__ = 'table_version'
+    name = db.Column(db.String(80), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+    @staticmethod
+    def current(names):
+        rows = db.session.execute(
+            select(TableVersion.name, TableVersion.version).where(TableVersion.name.in_(names))
+        )
+        versions = dict(rows.all())
+        return [(name, versions.get(name, 0)) for name in names]
+
+    @staticmethod
+    def bump(connection, names):
+        table = TableVersion.__table__
+        if connection.dialect.name in ("postgresql", "sqlite"):
+            # One upsert for every table, the first bump of a table can't fail
+            # a concurrent one with a duplicate key. Sorted, so concurrent
+            # writers lock the rows in the same order.
+            dialect_insert = postgresql.insert if connection.dialect.name == "postgresql" else sqlite.insert
+            statement = dialect_insert(table).values([{"name": name, "version": 1} for name in sorted(names)])
+            connection.execute(statement.on_conflict_do_update(
+                index_elements=[table.c.name], set_={"version": table.c.version + 1}
+            ))
+            return
+        for name in sorted(names):
+            result = connection.execute(
+                update(TableVersion.__table__)
+                .where(TableVersion.name == name)
+                .values(version=TableVersion.version + 1)
+            )
+            if result.rowcount == 0:
+                connection.execute(insert(TableVersion.__table__).values(name=name, version=1))
+
+# Position reached by a long running job (bulk imports, backfills), saved in
+# the same transaction as the rows it covers so a crash never loses or repeats a batch.
+class Checkpoint(db.Model):
+    __tablename__ = 'checkpoint'
+    name = db.Column(db.String(250), primary_key=True)
+    position = db.Column(db.BigInteger, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, server_default=db.func.now(), onupdate=db.func.now())
+    # Only known for the online backfills (migrations/online.py): the last
+    # key they have to reach, and when they started and finished
+    total = db.Column(db.BigInteger)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    @staticmethod
+    def get(name):
+        return db.session.execute(select(Checkpoint.position).where(Checkpoint.name == name)).scalar() or 0
+
+    @staticmethod
+    def save(connection, name, position):
+        result = connection.execute(
+            update(Checkpoint.__table__).where(Checkpoint.name == name)
+            .values(position=position, updated_at=db.func.now())
+        )
+        if result.rowcount == 0:
+            connection.execute(insert(Checkpoint.__table__).values(name=name, position=position))
+
+    @staticmethod
+    def clear(name):
+        db.session.execute(Checkpoint.__table__.delete().where(Checkpoint.name == name))
+
+# Append-only log of the writes to the tables clients keep a copy of, read
+# back by /changes?since=<seq> (see changes.py). Favorites carry their owner
+# so each user only gets their own.
+class ChangeLog(db.Model):
+    __tablename__ = 'change_log'
+    # AUTOINCREMENT on SQLite, a seq is never handed out twice even after compaction
+    seq = db.Column(db.BigInteger().with_variant(db.Integer, "sqlite"), primary_key=True)
+    table_name = db.Column(db.String(50), nullable=False)
+    row_id = db.Column(db.Integer, nullable=False)
+    op = db.Column(db.String(10), nullable=False)
+    user_id = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, nullable=False, server_default=db.func.now())
+    __table_args__ = (
+        # Compaction looks for a later entry of the same row
+        db.Index('ix_change_log_row', 'table_name', 'row_id', 'seq'),
+        {"sqlite_autoincrement": True},
+    )
+
+    # Taken by every transaction that writes to the log, until it commits, so
+    # on Postgres seqs become visible in order and a reader that is past a seq
+    # never misses a smaller one committed later
+    LOCK_ID = 7102
+
+    @staticmethod
+    def record(connection, entries):
+        if connection.dialect.name == "postgresql":
+            connection.execute(select(func.pg_advisory_xact_lock(ChangeLog.LOCK_ID)))
+        connection.execute(insert(ChangeLog.__table__), entries)
+
+CHANGE_LOG_TABLES = {"character", "planet", "favorite_character", "favorite_planet"}
+
+def pending_changes(session):
+    entries = []
+    for objects, op in ((session.new, "insert"), (session.dirty, "update"), (session.deleted, "delete")):
+        for obj in objects:
+            table = getattr(obj, "__tablename__", None)
+            if table not in CHANGE_LOG_TABLES:
+                continue
+            if op == "update" and not session.is_modified(obj, include_collections=False):
+                continue
+            user_id = getattr(obj, "user_id", None)
+            entry_op = op
+            if op == "update" and table.startswith("favorite_"):
+                previous = inspect(obj).attrs.user_id.history.deleted
+                if previous and previous[0] != user_id:
+                    # Given to another user in Flask-Admin: gone for one, new for the other
+                    entries.append({"table_name": table, "row_id": obj.id, "op": "delete", "user_id": previous[0]})
+                    entry_op = "insert"
+            entries.append({"table_name": table, "row_id": obj.id, "op": entry_op, "user_id": user_id})
+    return entries
+
+def popularity_deltas(session):
+    deltas = {}
+    for objects, sign in ((session.new, 1), (session.deleted, -1), (session.dirty, 0)):
+        for obj in objects:
+            counter = POPULARITY_COUNTERS.get(type(obj))
+            if counter is None:
+                continue
+            changes = deltas.setdefault(counter, Counter())
+            if sign:
+                item_id = getattr(obj, counter.item_key)
+                if item_id is not None:
+                    changes[item_id] += sign
+            else:
+                # A favorite moved to another item, e.g. edited in Flask-Admin
+                history = inspect(obj).attrs[counter.item_key].history
+                for item_id in history.added:
+                    if item_id is not None:
+                        changes[item_id] += 1
+                for item_id in history.deleted:
+                    if item_id is not None:
+                        changes[item_id] -= 1
+    return {counter: changes for counter, changes in deltas.items() if any(changes.values())}
+
+# Runs on every flush, so the API handlers and the Flask-Admin views both bump
+# the version of whatever table they touched inside the same transaction.
+@event.listens_for(Session, "after_flush")
+def bump_table_versions(session, flush_context):
+    names = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        table = getattr(obj, "__tablename__", None)
+        if table and table != TableVersion.__tablename__:
+            names.add(table)
+    for counter, deltas in popularity_deltas(session).items():
+        counter.add(session.connection(), deltas)
+        names.add(counter.__tablename__)
+    if names:
+        TableVersion.bump(session.connection(), names)
+        # Keep the rest of the request on the primary, see db_routing.py
+        session.info["wrote"] = True
+
+# Same hook for the change log: the favorite handlers (both with and without
+# group commit), Flask-Admin and anything else going through a session.
+@event.listens_for(Session, "after_flush")
+def log_changes(session, flush_context):
+    entries = pending_changes(session)
+    if entries:
+        ChangeLog.record(session.connection(), entries)
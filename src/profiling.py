@@ -0,0 +1,263 @@
+"""
+Profiles single requests on demand, to see where the time of a slow endpoint
+goes inside the worker.
+
+With PROFILING on and a PROFILE_SECRET set, a request with an X-Profile
+header signed with that secret (`flask profile-token` prints one, valid for
+PROFILE_TOKEN_MAX_AGE seconds) runs under a deterministic profiler,
+sys.setprofile on its thread. Without PROFILE_SECRET nothing is installed:
+the JWT key has a default anyone can read, so it isn't used to sign these.
+The response gets a Server-Timing header with the milliseconds spent in
+
+    routing     outside the view: URL matching, the before and after request
+                hooks, building the response
+    view        the view's own code
+    sqlalchemy  building and running the queries, reading the rows
+    serialize   Model.serialize() and the row to dict helpers of serializers.py
+    jsonify     encoding the body, jsonify() and json_response()
+
+and its call stacks are saved in PROFILE_DIR as collapsed stacks (one
+"frame;frame;frame microseconds" line per stack, for flamegraph.pl or
+speedscope) or as a speedscope file, see PROFILE_FORMAT. The path is in the
+log, not in the response. The profiler makes every Python call several times
+slower, so compare the parts with each other, not with an unprofiled request.
+
+With PROFILING off nothing is installed and requests pay nothing for it. To
+profile a route without a server, against DATABASE_URL:
+
+    $ flask profile GET "/people?limit=1000"
+    $ flask profile POST /favorite/planet/3 --user 1 --format speedscope
+"""
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+
+HEADER = "X-Profile"
+# A list `flask profile` puts in the environ through the test client, the
+# request is profiled and the path appended to it. A remote client can only
+# send HTTP_ keys.
+SAVED_KEY = "profiling.saved"
+CATEGORIES = ("routing", "view", "sqlalchemy", "serialize", "jsonify")
+FORMATS = {"collapsed": "collapsed.txt", "speedscope": "speedscope.json"}
+SPEEDSCOPE_SCHEMA = "https://www.speedscope.app/file-format-schema.json"
+
+
+def frame_category(filename, function):
+    if f"{os.sep}sqlalchemy{os.sep}" in filename or f"{os.sep}flask_sqlalchemy{os.sep}" in filename:
+        return "sqlalchemy"
+    serializers = filename.endswith(f"{os.sep}serializers.py")
+    # Not every dumps(), Flask's session cookie has one too
+    if function in ("jsonify", "json_response") or (serializers and function == "dumps") or filename == "orjson":
+        return "jsonify"
+    # stream_ndjson() turns rows into dicts in its generator, after the view returned
+    streaming = function == "generate" and filename.endswith(f"{os.sep}utils.py")
+    if function in ("serialize", "rows_as_dicts") or serializers or streaming:
+        return "serialize"
+    if function == "dispatch_request" and filename.endswith(f"{os.sep}flask{os.sep}app.py"):
+        return "view"
+    return None
+
+
+def short_filename(filename):
+    for marker in ("site-packages" + os.sep, os.sep + "src" + os.sep):
+        if marker in filename:
+            return filename.rsplit(marker, 1)[1]
+    return os.path.basename(filename)
+
+
+class CallTree:
+    """Self time of every call stack seen by sys.setprofile on this thread."""
+
+    def __init__(self):
+        # Node 0 is the request itself, every other one a call under its parent
+        self.frames = [("request", "", "")]
+        self.parents = [None]
+        self.self_time = [0.0]
+        self._children = {}
+        self._stack = [0]
+        self._last = 0.0
+
+    def _push(self, key, label, filename, function):
+        parent = self._stack[-1]
+        node = self._children.get((parent, key))
+        if node is None:
+            node = len(self.frames)
+            self._children[(parent, key)] = node
+            self.frames.append((label, filename, function))
+            self.parents.append(parent)
+            self.self_time.append(0.0)
+        self._stack.append(node)
+
+    def _event(self, frame, event, arg):
+        self.self_time[self._stack[-1]] += time.perf_counter() - self._last
+        if event == "call":
+            code = frame.f_code
+            self._push(code, f"{code.co_name} ({short_filename(code.co_filename)}:{code.co_firstlineno})",
+                       code.co_filename, code.co_name)
+        elif event == "c_call":
+            name = getattr(arg, "__qualname__", None) or getattr(arg, "__name__", "?")
+            module = getattr(arg, "__module__", None) or "builtins"
+            self._push((module, name), f"{name} ({module})", module, name)
+        elif len(self._stack) > 1:
+            # return, c_return and c_exception. Returns from frames that were
+            # running before the profiler started are left at the root.
+            self._stack.pop()
+        self._last = time.perf_counter()
+
+    def start(self):
+        self._last = time.perf_counter()
+        sys.setprofile(self._event)
+
+    def stop(self):
+        sys.setprofile(None)
+
+    def stacks(self):
+        for node in range(1, len(self.frames)):
+            if self.self_time[node] <= 0:
+                continue
+            path = []
+            parent = node
+            while parent:
+                path.append(parent)
+                parent = self.parents[parent]
+            yield path[::-1], self.self_time[node]
+
+    def breakdown(self):
+        # Each stack goes to the closest frame with a category, from the leaf up
+        totals = dict.fromkeys(CATEGORIES, 0.0)
+        categories = {0: "routing"}
+        for node in range(1, len(self.frames)):
+            category = frame_category(*self.frames[node][1:])
+            categories[node] = category or categories[self.parents[node]]
+        for node, seconds in enumerate(self.self_time):
+            totals[categories[node]] += seconds
+        return totals
+
+
+def write_collapsed(tree, f):
+    for path, seconds in tree.stacks():
+        label = ";".join(tree.frames[node][0].replace(";", ",") for node in path)
+        f.write(f"{label} {round(seconds * 1e6)}\n")
+
+
+def write_speedscope(tree, f, name):
+    frames, indexes, samples, weights = [], {}, [], []
+    for path, seconds in tree.stacks():
+        sample = []
+        for node in path:
+            label, filename, _ = tree.frames[node]
+            if label not in indexes:
+                indexes[label] = len(frames)
+                frames.append({"name": label, "file": filename})
+            sample.append(indexes[label])
+        samples.append(sample)
+        weights.append(round(seconds * 1e6))
+    json.dump({
+        "$schema": SPEEDSCOPE_SCHEMA,
+        "name": name,
+        "shared": {"frames": frames},
+        "profiles": [{
+            "type": "sampled", "name": name, "unit": "microseconds",
+            "startValue": 0, "endValue": sum(weights), "samples": samples, "weights": weights,
+        }],
+    }, f)
+
+
+def save(tree, directory, output_format, method, path):
+    os.makedirs(directory, exist_ok=True)
+    slug = re.sub(r"[^A-Za-z0-9]+", "_", path).strip("_") or "root"
+    stamp = time.strftime("%Y%m%dT%H%M%S")
+    filename = os.path.join(directory, f"{stamp}-{os.getpid()}-{method}-{slug[:80]}.{FORMATS[output_format]}")
+    with open(filename, "w") as f:
+        if output_format == "speedscope":
+            write_speedscope(tree, f, f"{method} {path}")
+        else:
+            write_collapsed(tree, f)
+    return filename
+
+
+def server_timing(breakdown):
+    return ", ".join(f"{category};dur={seconds * 1000:.2f}" for category, seconds in breakdown.items())
+
+
+def signer(app):
+    return URLSafeTimedSerializer(app.config["PROFILE_SECRET"], salt="profile")
+
+
+def make_token(app):
+    return signer(app).dumps("profile")
+
+
+def valid_token(app, token):
+    if not app.config["PROFILE_SECRET"]:
+        return False
+    try:
+        signer(app).loads(token, max_age=app.config["PROFILE_TOKEN_MAX_AGE"])
+        return True
+    except BadSignature:
+        return False
+
+
+class ProfilingMiddleware:
+    """Runs the requests with a valid X-Profile header under a CallTree."""
+
+    def __init__(self, wsgi_app, app):
+        self.wsgi_app = wsgi_app
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        token = environ.get("HTTP_X_PROFILE")
+        # Without a good signature the request runs as if the header wasn't there
+        if SAVED_KEY not in environ and (token is None or not valid_token(self.app, token)):
+            return self.wsgi_app(environ, start_response)
+
+        started, body = {}, []
+
+        def capture(status, headers, exc_info=None):
+            started.update(status=status, headers=headers, exc_info=exc_info)
+            return body.append
+
+        tree = CallTree()
+        tree.start()
+        try:
+            result = self.wsgi_app(environ, capture)
+            # The body too, a streamed or lazily encoded one is written here
+            try:
+                body.extend(result)
+            finally:
+                if hasattr(result, "close"):
+                    result.close()
+        finally:
+            tree.stop()
+
+        method, path = environ["REQUEST_METHOD"], environ.get("PATH_INFO", "/")
+        breakdown = tree.breakdown()
+        filename = save(tree, self.app.config["PROFILE_DIR"], self.app.config["PROFILE_FORMAT"], method, path)
+        self.app.logger.info("Profiled %s %s: %s, saved in %s", method, path, server_timing(breakdown), filename)
+        environ.get(SAVED_KEY, []).append(filename)
+        headers = list(started["headers"]) + [("Server-Timing", server_timing(breakdown))]
+        start_response(started["status"], headers, started["exc_info"])
+        return body
+
+
+def install(app):
+    if not isinstance(app.wsgi_app, ProfilingMiddleware):
+        app.wsgi_app = ProfilingMiddleware(app.wsgi_app, app)
+
+
+def setup_profiling(app):
+    app.config.setdefault("PROFILE_DIR", os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "profiles")))
+    app.config.setdefault("PROFILE_FORMAT", os.getenv("PROFILE_FORMAT", "collapsed"))
+    app.config.setdefault("PROFILE_TOKEN_MAX_AGE", int(os.getenv("PROFILE_TOKEN_MAX_AGE", 3600)))
+    app.config.setdefault("PROFILE_SECRET", os.getenv("PROFILE_SECRET"))
+    app.config.setdefault("PROFILING", False)
+    if not app.config["PROFILING"]:
+        return
+    if not app.config["PROFILE_SECRET"]:
+        app.logger.warning("PROFILING is on but PROFILE_SECRET is not set, requests won't be profiled")
+        return
+    install(app)
@@ -0,0 +1,122 @@
+"""
+Per request query budget, to catch N+1 patterns like a serializer that walks
+FavoriteCharacter.character and lazy loads it once per row.
+
+Each endpoint has a maximum number of SQL statements in QUERY_BUDGETS
+(endpoint name -> count, anything missing uses QUERY_BUDGET_DEFAULT). Going
+over the budget raises QueryBudgetExceeded when QUERY_BUDGET_RAISE is on.
+Left unset it follows app.testing, read when the query runs, so setting
+app.testing after create_app() is enough. Otherwise the request is logged
+with the statements it ran.
+
+The listeners here are the only ones on the request's SQL: they also count
+and time every statement in g.sql_queries and g.sql_duration for metrics.py.
+"""
+import time
+from contextlib import contextmanager
+from flask import g, request, current_app, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Expected number of statements per endpoint, keep these in sync with the routes
+DEFAULT_BUDGETS = {
+    "sitemap": 0,
+    "api.login": 1,
+    "metrics": 0,
+    "api.get_users": 1,
+    "api.get_characters": 2,
+    "api.get_single_character": 2,
+    "api.get_planets": 2,
+    "api.get_characters_batch": 1,
+    "api.get_planets_batch": 1,
+    "api.get_single_planet": 2,
+    "api.search_characters": 4,
+    "api.search_planets": 4,
+    "api.popular_characters": 2,
+    "api.popular_planets": 2,
+    # The user too, on the first request of a token per worker and TTL
+    "api.user_favorite": 3,
+    "api.get_changes": 8,
+    # Writes include the change log insert, and its lock on Postgres
+    "api.add_new_fav_character": 9,
+    "api.add_new_fav_planet": 9,
+    "api.delete_character": 8,
+    "api.delete_planet": 8,
+}
+DEFAULT_BUDGET = 10
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def budget_for(endpoint):
+    budgets = current_app.config["QUERY_BUDGETS"]
+    return budgets.get(endpoint, current_app.config["QUERY_BUDGET_DEFAULT"])
+
+
+def raise_over_budget():
+    value = current_app.config["QUERY_BUDGET_RAISE"]
+    return current_app.testing if value is None else value
+
+
+def over_budget_message(endpoint, budget, statements):
+    lines = "\n".join(f"  {i + 1}. {sql}" for i, sql in enumerate(statements))
+    return (f"{request.method} {request.path} ({endpoint}) ran {len(statements)} "
+            f"queries, budget is {budget}:\n{lines}")
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if not has_request_context() or "sql_queries" not in g:
+        return
+    if "query_budget_statements" in g:
+        g.query_budget_statements.append(statement)
+        if raise_over_budget():
+            endpoint = request.endpoint
+            budget = budget_for(endpoint)
+            if len(g.query_budget_statements) > budget:
+                raise QueryBudgetExceeded(over_budget_message(endpoint, budget, g.query_budget_statements))
+    # After the check, a statement stopped there never reaches after_cursor_execute
+    g.sql_queries += 1
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and "sql_duration" in g and conn.info.get("query_start"):
+        g.sql_duration += time.perf_counter() - conn.info["query_start"].pop()
+
+
+@contextmanager
+def unbudgeted():
+    # For work done on behalf of other requests too, like a group commit batch.
+    # It still shows in the metrics.
+    statements = g.pop("query_budget_statements", None) if has_request_context() else None
+    try:
+        yield
+    finally:
+        if statements is not None:
+            g.query_budget_statements = statements
+
+
+def setup_query_budget(app):
+    app.config.setdefault("QUERY_BUDGETS", dict(DEFAULT_BUDGETS))
+    app.config.setdefault("QUERY_BUDGET_DEFAULT", DEFAULT_BUDGET)
+    app.config.setdefault("QUERY_BUDGET_RAISE", None)
+
+    @app.before_request
+    def start_query_budget():
+        g.query_budget_statements = []
+        g.sql_queries = 0
+        g.sql_duration = 0.0
+
+    @app.after_request
+    def check_query_budget(response):
+        statements = g.pop("query_budget_statements", None)
+        if statements is None or request.endpoint is None:
+            return response
+        budget = budget_for(request.endpoint)
+        if len(statements) > budget:
+            app.logger.warning(over_budget_message(request.endpoint, budget, statements))
+        return response
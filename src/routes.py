@@ -0,0 +1,304 @@
+"""
+API endpoints, registered on the app by create_app()
+
+Every read route takes ?fields=id,name to send only some of the fields, and
+only those columns are selected.
+"""
+from flask import Blueprint, request, jsonify
+from flask_jwt_extended import create_access_token
+from flask_jwt_extended import current_user
+from flask_jwt_extended import jwt_required
+from utils import paginate, wants_stream, stream_ndjson, conditional, get_search_args, get_int_arg, get_fields
+from utils import get_ids, read_only, negotiated
+from search import search_names
+from serializers import json_response, fetch_one, fetch_many
+from group_commit import add_favorite, remove_favorite
+from compression import cache_compressed
+from changes import changes_since, head
+from models import User, Character, Planet, FavoriteCharacter, FavoritePlanet
+from models import CharacterPopularity, PlanetPopularity
+
+api = Blueprint('api', __name__)
+
+DEFAULT_POPULAR_LIMIT = 10
+MAX_POPULAR_LIMIT = 100
+MAX_BATCH_IDS = 200
+DEFAULT_CHANGES_LIMIT = 500
+MAX_CHANGES_LIMIT = 5000
+
+def batch_response(model, fields):
+    items, missing = fetch_many(model, get_ids(MAX_BATCH_IDS), fields)
+    return json_response({"msg": "Ok", "result": items, "missing": missing}), 200
+
+#Listar los usuarios del blog, paginados con ?limit=&after=<id>
+#o exportados completos como NDJSON con ?stream=1 o Accept: application/x-ndjson
+@api.route('/users', methods=['GET'])
+@negotiated
+def get_users():
+
+    fields = get_fields(User.serialize_fields)
+    if wants_stream():
+        return stream_ndjson(User.query, User, fields)
+
+    users, next_cursor = paginate(User.query, User, fields)
+
+    response_body = {
+        "msg": "Ok", "result" : users, "next" : next_cursor
+    }
+
+    return json_response(response_body), 200
+
+#Listar los registros de people en la base de datos, paginados con ?limit=&after=<id>
+#o exportados completos como NDJSON con ?stream=1 o Accept: application/x-ndjson.
+#Con ?ids=1,2,3 devuelve solo esos, en ese orden, y los que no existen en "missing"
+@api.route('/people', methods=['GET'])
+@negotiated
+@conditional('character', streams=True)
+@cache_compressed
+def get_characters():
+
+    fields = get_fields(Character.serialize_fields)
+    if "ids" in request.args:
+        return batch_response(Character, fields)
+    if wants_stream():
+        return stream_ndjson(Character.query, Character, fields)
+
+    characters, next_cursor = paginate(Character.query, Character, fields)
+
+    response_body = {
+        "msg" : "Ok",
+        "result" : characters,
+        "next" : next_cursor
+    }
+
+    return json_response(response_body), 200
+
+#Igual que /people?ids= con la lista en el body, {"ids": [1, 2, 3]}, para listas largas
+@api.route('/people/batch', methods=['POST'])
+@read_only
+def get_characters_batch():
+
+    return batch_response(Character, get_fields(Character.serialize_fields))
+
+#Busca personajes por nombre (prefijo o substring) con ?q=&limit=&offset=
+@api.route('/people/search', methods=['GET'])
+@conditional('character')
+def search_characters():
+
+    q, limit, offset = get_search_args()
+    fields = get_fields(Character.serialize_fields)
+    characters = search_names(Character, q, limit + 1, offset, fields)
+
+    next_offset = None
+    if len(characters) > limit:
+        characters = characters[:limit]
+        next_offset = offset + limit
+
+    return json_response({
+        "msg" : "Ok",
+        "result" : characters,
+        "next" : next_offset
+    }), 200
+
+#Los personajes con más favoritos, ?limit= (10 por defecto, máximo 100)
+@api.route('/people/popular', methods=['GET'])
+@conditional('character_popularity', 'character')
+@cache_compressed
+def popular_characters():
+
+    limit = get_int_arg("limit", DEFAULT_POPULAR_LIMIT, minimum=1, maximum=MAX_POPULAR_LIMIT)
+    fields = get_fields(Character.serialize_fields + ("favorites",))
+    return json_response({
+        "msg" : "Ok",
+        "result" : CharacterPopularity.top(limit, fields)
+    }), 200
+
+#Muestra la información de un solo personaje según su id.
+@api.route('/people/<int:people_id>', methods=['GET'])
+@conditional('character')
+def get_single_character(people_id):
+
+    single_character = fetch_one(Character, people_id, get_fields(Character.serialize_fields))
+    if single_character:
+        return json_response({
+            "msg" : "Ok",
+            "character" : single_character
+        }), 200
+    else: return jsonify({'msg': 'Character not found'}), 404
+
+#Listar los registros de planets en la base de datos, paginados con ?limit=&after=<id>
+#o exportados completos como NDJSON con ?stream=1 o Accept: application/x-ndjson.
+#Con ?ids=1,2,3 devuelve solo esos, en ese orden, y los que no existen en "missing"
+@api.route('/planets', methods=['GET'])
+@negotiated
+@conditional('planet', streams=True)
+@cache_compressed
+def get_planets():
+
+    fields = get_fields(Planet.serialize_fields)
+    if "ids" in request.args:
+        return batch_response(Planet, fields)
+    if wants_stream():
+        return stream_ndjson(Planet.query, Planet, fields)
+
+    planets, next_cursor = paginate(Planet.query, Planet, fields)
+
+    response_body = {
+        "msg" : "Ok",
+        "result" : planets,
+        "next" : next_cursor
+    }
+
+    return json_response(response_body), 200
+
+#Igual que /planets?ids= con la lista en el body, {"ids": [1, 2, 3]}, para listas largas
+@api.route('/planets/batch', methods=['POST'])
+@read_only
+def get_planets_batch():
+
+    return batch_response(Planet, get_fields(Planet.serialize_fields))
+
+#Busca planetas por nombre (prefijo o substring) con ?q=&limit=&offset=
+@api.route('/planets/search', methods=['GET'])
+@conditional('planet')
+def search_planets():
+
+    q, limit, offset = get_search_args()
+    fields = get_fields(Planet.serialize_fields)
+    planets = search_names(Planet, q, limit + 1, offset, fields)
+
+    next_offset = None
+    if len(planets) > limit:
+        planets = planets[:limit]
+        next_offset = offset + limit
+
+    return json_response({
+        "msg" : "Ok",
+        "result" : planets,
+        "next" : next_offset
+    }), 200
+
+#Los planetas con más favoritos, ?limit= (10 por defecto, máximo 100)
+@api.route('/planets/popular', methods=['GET'])
+@conditional('planet_popularity', 'planet')
+@cache_compressed
+def popular_planets():
+
+    limit = get_int_arg("limit", DEFAULT_POPULAR_LIMIT, minimum=1, maximum=MAX_POPULAR_LIMIT)
+    fields = get_fields(Planet.serialize_fields + ("favorites",))
+    return json_response({
+        "msg" : "Ok",
+        "result" : PlanetPopularity.top(limit, fields)
+    }), 200
+
+#Muestra la información de un solo planeta según su id.
+@api.route('/planets/<int:planet_id>', methods=['GET'])
+@conditional('planet')
+def get_single_planet(planet_id):
+
+    single_planet = fetch_one(Planet, planet_id, get_fields(Planet.serialize_fields))
+    if single_planet:
+        return json_response({
+            "msg" : "Ok",
+            "character" : single_planet
+        }), 200
+    else: return jsonify({'msg': 'Planet not found'}), 404
+
+
+#Listar todos los favoritos que pertenecen al usuario logueado, con sus nombres.
+@api.route('/users/favorites', methods=['GET'])
+@jwt_required()
+@conditional('favorite_character', 'favorite_planet', 'character', 'planet')
+def user_favorite():
+
+    response = json_response({
+        "msg" : "Ok",
+        "result" : current_user.favorites(get_fields(User.favorite_fields))
+    })
+    # The same url answers differently for each user
+    response.vary.add("Authorization")
+    return response, 200
+
+
+#Añade un nuevo people favorito al usuario logueado con el id = people_id.
+#Si ya estaba en favoritos no se duplica.
+@api.route('/favorite/people/<int:people_id>', methods=['POST'])
+@jwt_required()
+def add_new_fav_character(people_id):
+
+    user = current_user
+
+    character = Character.query.get(people_id)
+    if character:
+        add_favorite(FavoriteCharacter, user.id, people_id)
+        return jsonify({'msg': 'Character added successfully'}), 200
+    else: return jsonify({'msg': 'Character not found'}), 404
+
+
+#Añade un nuevo planet favorito al usuario logueado con el id = planet_id.
+#Si ya estaba en favoritos no se duplica.
+@api.route('/favorite/planet/<int:planet_id>', methods=['POST'])
+@jwt_required()
+def add_new_fav_planet(planet_id):
+
+    user = current_user
+
+    planet = Planet.query.get(planet_id)
+    if planet:
+        add_favorite(FavoritePlanet, user.id, planet_id)
+        return jsonify({'msg': 'Planet added successfully'}), 200
+    else: return jsonify({'msg': 'Planet not found'}), 404
+
+#Elimina un planet favorito del usuario logueado con el id = planet_id
+@api.route('/favorite/planet/<int:planet_id>', methods=['DELETE'])
+@jwt_required()
+def delete_planet(planet_id):
+
+    user = current_user
+
+    if remove_favorite(FavoritePlanet, user.id, planet_id):
+        return jsonify({"msg": f"Planet {planet_id} deleted"}),200
+    else: return jsonify({'msg': 'Planet not found'}), 404
+
+#Elimina un people favorito del usuario logueado con el id = people_id
+@api.route('/favorite/people/<int:people_id>', methods=['DELETE'])
+@jwt_required()
+def delete_character(people_id):
+
+    user = current_user
+
+    if remove_favorite(FavoriteCharacter, user.id, people_id):
+        return jsonify({"msg": f"Character {people_id} deleted"}),200
+    else: return jsonify({'msg': 'Character not found'}), 404
+
+#Cambios en people, planets y los favoritos del usuario logueado desde ?since=<seq>,
+#de a ?limit= entradas. Sin since devuelve solo el seq actual, ver changes.py.
+@api.route('/changes', methods=['GET'])
+@jwt_required(optional=True)
+def get_changes():
+
+    since = get_int_arg("since", minimum=0)
+    if since is None:
+        response = json_response({"msg": "Ok", "changes": [], "next": head(), "more": False})
+    else:
+        limit = get_int_arg("limit", DEFAULT_CHANGES_LIMIT, minimum=1, maximum=MAX_CHANGES_LIMIT)
+        # Loaded by the decorator when there is a token, a bad one is a 401
+        result = changes_since(since, limit, current_user.id if current_user else None)
+        response = json_response({"msg": "Ok", **result})
+    response.vary.add("Authorization")
+    return response, 200
+
+# Create a route to authenticate your users and return JWTs. The
+# create_access_token() function is used to actually generate the JWT.
+@api.route("/login", methods=["POST"])
+def login():
+    email = request.json.get("email", None)
+    password = request.json.get("password", None)
+
+    user = User.query.filter_by(email=email).first()
+    if user is None or not isinstance(password, str) or not user.check_password(password):
+        return jsonify({"msg": "Bad email or password"}), 401
+
+    # The subject is the user id, auth.py turns it back into current_user
+    access_token = create_access_token(identity=str(user.id))
+    return jsonify(access_token=access_token)
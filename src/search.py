@@ -0,0 +1,117 @@
+"""
+Name search for characters and planets.
+
+On SQLite the names are indexed in an FTS5 table with the trigram tokenizer
+(<table>_fts, kept in sync by triggers), on Postgres in a pg_trgm GIN index.
+Both answer substring queries of 3 or more characters without scanning the
+table. Shorter queries can only be prefixes and use an index on lower(name):
+ix_<table>_name_lower on SQLite, ix_<table>_name_lower_c (in the "C"
+collation) on Postgres. The search indexes are created by the migrations,
+ensure_search_index() builds the SQLite one for databases made with
+db.create_all().
+
+Results are ranked: names that start with the query first, in name order,
+then the names that contain it, by id.
+"""
+from sqlalchemy import and_, column, func, literal, literal_column, select, table, text
+from models import db
+
+MIN_SUBSTRING_LENGTH = 3
+# Upper bound of the prefix range on SQLite
+MAX_CODE_POINT = 0x10FFFF
+
+# (database url, table) -> whether the FTS5 table exists
+_fts_tables = {}
+
+
+def fts_table(table):
+    return f"{table}_fts"
+
+
+def ensure_search_index(connection, table):
+    if connection.dialect.name != "sqlite":
+        return
+    fts = fts_table(table)
+    connection.exec_driver_sql(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+        f"name, content='{table}', content_rowid='id', tokenize='trigram')"
+    )
+    connection.exec_driver_sql(
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN "
+        f"INSERT INTO {fts}(rowid, name) VALUES (new.id, new.name); END"
+    )
+    connection.exec_driver_sql(
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, name) VALUES ('delete', old.id, old.name); END"
+    )
+    connection.exec_driver_sql(
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, name) VALUES ('delete', old.id, old.name); "
+        f"INSERT INTO {fts}(rowid, name) VALUES (new.id, new.name); END"
+    )
+    connection.exec_driver_sql(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+def has_fts(table):
+    connection = db.session.connection()
+    key = (str(connection.engine.url), table)
+    if key not in _fts_tables:
+        _fts_tables[key] = connection.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+            {"name": fts_table(table)},
+        ).first() is not None
+    return _fts_tables[key]
+
+
+def escape_like(value):
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def name_key(column, dialect):
+    # Byte order on both databases, so the index gives the prefix matches in
+    # order whatever the Postgres database's collation is
+    key = func.lower(column)
+    return key.collate("C") if dialect == "postgresql" else key
+
+
+def name_prefix(column, q, dialect):
+    # lower(name) starts with lower(q). The database folds both sides, so
+    # they agree on case: ASCII only in SQLite, Unicode in Postgres.
+    key = name_key(column, dialect)
+    if dialect == "postgresql":
+        return key.like(func.lower(literal(escape_like(q))).concat("%"), escape="\\")
+    # SQLite only uses an expression index for a range, not for LIKE. Its
+    # BINARY collation compares code points, so this is the prefix match.
+    low = func.lower(literal(q))
+    return and_(key >= low, key < low.concat(func.char(MAX_CODE_POINT)))
+
+
+def search_names(model, q, limit, offset, fields=None):
+    # Only offset + limit rows are ever read: prefix matches come in index
+    # order, and substring matches are only looked up when there aren't
+    # enough prefix matches to fill the page.
+    t = model.__table__
+    fields = fields or model.serialize_fields
+    columns = [t.c[field] for field in fields]
+    window = offset + limit
+    dialect = db.session.get_bind().dialect.name
+    prefix = name_prefix(t.c.name, q, dialect)
+
+    rows = db.session.execute(
+        select(*columns).where(prefix).order_by(name_key(t.c.name, dialect), t.c.id).limit(window)
+    ).all()
+
+    if len(rows) < window and len(q) >= MIN_SUBSTRING_LENGTH:
+        if dialect == "sqlite" and has_fts(t.name):
+            fts = table(fts_table(t.name), column("rowid"))
+            match = literal_column(fts.name).op("MATCH")('"' + q.replace('"', '""') + '"')
+            query = (select(*columns).select_from(fts.join(t, t.c.id == fts.c.rowid))
+                     .where(match, ~prefix).order_by(fts.c.rowid))
+        else:
+            # ILIKE '%q%' goes through the pg_trgm GIN index on Postgres
+            contains = "%" + escape_like(q) + "%"
+            like = t.c.name.ilike if dialect == "postgresql" else t.c.name.like
+            query = select(*columns).where(like(contains, escape="\\"), ~prefix).order_by(t.c.id)
+        rows += db.session.execute(query.limit(window - len(rows))).all()
+
+    return [dict(zip(fields, row)) for row in rows[offset:window]]
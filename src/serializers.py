@@ -0,0 +1,53 @@
+"""
+Fast read path: instead of loading full ORM objects and calling serialize()
+on each one, select only the columns in the model's serialize_fields and
+encode the rows straight to JSON bytes with orjson. Nothing goes through
+the identity map or the unit of work, which read-only endpoints don't need.
+"""
+import orjson
+from flask import Response
+from sqlalchemy import select
+from models import db
+
+
+def dumps(obj):
+    return orjson.dumps(obj)
+
+
+def json_response(body, status=200):
+    return Response(orjson.dumps(body), status=status, mimetype="application/json")
+
+
+def rows_as_dicts(model, rows, fields=None):
+    fields = fields or model.serialize_fields
+    return [dict(zip(fields, row)) for row in rows]
+
+
+def project(query, model, fields=None):
+    # Turns a Model.query into a query that returns plain rows of the serialized
+    # columns, or only of `fields` (see get_fields() in utils.py)
+    return query.with_entities(*model.serialize_columns(fields))
+
+
+def fetch_many(model, ids, fields=None):
+    # One IN query, returns the rows in the order of `ids` and the ids that
+    # don't exist
+    fields = fields or model.serialize_fields
+    columns = model.serialize_columns(fields)
+    key = fields.index("id") if "id" in fields else len(columns)
+    if key == len(columns):
+        columns.append(model.id)
+    found = {
+        row[key]: dict(zip(fields, row))
+        for row in db.session.execute(select(*columns).where(model.id.in_(ids)))
+    }
+    return [found[id] for id in ids if id in found], [id for id in ids if id not in found]
+
+
+def fetch_one(model, id, fields=None):
+    row = db.session.execute(
+        select(*model.serialize_columns(fields)).where(model.id == id)
+    ).first()
+    if row is None:
+        return None
+    return dict(zip(fields or model.serialize_fields, row))
@@ -1,4 +1,16 @@
-from flask import jsonify, url_for
+from functools import wraps
+from flask import jsonify, url_for, request, Response, stream_with_context, make_response, g
+from models import TableVersion
+from serializers import dumps, project, rows_as_dicts
+
+# Page sizes for the list endpoints, MAX_PAGE_SIZE is enforced by the server
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+# Rows fetched from the database cursor at a time when streaming a full export
+STREAM_BATCH_SIZE = 1000
+# Search results are ranked, so they are paged by offset up to a limit
+DEFAULT_SEARCH_PAGE_SIZE = 20
+MAX_SEARCH_OFFSET = 1000
 
 class APIException(Exception):
     status_code = 400
@@ -15,13 +27,159 @@ class APIException(Exception):
         rv['message'] = self.message
         return rv
 
+def get_int_arg(name, default=None, minimum=None, maximum=None):
+    value = request.args.get(name)
+    if value is None or value == "":
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        raise APIException(f"'{name}' must be an integer", status_code=400)
+    if minimum is not None and value < minimum:
+        raise APIException(f"'{name}' must be >= {minimum}", status_code=400)
+    if maximum is not None and value > maximum:
+        value = maximum
+    return value
+
+def get_ids(maximum):
+    # ?ids=1,2,3, or {"ids": [1, 2, 3]} in the body of a POST for long lists.
+    # In the client's order, repeats dropped.
+    if request.method == "POST":
+        body = request.get_json(silent=True)
+        values = body.get("ids") if isinstance(body, dict) else None
+        if not isinstance(values, list):
+            raise APIException("The body must be {\"ids\": [...]}", status_code=400)
+    else:
+        values = [value for value in request.args.get("ids", "").split(",") if value.strip()]
+    try:
+        ids = list(dict.fromkeys(int(value) for value in values))
+    except (TypeError, ValueError):
+        raise APIException("'ids' must be integers", status_code=400)
+    if not ids:
+        raise APIException("'ids' is empty", status_code=400)
+    if len(ids) > maximum:
+        raise APIException(f"At most {maximum} ids per request", status_code=400)
+    return ids
+
+def get_fields(allowed):
+    # ?fields=id,name picks which of the `allowed` fields go in the response,
+    # in the order of `allowed`. Without it every field is sent.
+    value = request.args.get("fields") or ""
+    requested = {field.strip() for field in value.split(",") if field.strip()}
+    if not requested:
+        return tuple(allowed)
+    unknown = requested.difference(allowed)
+    if unknown:
+        raise APIException(f"Unknown fields: {', '.join(sorted(unknown))}. "
+                           f"Available: {', '.join(allowed)}", status_code=400)
+    return tuple(field for field in allowed if field in requested)
+
+def paginate(query, model, fields=None):
+    # Keyset pagination on the primary key: "WHERE id > after ORDER BY id LIMIT n"
+    # walks the index, so every page costs the same no matter how deep it is.
+    limit = get_int_arg("limit", DEFAULT_PAGE_SIZE, minimum=1, maximum=MAX_PAGE_SIZE)
+    after = get_int_arg("after", None, minimum=0)
+    fields = fields or model.serialize_fields
+    # The id is always read, the next cursor comes from it
+    columns = fields if "id" in fields else fields + ("id",)
+
+    if after is not None:
+        query = query.filter(model.id > after)
+    # Ask for one extra row to know if there is a next page without a COUNT(*)
+    rows = project(query, model, columns).order_by(model.id).limit(limit + 1).all()
+    items = rows_as_dicts(model, rows, columns)
+
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = items[-1]["id"]
+    if columns is not fields:
+        for item in items:
+            del item["id"]
+    return items, next_cursor
+
+def get_search_args():
+    q = (request.args.get("q") or "").strip()
+    if not q:
+        raise APIException("'q' is required", status_code=400)
+    limit = get_int_arg("limit", DEFAULT_SEARCH_PAGE_SIZE, minimum=1, maximum=MAX_PAGE_SIZE)
+    offset = get_int_arg("offset", 0, minimum=0)
+    if offset > MAX_SEARCH_OFFSET:
+        raise APIException(f"'offset' must be <= {MAX_SEARCH_OFFSET}, refine the search instead", status_code=400)
+    return q, limit, offset
+
+def wants_stream():
+    if request.args.get("stream") in ("1", "true"):
+        return True
+    return request.accept_mimetypes.best == "application/x-ndjson"
+
+def negotiated(fn):
+    # The same url answers a JSON page or the NDJSON export depending on
+    # Accept (wants_stream()), caches have to keep them apart
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        response = make_response(fn(*args, **kwargs))
+        response.vary.add("Accept")
+        return response
+    return wrapper
+
+def stream_ndjson(query, model, fields=None):
+    # Sends one JSON document per line while rows are read from the cursor,
+    # so the first byte goes out right away and memory stays flat.
+    fields = fields or model.serialize_fields
+
+    def generate():
+        for row in project(query, model, fields).order_by(model.id).yield_per(STREAM_BATCH_SIZE):
+            yield dumps(dict(zip(fields, row))) + b"\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+def etag_for(*tables):
+    # Strong ETag made from the version counters of the tables a route reads
+    versions = TableVersion.current(tables)
+    return "-".join(f"{name}.{version}" for name, version in versions)
+
+def conditional(*tables, streams=False):
+    # Answers 304 before the handler runs when the client already has the
+    # current version, skipping the query and the serialization. With
+    # streams=True the route also sends the NDJSON export, which gets a tag
+    # of its own: a strong ETag names one representation.
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            etag = etag_for(*tables)
+            if streams and wants_stream():
+                etag += ";ndjson"
+            g.etag = etag
+            # Weak comparison, compressed responses carry the ETag as W/"..."
+            if request.if_none_match.contains_weak(etag):
+                response = make_response("", 304)
+                response.set_etag(etag)
+                return response
+
+            response = make_response(fn(*args, **kwargs))
+            if response.status_code == 200:
+                response.set_etag(etag)
+            return response
+        # Lets admission.py tell these cheap reads apart
+        wrapper.conditional_tables = tables
+        return wrapper
+    return decorator
+
+def read_only(fn):
+    # A POST that only reads (ids in the body): admission.py charges it as a
+    # read and db_routing.py sends it to a replica
+    fn.read_only = True
+    return fn
+
 def has_no_empty_params(rule):
     defaults = rule.defaults if rule.defaults is not None else ()
     arguments = rule.arguments if rule.arguments is not None else ()
     return len(defaults) >= len(arguments)
 
 def generate_sitemap(app):
-    links = ['/admin/']
+    # Without ENABLE_ADMIN the admin views are never registered
+    links = ['/admin/'] if app.config["ENABLE_ADMIN"] else []
     for rule in app.url_map.iter_rules():
         # Filter out rules we can't navigate to in a browser
         # and rules that require parameters
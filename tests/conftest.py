@@ -0,0 +1,76 @@
+import os
+import sys
+
+import pytest
+from flask import g
+from flask_jwt_extended import create_access_token
+from werkzeug.security import generate_password_hash
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from app import create_app  # noqa: E402
+from auth import user_cache, load_user  # noqa: E402
+from compression import compressed_cache  # noqa: E402
+from models import db, User, Character, Planet, FavoriteCharacter, FavoritePlanet  # noqa: E402
+from search import ensure_search_index  # noqa: E402
+
+PASSWORD = "test"
+# Hashed once, scrypt takes a tenth of a second
+PASSWORD_HASH = generate_password_hash(PASSWORD)
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app({
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'test.db'}",
+        "ENABLE_ADMIN": False,
+        "ENABLE_MIGRATE": False,
+        "ENABLE_SWAGGER": False,
+        "JWT_SECRET_KEY": "a-test-key-long-enough-for-hs256!",
+    })
+    app.testing = True
+    with app.app_context():
+        db.create_all()
+        for table in ("character", "planet"):
+            ensure_search_index(db.session.connection(), table)
+        db.session.add_all([User(username=f"user{i}", email=f"user{i}@example.com", password=PASSWORD_HASH,
+                                 is_active=True) for i in (1, 2)])
+        db.session.add_all([Character(name=f"Luke {i}") for i in range(1, 11)])
+        db.session.add_all([Planet(name=f"Tatooine {i}") for i in range(1, 11)])
+        db.session.flush()
+        db.session.add_all([FavoriteCharacter(user_id=1, character_id=1), FavoritePlanet(user_id=1, planet_id=1)])
+        db.session.commit()
+    # Module level, they would carry rows over from the previous test's database
+    user_cache.clear()
+    compressed_cache.clear()
+    yield app
+    with app.app_context():
+        db.engine.dispose()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def query_counts(app):
+    """Statements counted by the query budget, one entry per request."""
+    counts = []
+
+    # Registered after setup_query_budget(), so it runs before its hook pops them
+    @app.after_request
+    def record_query_count(response):
+        counts.append(len(g.get("query_budget_statements", ())))
+        return response
+
+    return counts
+
+
+@pytest.fixture
+def auth_headers(app):
+    with app.app_context():
+        token = create_access_token(identity="1")
+        # Like any client past its first request, the user comes from the cache
+        load_user("1")
+    return {"Authorization": "Bearer " + token}
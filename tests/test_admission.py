@@ -0,0 +1,81 @@
+"""
+The concurrency cap of admission.py with ADMISSION_DB set: the slots taken
+by every worker count against it, not only this process's.
+"""
+import os
+import sqlite3
+import subprocess
+import sys
+
+import pytest
+from app import create_app
+from admission import SQLiteSlots
+
+SHARES = {"cached": 1.0, "read": 0.8, "write": 0.5, "admin": 0.25}
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "admission.db")
+
+
+def busy(path, pid, in_flight):
+    # Slots held by another worker
+    with sqlite3.connect(path) as connection:
+        connection.execute(SQLiteSlots.SCHEMA)
+        connection.execute("INSERT INTO slots (pid, in_flight) VALUES (?, ?)", (pid, in_flight))
+
+
+def dead_pid():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+def test_slots_of_the_other_workers_count(path):
+    slots = SQLiteSlots(path, 4, SHARES)
+    busy(path, os.getppid(), 3)
+    assert slots.acquire("cached")
+    assert not slots.acquire("cached")
+    slots.release()
+    assert slots.acquire("cached")
+
+
+def test_expensive_kinds_stop_earlier(path):
+    slots = SQLiteSlots(path, 4, SHARES)
+    busy(path, os.getppid(), 1)
+    assert slots.acquire("write")
+    assert not slots.acquire("write")
+    assert slots.acquire("cached")
+
+
+def test_prune_frees_the_slots_of_a_dead_worker(path):
+    slots = SQLiteSlots(path, 2, SHARES)
+    busy(path, dead_pid(), 2)
+    assert not slots.acquire("cached")
+    slots.prune()
+    assert slots.acquire("cached")
+
+
+def test_busy_server_answers_503(tmp_path, path):
+    app = create_app({
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'test.db'}",
+        "ENABLE_ADMIN": False,
+        "ENABLE_MIGRATE": False,
+        "ENABLE_SWAGGER": False,
+        "ADMISSION_CONTROL": True,
+        "ADMISSION_DB": path,
+        "ADMISSION_MAX_CONCURRENCY": 1,
+    })
+    client = app.test_client()
+    assert client.get("/").status_code == 200
+
+    busy(path, os.getppid(), 1)
+    response = client.get("/")
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+
+    # The first request gave its slot back
+    with sqlite3.connect(path) as connection:
+        connection.execute("DELETE FROM slots WHERE pid = ?", (os.getppid(),))
+    assert client.get("/").status_code == 200
@@ -0,0 +1,34 @@
+"""
+Passwords are stored as werkzeug hashes and checked against them on /login.
+"""
+import pytest
+from models import db, User
+from conftest import PASSWORD
+
+
+def test_login_checks_the_hash(client):
+    response = client.post("/login", json={"email": "user1@example.com", "password": PASSWORD})
+    assert response.status_code == 200
+    assert response.get_json()["access_token"]
+
+
+@pytest.mark.parametrize("body", [
+    {"email": "user1@example.com", "password": "wrong"},
+    {"email": "user1@example.com"},
+    {"email": "nobody@example.com", "password": PASSWORD},
+])
+def test_bad_credentials(client, body):
+    assert client.post("/login", json=body).status_code == 401
+
+
+def test_the_stored_hash_does_not_log_in(app, client):
+    with app.app_context():
+        stored = db.session.get(User, 1).password
+    assert client.post("/login", json={"email": "user1@example.com", "password": stored}).status_code == 401
+
+
+def test_plain_passwords_are_hashed_on_the_way_in(app):
+    with app.app_context():
+        user = User(username="user3", email="user3@example.com", password="secret", is_active=True)
+        assert user.password != "secret"
+        assert user.check_password("secret")
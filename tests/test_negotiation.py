@@ -0,0 +1,38 @@
+"""
+/people and /planets answer a JSON page or the NDJSON export at the same
+url, depending on Accept. Neither the compressed body cache nor the ETags
+may hand one out for the other.
+"""
+import gzip
+
+NDJSON = {"Accept": "application/x-ndjson", "Accept-Encoding": "gzip"}
+
+
+def test_cached_page_is_not_served_for_the_export(client):
+    page = client.get("/people", headers={"Accept-Encoding": "gzip"})
+    assert page.mimetype == "application/json"
+
+    export = client.get("/people", headers=NDJSON)
+    assert export.mimetype == "application/x-ndjson"
+    body = export.get_data()
+    if export.content_encoding == "gzip":
+        body = gzip.decompress(body)
+    assert len(body.splitlines()) == 10
+
+
+def test_list_responses_vary_on_accept(client):
+    for path in ("/users", "/people", "/planets", "/people?stream=1"):
+        assert "Accept" in client.get(path).vary
+
+
+def test_page_and_export_have_different_etags(client):
+    page = client.get("/people")
+    export = client.get("/people", headers={"Accept": "application/x-ndjson"})
+    assert page.get_etag()[0] != export.get_etag()[0]
+
+    # The page's tag doesn't make the export a 304, and the other way round
+    assert client.get("/people?stream=1", headers={"If-None-Match": page.headers["ETag"]}).status_code == 200
+    assert client.get("/people", headers={"If-None-Match": export.headers["ETag"]}).status_code == 200
+    again = client.get("/people?stream=1", headers={"If-None-Match": export.headers["ETag"]})
+    assert again.status_code == 304
+    assert "Accept" in again.vary
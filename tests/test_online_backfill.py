@@ -0,0 +1,130 @@
+"""
+backfill() from migrations/online.py stopped partway and run again: every
+row ends up right and the statement touched each one exactly once, whether
+the first run raised between a range's UPDATE and its checkpoint or was
+killed with SIGKILL.
+"""
+import multiprocessing
+import os
+import signal
+import sys
+import time
+
+import pytest
+import sqlalchemy as sa
+from models import db
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "migrations"))
+import online  # noqa: E402
+
+ROWS = 3000
+BATCH_SIZE = 50
+CHECKPOINT = "backfill:scratch:double"
+# `touches` counts how many times the statement ran on each row
+STATEMENT = "UPDATE scratch SET doubled = value * 2, touches = touches + 1 WHERE id > :low AND id <= :high"
+
+
+class Killed(Exception):
+    pass
+
+
+@pytest.fixture
+def engine(app):
+    with app.app_context():
+        engine = db.engine
+        with engine.begin() as connection:
+            connection.execute(sa.text("CREATE TABLE scratch (id INTEGER PRIMARY KEY, value INTEGER NOT NULL, "
+                                       "doubled INTEGER, touches INTEGER NOT NULL DEFAULT 0)"))
+            # Gaps in the keys, like a table with deleted rows
+            connection.execute(sa.text("INSERT INTO scratch (id, value) VALUES (:id, :value)"),
+                               [{"id": i, "value": i % 97} for i in range(1, ROWS + 1) if i % 7])
+        yield engine
+
+
+def run(engine):
+    return online.backfill("double", "scratch", STATEMENT, BATCH_SIZE, 0, bind=engine)
+
+
+def checkpoint(engine):
+    with engine.connect() as connection:
+        return connection.execute(sa.text("SELECT position, total, finished_at FROM checkpoint WHERE name = :name"),
+                                  {"name": CHECKPOINT}).one()
+
+
+def touches(engine):
+    with engine.connect() as connection:
+        return dict(connection.execute(sa.text("SELECT touches, count(*) FROM scratch GROUP BY touches")).all())
+
+
+def assert_done_once(engine):
+    with engine.connect() as connection:
+        wrong = connection.execute(sa.text(
+            "SELECT count(*) FROM scratch WHERE doubled IS NULL OR doubled != value * 2")).scalar()
+        rows = connection.execute(sa.text("SELECT count(*) FROM scratch")).scalar()
+    assert wrong == 0
+    assert touches(engine) == {1: rows}
+    assert checkpoint(engine).finished_at is not None
+
+
+def rows_after(engine, position):
+    with engine.connect() as connection:
+        return connection.execute(sa.text("SELECT count(*) FROM scratch WHERE id > :position"),
+                                  {"position": position}).scalar()
+
+
+def test_resumes_after_dying_between_update_and_checkpoint(engine):
+    # The range's UPDATE has run but its checkpoint never gets written
+    def die(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith("UPDATE checkpoint") and 1500 in parameters:
+            raise Killed()
+
+    sa.event.listen(engine, "before_cursor_execute", die)
+    try:
+        with pytest.raises(Killed):
+            run(engine)
+    finally:
+        sa.event.remove(engine, "before_cursor_execute", die)
+
+    position = checkpoint(engine).position
+    assert position == 1500 - BATCH_SIZE
+    # The range that died rolled back with its checkpoint
+    left = rows_after(engine, position)
+    assert touches(engine) == {1: rows_after(engine, 0) - left, 0: left}
+
+    assert run(engine) == left
+    assert_done_once(engine)
+
+
+def test_resumes_after_sigkill(engine):
+    def child():
+        # The parent's pooled connections stay with the parent
+        engine.dispose(close=False)
+        online.backfill("double", "scratch", STATEMENT, BATCH_SIZE, 0.005, bind=engine)
+
+    process = multiprocessing.get_context("fork").Process(target=child)
+    process.start()
+    try:
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            with engine.connect() as connection:
+                position = connection.execute(sa.text("SELECT position FROM checkpoint WHERE name = :name"),
+                                              {"name": CHECKPOINT}).scalar()
+            if position is not None and position >= ROWS * 0.4:
+                break
+            time.sleep(0.01)
+        os.kill(process.pid, signal.SIGKILL)
+    finally:
+        process.join()
+    assert process.exitcode == -signal.SIGKILL
+
+    position, total, finished_at = checkpoint(engine)
+    assert finished_at is None and 0 < position < total
+    left = rows_after(engine, position)
+    assert run(engine) == left
+    assert_done_once(engine)
+
+
+def test_finished_backfill_does_nothing(engine):
+    run(engine)
+    assert run(engine) == 0
+    assert_done_once(engine)
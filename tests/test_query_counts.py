@@ -0,0 +1,114 @@
+"""
+Exact number of SQL statements each endpoint runs, on SQLite. A change that
+adds one (a lazy load in a serializer, an N+1 over the favorites) fails here
+even while it stays under its budget in src/query_budget.py. The budgets
+leave room for what only Postgres runs, like the change log lock.
+"""
+import pytest
+from flask import g, request
+from auth import user_cache
+from query_budget import DEFAULT_BUDGETS, QueryBudgetExceeded
+
+LOGIN = {"email": "user1@example.com", "password": "test"}
+
+# (endpoint, method, path, json body, statements). The fixtures in
+# conftest.py seed 10 people and 10 planets, and user 1 has person 1 and
+# planet 1 as favorites.
+CASES = [
+    ("sitemap", "GET", "/", None, 0),
+    ("metrics", "GET", "/metrics", None, 0),
+    ("api.login", "POST", "/login", LOGIN, 1),
+    ("api.get_users", "GET", "/users", None, 1),
+    # ETag versions, then the page
+    ("api.get_characters", "GET", "/people", None, 2),
+    ("api.get_characters", "GET", "/people?ids=1,2,99", None, 2),
+    # The rows are read while the body streams, after the count is taken
+    ("api.get_characters", "GET", "/people?stream=1", None, 1),
+    ("api.get_single_character", "GET", "/people/1", None, 2),
+    ("api.get_characters_batch", "POST", "/people/batch", {"ids": [1, 2]}, 1),
+    # Versions, the prefix match, the FTS5 table lookup (once per worker)
+    # and the substring match for the rest of the page
+    ("api.search_characters", "GET", "/people/search?q=luk", None, 4),
+    ("api.popular_characters", "GET", "/people/popular", None, 2),
+    ("api.get_planets", "GET", "/planets", None, 2),
+    ("api.get_single_planet", "GET", "/planets/1", None, 2),
+    ("api.get_planets_batch", "POST", "/planets/batch", {"ids": [1, 2]}, 1),
+    ("api.search_planets", "GET", "/planets/search?q=tat", None, 4),
+    ("api.popular_planets", "GET", "/planets/popular", None, 2),
+    ("api.user_favorite", "GET", "/users/favorites", None, 2),
+    # The item, the existing favorite, the INSERT, the popularity counter,
+    # the table versions and the change log
+    ("api.add_new_fav_character", "POST", "/favorite/people/2", None, 6),
+    ("api.add_new_fav_planet", "POST", "/favorite/planet/2", None, 6),
+    # Already a favorite, nothing to write
+    ("api.add_new_fav_character", "POST", "/favorite/people/1", None, 2),
+    ("api.delete_character", "DELETE", "/favorite/people/1", None, 5),
+    ("api.delete_planet", "DELETE", "/favorite/planet/1", None, 5),
+    ("api.delete_planet", "DELETE", "/favorite/planet/2", None, 1),
+    ("api.get_changes", "GET", "/changes", None, 1),
+    # Compaction floor, head, the entries and the current rows of each of
+    # the four tables
+    ("api.get_changes", "GET", "/changes?since=0", None, 7),
+]
+
+
+@pytest.mark.parametrize("endpoint, method, path, body, expected", CASES,
+                         ids=[f"{method} {path}" for _, method, path, _, _ in CASES])
+def test_query_count(app, client, query_counts, auth_headers, endpoint, method, path, body, expected):
+    endpoints = []
+
+    @app.before_request
+    def record_endpoint():
+        endpoints.append(request.endpoint)
+
+    response = client.open(path, method=method, json=body, headers=auth_headers)
+    assert response.status_code in (200, 404)
+    assert endpoints == [endpoint]
+    assert query_counts == [expected]
+
+
+# Routes that load current_user from the token: on a cache miss (the first
+# request per user per worker, and again after USER_CACHE_TTL) one more
+USER_ENDPOINTS = {"api.user_favorite", "api.add_new_fav_character", "api.add_new_fav_planet",
+                  "api.delete_character", "api.delete_planet", "api.get_changes"}
+
+
+@pytest.mark.parametrize("endpoint, method, path, body, expected", CASES,
+                         ids=[f"{method} {path}" for _, method, path, _, _ in CASES])
+def test_query_count_with_a_cold_user_cache(app, client, query_counts, auth_headers,
+                                            endpoint, method, path, body, expected):
+    user_cache.clear()
+    # Still within the budget, or QueryBudgetExceeded is raised here
+    response = client.open(path, method=method, json=body, headers=auth_headers)
+    assert response.status_code in (200, 404)
+    assert query_counts == [expected + (endpoint in USER_ENDPOINTS)]
+
+
+def test_every_budget_is_covered():
+    assert set(DEFAULT_BUDGETS) == {endpoint for endpoint, *_ in CASES}
+
+
+def test_over_budget_raises_under_testing(app, client):
+    app.config["QUERY_BUDGETS"]["api.get_users"] = 0
+    with pytest.raises(QueryBudgetExceeded):
+        client.get("/users")
+
+
+def test_raise_follows_testing_when_the_query_runs(app, client):
+    # Left unset, QUERY_BUDGET_RAISE reads app.testing on every query, not
+    # the value it had when the app was created
+    app.config["QUERY_BUDGETS"]["api.get_users"] = 0
+    app.testing = False
+    assert client.get("/users").status_code == 200
+
+
+def test_metrics_see_the_same_statements(app, client, query_counts):
+    seen = []
+
+    @app.after_request
+    def record_sql_queries(response):
+        seen.append(g.sql_queries)
+        return response
+
+    client.get("/people")
+    assert seen == query_counts == [2]
@@ -0,0 +1,41 @@
+"""
+Name search on SQLite: prefix matches first, in name order, then the names
+that contain the query. conftest.py seeds "Luke 1" to "Luke 10".
+"""
+import pytest
+from models import db, Character
+
+
+@pytest.fixture
+def names(app):
+    with app.app_context():
+        db.session.add_all([Character(name=name) for name in
+                            ("Skywalker Luke", "Lu\U0001F600", "Lu%ke", "ÉCLAIR")])
+        db.session.commit()
+
+
+def search(client, q, **args):
+    response = client.get("/people/search", query_string={"q": q, "limit": 50, **args})
+    assert response.status_code == 200
+    return [item["name"] for item in response.get_json()["result"]]
+
+
+def test_prefix_matches_come_first_in_name_order(client, names):
+    assert search(client, "luk") == ["Luke 1", "Luke 10"] + [f"Luke {i}" for i in range(2, 10)] + ["Skywalker Luke"]
+
+
+def test_paging_goes_on_into_the_substring_matches(client, names):
+    assert search(client, "LUK", offset=9, limit=2) == ["Luke 9", "Skywalker Luke"]
+
+
+def test_prefix_covers_every_code_point(client, names):
+    assert "Lu\U0001F600" in search(client, "lu")
+
+
+def test_like_wildcards_are_plain_characters(client, names):
+    assert search(client, "lu%") == ["Lu%ke"]
+
+
+def test_the_database_folds_both_sides(client, names):
+    # SQLite's lower() leaves É alone, in the name and in the query alike
+    assert search(client, "Éc") == ["ÉCLAIR"]
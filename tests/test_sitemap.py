@@ -0,0 +1,22 @@
+"""
+The sitemap only links to what the app serves.
+"""
+from app import create_app
+
+
+def sitemap(tmp_path, enable_admin):
+    app = create_app({
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'test.db'}",
+        "ENABLE_ADMIN": enable_admin,
+        "ENABLE_MIGRATE": False,
+        "ENABLE_SWAGGER": False,
+    })
+    return app.test_client().get("/").get_data(as_text=True)
+
+
+def test_no_admin_link_without_the_admin(tmp_path):
+    assert "/admin/" not in sitemap(tmp_path, False)
+
+
+def test_admin_link_with_the_admin(tmp_path):
+    assert "href='/admin/'" in sitemap(tmp_path, True)